@@ -13,4 +13,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# Те же представления, что и под WSGI, плюс async-чтение /api/async/... и поток
+# /api/events/stock/ без потока на соединение: uvicorn config.asgi:application
 application = get_asgi_application()
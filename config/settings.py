@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -26,13 +27,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'crm.metrics.RequestMetricsMiddleware',
+    'crm.middleware.SecurityMiddleware',
+    'crm.middleware.SessionMiddleware',
+    'crm.middleware.CommonMiddleware',
+    'crm.middleware.CsrfViewMiddleware',
+    'crm.middleware.AuthenticationMiddleware',
+    'crm.middleware.MessageMiddleware',
+    'crm.middleware.XFrameOptionsMiddleware',
+    'crm.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -54,6 +57,21 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Профиль SQLite: 'default' (настройки Django по умолчанию, для разработки) или
+# 'production' (WAL, настроенные PRAGMA, BEGIN IMMEDIATE, постоянные соединения),
+# который включается явно: CRM_SQLITE_PROFILE=production.
+SQLITE_PROFILE = os.environ.get('CRM_SQLITE_PROFILE', 'default')
+
+# PRAGMA, которые выполняются на каждом новом соединении.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -61,6 +79,35 @@ DATABASES = {
     }
 }
 
+if SQLITE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Пишущие транзакции сразу берут RESERVED-лок и ждут его по busy_timeout,
+            # а не падают с "database is locked" при апгрейде лока посреди транзакции.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+    })
+
+# Реплика для чтения. Локально это отдельный файл SQLite, который обновляется
+# командой manage.py sync_replica; в тестах она зеркалит основную базу.
+# Чтения идут на реплику, только если задан CRM_DB_REPLICA_NAME.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('CRM_DB_REPLICA_NAME', BASE_DIR / 'db.replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+CRM_DB_REPLICA = 'replica' if os.environ.get('CRM_DB_REPLICA_NAME') else None
+CRM_DB_PRIMARY_STICKY_SECONDS = 5
+# Кэш, где хранится закрепление пользователя за основной базой после записи.
+# При нескольких воркерах он должен быть общим для них (не locmem).
+CRM_DB_PIN_CACHE_ALIAS = 'default'
+
+DATABASE_ROUTERS = ['crm.routers.PrimaryReplicaRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',},
@@ -91,11 +138,20 @@ SWAGGER_SETTINGS = {
         }
     },
     'USE_SESSION_AUTH': False,
+    # UI загружает заранее построенную схему, см. crm/schema.py.
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
 }
 
+# Файлы OpenAPI-схемы, которые пишет manage.py generate_schema.
+CRM_SCHEMA_DIR = os.environ.get('CRM_SCHEMA_DIR', BASE_DIR / 'schema')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'crm.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -104,6 +160,88 @@ REST_FRAMEWORK = {
     'UNAUTHENTICATED_USER': None,
 }
 
+# Режим конкурентного учёта остатков: 'lock' (select_for_update) или 'retry' (оптимистичный повтор).
+# В SQLite select_for_update не блокирует строки, поэтому там по умолчанию 'retry'
+# (а 'lock' работает так же, см. crm/stock.py).
+CRM_STOCK_CONTENTION_MODE = os.environ.get(
+    'CRM_STOCK_CONTENTION_MODE', 'retry' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'lock',
+)
+CRM_STOCK_RETRY_ATTEMPTS = 5
+CRM_STOCK_RETRY_BACKOFF = 0.05
+
+# Метрики запросов (crm/metrics.py): заголовок Server-Timing, лог запросов дольше
+# CRM_SLOW_REQUEST_MS с самыми дорогими SQL и /metrics для Prometheus.
+CRM_SERVER_TIMING = True
+CRM_SLOW_REQUEST_MS = int(os.environ.get('CRM_SLOW_REQUEST_MS', 500))
+CRM_SLOW_REQUEST_TOP_QUERIES = 5
+CRM_METRICS_ALLOWED_IPS = [
+    address for address in os.environ.get('CRM_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if address
+]
+
+# Кэш Principal (пользователь, компания, склад) для аутентификации по JWT.
+CRM_PRINCIPAL_CACHE_SIZE = 10000
+CRM_PRINCIPAL_CACHE_TTL = 60
+
+# Списки товаров, поставщиков и поставок через values_list и ValuesMapper
+# (crm/mappers.py) вместо ModelSerializer; выдача та же. Включается явно.
+CRM_FAST_LIST_SERIALIZATION = os.environ.get('CRM_FAST_LIST_SERIALIZATION', '') == '1'
+
+# Кэш сериализованных списков (crm/response_cache.py). CRM_RESPONSE_CACHE выбирает
+# хранилище: 'locmem' — LRU в памяти процесса, 'file' или 'sqlite' — общий для
+# нескольких воркеров ('sqlite' требует manage.py createcachetable).
+CRM_RESPONSE_CACHE = os.environ.get('CRM_RESPONSE_CACHE', 'locmem')
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crm-responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CRM_RESPONSE_CACHE_DIR', BASE_DIR / 'cache' / 'responses'),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'sqlite': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'crm_response_cache',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'crm_responses': RESPONSE_CACHE_BACKENDS[CRM_RESPONSE_CACHE],
+}
+CRM_RESPONSE_CACHE_ALIAS = 'crm_responses'
+CRM_RESPONSE_CACHE_TIMEOUT = 300
+
+# Фоновые задачи (manage.py runworkers): файлы импорта и результаты выгрузок лежат в CRM_JOB_DIR.
+CRM_JOB_DIR = os.environ.get('CRM_JOB_DIR', BASE_DIR / 'jobs')
+CRM_JOB_WORKERS = 2
+CRM_JOB_POLL_INTERVAL = 1.0
+CRM_JOB_MAX_ATTEMPTS = 3
+CRM_JOB_RETRY_BACKOFF = 5
+CRM_JOB_STALE_TIMEOUT = 600
+
+# Пакет подзапросов POST /api/batch/ (crm/batch.py).
+CRM_BATCH_MAX_REQUESTS = 50
+
+# Поставщиков в одном POST /api/suppliers/upsert/.
+CRM_SUPPLIER_UPSERT_MAX_ITEMS = 5000
+
+# Изменений на страницу GET /api/sync/ (crm/sync.py).
+CRM_SYNC_PAGE_SIZE = 500
+
+# Поток изменений остатков GET /api/events/stock/ (crm/events.py). Канал между
+# процессами — путь к классу; по умолчанию опрашивается таблица StockEvent.
+# События старше CRM_STOCK_EVENTS_RETENTION секунд удаляет prune_stock_events.
+CRM_STOCK_EVENTS_CHANNEL = 'crm.events.OutboxChannel'
+CRM_STOCK_EVENTS_POLL_INTERVAL = 1.0
+CRM_STOCK_EVENTS_HEARTBEAT = 15
+CRM_STOCK_EVENTS_RETRY_MS = 3000
+CRM_STOCK_EVENTS_QUEUE_SIZE = 100
+CRM_STOCK_EVENTS_REPLAY_LIMIT = 1000
+CRM_STOCK_EVENTS_RETENTION = 24 * 3600
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
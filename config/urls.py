@@ -10,26 +10,29 @@ from crm.views import (
     SupplierRetrieveUpdateDestroyView,
     ProductListCreateView,
     ProductRetrieveUpdateDestroyView,
+    ProductAdjustView,
     SupplyListCreateView,
+    SupplyRetrieveView,
     AttachUserToCompanyView,
+    ProductExportView,
+    SupplierExportView,
+    SupplyExportView,
+    ProductImportView,
+    SupplierImportView,
+    SupplierUpsertView,
+    JobCreateView,
+    JobDetailView,
+    JobResultView,
+    ResponseCacheStatsView,
+    BatchView,
+    SyncView,
+    StockAtView,
 )
+from crm import async_views, metrics, schema
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from rest_framework import permissions
 from django.contrib import admin
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Final Module API",
-        default_version='v1',
-        description="API documentation",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
     path('', RedirectView.as_view(url='/swagger/', permanent=False)),
 
@@ -49,18 +52,60 @@ urlpatterns = [
     # Suppliers
     path('api/suppliers/', SupplierListCreateView.as_view(), name='supplier_list_create'),
     path('api/suppliers/<int:pk>/', SupplierRetrieveUpdateDestroyView.as_view(), name='supplier_detail'),
+    path('api/suppliers/export/', SupplierExportView.as_view(), name='supplier_export'),
+    path('api/suppliers/import/', SupplierImportView.as_view(), name='supplier_import'),
+    path('api/suppliers/upsert/', SupplierUpsertView.as_view(), name='supplier_upsert'),
 
     # Products
     path('api/products/', ProductListCreateView.as_view(), name='product_list_create'),
     path('api/products/<int:pk>/', ProductRetrieveUpdateDestroyView.as_view(), name='product_detail'),
+    path('api/products/<int:pk>/adjust/', ProductAdjustView.as_view(), name='product_adjust'),
+    path('api/products/export/', ProductExportView.as_view(), name='product_export'),
+    path('api/products/import/', ProductImportView.as_view(), name='product_import'),
 
     # Supplies
     path('api/supplies/', SupplyListCreateView.as_view(), name='supply_list_create'),
+    path('api/supplies/<int:pk>/', SupplyRetrieveView.as_view(), name='supply_detail'),
+    path('api/supplies/export/', SupplyExportView.as_view(), name='supply_export'),
+
+    # Background jobs
+    path('api/jobs/', JobCreateView.as_view(), name='job_create'),
+    path('api/jobs/<int:pk>/', JobDetailView.as_view(), name='job_detail'),
+    path('api/jobs/<int:pk>/result/', JobResultView.as_view(), name='job_result'),
+
+    path('api/cache/stats/', ResponseCacheStatsView.as_view(), name='response_cache_stats'),
+
+    # Several API calls in one round trip
+    path('api/batch/', BatchView.as_view(), name='batch'),
+
+    # Delta sync for offline clients
+    path('api/sync/', SyncView.as_view(), name='sync'),
+
+    # Point-in-time inventory from the stock ledger
+    path('api/stock/at/', StockAtView.as_view(), name='stock_at'),
+
+    # Async read endpoints (ASGI): the same views served through the async ORM
+    path('api/async/company/detail/', async_views.read_view(CompanyDetailView), name='async_company_detail'),
+    path('api/async/storage/detail/', async_views.read_view(StorageDetailView), name='async_storage_detail'),
+    path('api/async/suppliers/', async_views.read_view(SupplierListCreateView), name='async_supplier_list'),
+    path('api/async/suppliers/<int:pk>/', async_views.read_view(SupplierRetrieveUpdateDestroyView),
+         name='async_supplier_detail'),
+    path('api/async/products/', async_views.read_view(ProductListCreateView), name='async_product_list'),
+    path('api/async/products/<int:pk>/', async_views.read_view(ProductRetrieveUpdateDestroyView),
+         name='async_product_detail'),
+    path('api/async/supplies/', async_views.read_view(SupplyListCreateView), name='async_supply_list'),
+    path('api/async/supplies/<int:pk>/', async_views.read_view(SupplyRetrieveView), name='async_supply_detail'),
+
+    # Stock change stream (SSE, ASGI)
+    path('api/events/stock/', async_views.stock_events, name='stock_events'),
 
     # Attach user to company (only for company owner)
     path('api/company/attach-user/', AttachUserToCompanyView.as_view(), name='attach_user_to_company'),
 
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics.metrics_view, name=metrics.METRICS_ROUTE),
+
+    # Схема строится один раз (manage.py generate_schema), drf_yasg подгружается при первом открытии UI.
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema.schema_view, name='schema-json'),
+    path('swagger/', schema.ui_view, {'renderer': 'swagger'}, name='schema-swagger-ui'),
+    path('redoc/', schema.ui_view, {'renderer': 'redoc'}, name='schema-redoc'),
 ]
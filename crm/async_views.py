@@ -0,0 +1,105 @@
+"""Async-эндпоинты для ASGI (config.asgi): чтение /api/async/... и поток остатков по SSE.
+
+Синхронное DRF-представление под ASGI занимает поток на весь запрос.
+read_view(view_class) обслуживает GET того же представления без потока:
+queryset, сериализатор, пагинация, ETag/304 и кэш списков берутся из
+view_class (ConditionalGetMixin.aget), а запросы к базе идут через async
+ORM (afirst, aget, aiterator). Ответы совпадают с синхронными эндпоинтами.
+"""
+from functools import wraps
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotAuthenticated, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from . import events
+from .authentication import CachedJWTAuthentication
+
+authenticator = CachedJWTAuthentication()
+renderer = JSONRenderer()
+
+
+class StreamingUnavailable(APIException):
+    status_code = 501
+    default_detail = "Поток событий доступен только под ASGI (uvicorn config.asgi:application)."
+    default_code = 'not_implemented'
+
+
+def render(data, status=200):
+    return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+
+def error_response(request, exc):
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = render(data, exc.status_code)
+    if exc.status_code == 401:
+        response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+    return response
+
+
+def async_read_view(view):
+    """Аутентификация по JWT и ошибки в формате DRF для async-представления view(request, principal, ...)."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            auth = await authenticator.aauthenticate(request)
+            if auth is None:
+                raise NotAuthenticated()
+            request.user, request.auth = auth
+            return await view(request, request.user.principal, *args, **kwargs)
+        except Http404 as exc:
+            return error_response(request, NotFound(*exc.args))
+        except APIException as exc:
+            return error_response(request, exc)
+    return wrapper
+
+
+def read_view(view_class):
+    """Async GET для представления view_class из crm/views.py; ответ всегда в JSON."""
+    @async_read_view
+    async def view(request, principal, **kwargs):
+        drf_request = Request(request)
+        drf_request.user, drf_request.auth = request.user, request.auth
+        drf_request.accepted_renderer, drf_request.accepted_media_type = renderer, renderer.media_type
+        instance = view_class(request=drf_request, args=(), kwargs=kwargs, format_kwarg=None)
+        response = await instance.aget(drf_request, **kwargs)
+        if isinstance(response, Response):
+            response.accepted_renderer, response.accepted_media_type = renderer, renderer.media_type
+            response.renderer_context = instance.get_renderer_context()
+            response.render()
+            # Django вызывает render() у SimpleTemplateResponse через sync_to_async, даже если ответ уже готов.
+            rendered = HttpResponse(response.content, status=response.status_code)
+            for header, value in response.items():
+                rendered[header] = value
+            rendered.cookies = response.cookies
+            return rendered
+        return response
+    view.view_class = view_class
+    return view
+
+
+@async_read_view
+async def stock_events(request, principal):
+    """SSE-поток изменений остатков компании (crm/events.py)."""
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI бесконечный поток занял бы рабочий поток сервера до отключения клиента.
+        raise StreamingUnavailable()
+    if principal.company_id is None:
+        raise ValidationError("Пользователь не привязан к компании.")
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if last_event_id is not None:
+        if not last_event_id.isdigit():
+            raise ValidationError({'last_event_id': ["Некорректный id события."]})
+        last_event_id = int(last_event_id)
+    response = StreamingHttpResponse(
+        events.stream(principal.company_id, last_event_id), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx иначе буферизует поток.
+    response['X-Accel-Buffering'] = 'no'
+    return response
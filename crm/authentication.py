@@ -0,0 +1,79 @@
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import metrics
+from .principal import principal_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, который берёт пользователя из кэша Principal.
+
+    Пользователь, компания и склад разрешаются одним запросом при промахе
+    кэша и без запросов при попадании.
+    """
+
+    def authenticate(self, request):
+        request_metrics = metrics.current()
+        if request_metrics is None:
+            return super().authenticate(request)
+        started = perf_counter()
+        try:
+            return super().authenticate(request)
+        finally:
+            request_metrics.auth_time += perf_counter() - started
+
+    def get_user_id(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            return self.user_model._meta.pk.to_python(user_id)
+        except ValidationError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_principal(self, principal, validated_token):
+        if principal is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user = principal.build_user()
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def get_user(self, validated_token):
+        principal = principal_cache.get_or_resolve(self.get_user_id(validated_token))
+        return self.check_principal(principal, validated_token)
+
+    async def aauthenticate(self, request):
+        """То же, что authenticate, но без блокирующих запросов: для async-представлений."""
+        request_metrics = metrics.current()
+        started = perf_counter()
+        try:
+            return await self._aauthenticate(request)
+        finally:
+            if request_metrics is not None:
+                request_metrics.auth_time += perf_counter() - started
+
+    async def _aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        principal = await principal_cache.aget_or_resolve(self.get_user_id(validated_token))
+        return self.check_principal(principal, validated_token), validated_token
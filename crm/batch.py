@@ -0,0 +1,155 @@
+"""Пакет подзапросов к API за один HTTP-запрос (POST /api/batch/).
+
+Подзапросы выполняются по порядку в этом же процессе: строится WSGIRequest
+и вызывается DRF-представление маршрута. JWT проверяется один раз на весь
+пакет, подзапросам пользователь передаётся через принудительную
+аутентификацию DRF; Principal перед каждым берётся из кэша заново, чтобы
+шаги видели компанию или склад, созданные предыдущими.
+
+Ссылки на ответы предыдущих подзапросов: "$N.поле" (N — номер с нуля,
+вложенные поля и индексы списков через точку). В теле строка целиком
+заменяется значением с его типом, в пути — подставляется текстом.
+
+В режиме atomic весь пакет идёт в одной транзакции и останавливается на
+первом ответе с ошибкой; изменения откатываются.
+"""
+import io
+import json
+import logging
+import re
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+
+from .principal import principal_cache
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api/'
+REFERENCE_RE = re.compile(r'\$(\d+)((?:\.\w+)+)')
+# Заголовки пакета, которые подзапросам не передаются: тело у каждого своё,
+# условные заголовки относятся к самому пакету.
+SKIPPED_META = ('CONTENT_LENGTH', 'CONTENT_TYPE', 'QUERY_STRING', 'wsgi.input')
+
+
+class BatchReferenceError(Exception):
+    pass
+
+
+def _lookup(responses, index, fields):
+    if index >= len(responses):
+        raise BatchReferenceError(f"Ссылка ${index} указывает на ещё не выполненный запрос.")
+    response = responses[index]
+    if response['status'] >= 400:
+        raise BatchReferenceError(f"Запрос ${index} завершился ошибкой, ссылаться на него нельзя.")
+    value = response['body']
+    for field in fields.split('.')[1:]:
+        if isinstance(value, dict) and field in value:
+            value = value[field]
+        elif isinstance(value, list) and field.isdigit() and int(field) < len(value):
+            value = value[int(field)]
+        else:
+            raise BatchReferenceError(f"В ответе запроса ${index} нет поля {fields[1:]}.")
+    return value
+
+
+def resolve_references(value, responses):
+    if isinstance(value, dict):
+        return {key: resolve_references(item, responses) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(item, responses) for item in value]
+    if isinstance(value, str):
+        match = REFERENCE_RE.fullmatch(value)
+        if match:
+            return _lookup(responses, int(match.group(1)), match.group(2))
+    return value
+
+
+def resolve_path(path, responses):
+    return REFERENCE_RE.sub(lambda match: str(_lookup(responses, int(match.group(1)), match.group(2))), path)
+
+
+def build_request(request, method, path, body, user):
+    path, _, query = path.partition('?')
+    payload = json.dumps(body).encode() if body is not None else b''
+    environ = {
+        key: value for key, value in request.META.items()
+        if key not in SKIPPED_META and not key.startswith('HTTP_IF_')
+    }
+    environ.update({
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload), 'wsgi.url_scheme': request.scheme,
+    })
+    sub_request = WSGIRequest(environ)
+    # Request DRF подставляет ForcedAuthentication вместо authentication_classes представления.
+    sub_request._force_auth_user = user
+    return sub_request
+
+
+def error(status, detail):
+    return {'status': status, 'body': {'detail': detail}}
+
+
+class BatchRunner:
+    def __init__(self, request, view_class):
+        self.request = request
+        self.view_class = view_class
+        self.user_id = request.user.pk
+        self.company_ids = {request.user.company_id}
+
+    def run(self, items, atomic):
+        if not atomic:
+            return {'rolled_back': False, 'responses': self.run_items(items, stop_on_error=False)}
+        with transaction.atomic():
+            responses = self.run_items(items, stop_on_error=True)
+            rolled_back = responses[-1]['status'] >= 400
+            if rolled_back:
+                transaction.set_rollback(True)
+        if rolled_back:
+            # Principal мог закэшироваться с компанией или складом из откаченной транзакции.
+            principal_cache.invalidate_users(self.user_id)
+            for company_id in self.company_ids - {None}:
+                principal_cache.invalidate_company(company_id)
+        return {'rolled_back': rolled_back, 'responses': responses}
+
+    def run_items(self, items, stop_on_error):
+        responses = []
+        for item in items:
+            responses.append(self.run_item(item, responses))
+            if stop_on_error and responses[-1]['status'] >= 400:
+                break
+        return responses
+
+    def run_item(self, item, responses):
+        try:
+            path = resolve_path(item['path'], responses)
+            body = resolve_references(item.get('body'), responses)
+        except BatchReferenceError as exc:
+            return error(400, str(exc))
+        if not path.startswith(API_PREFIX):
+            return error(400, f"Путь должен начинаться с {API_PREFIX}.")
+        try:
+            match = resolve(path.partition('?')[0])
+        except Resolver404:
+            return error(404, "Маршрут не найден.")
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is None or not issubclass(view_class, APIView) or issubclass(view_class, self.view_class):
+            return error(400, "Маршрут нельзя вызвать в пакете.")
+
+        principal = principal_cache.get_or_resolve(self.user_id)
+        if principal is None:
+            return error(401, "Пользователь не найден.")
+        self.company_ids.add(principal.company_id)
+        sub_request = build_request(self.request, item['method'], path, body, principal.build_user())
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception('Подзапрос %s %s пакета упал', item['method'], path)
+            return error(500, "Внутренняя ошибка сервера.")
+        if response.streaming or not hasattr(response, 'data'):
+            response.close()
+            return error(400, "Потоковые ответы (выгрузки, файлы) в пакете не поддерживаются.")
+        return {'status': response.status_code, 'body': response.data}
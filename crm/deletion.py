@@ -0,0 +1,38 @@
+"""Удаление данных склада и компании фиксированным числом запросов.
+
+Collector Django перед каскадным удалением выбирает id всех строк и удаляет
+их пачками по 100, так что удаление склада с миллионом товаров — это
+десятки тысяч запросов. Здесь зависимые таблицы чистятся снизу вверх
+одним DELETE с подзапросом на таблицу. Сигналов post_delete у этих моделей
+нет (см. crm/versioning.py), строки FTS удаляет триггер на crm_product;
+версии и кэш списков сбрасывают вызывающие и сигналы Storage/Company.
+Удалённые товары склада записываются в надгробия для /api/sync/; при
+удалении компании надгробия не нужны — клиенты получат reset.
+"""
+from django.db import router
+
+from .models import Supplier, Product, Supply, SupplyProduct, Tombstone
+from .sync import record_deletions, touch
+
+
+def raw_delete(queryset):
+    """DELETE без выборки id, каскадов и сигналов; ссылающиеся строки должны быть уже удалены."""
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def delete_storage_contents(storage_id, company_id, sync_seq):
+    products = Product.objects.filter(storage_id=storage_id)
+    record_deletions(products, Tombstone.PRODUCT, company_id, sync_seq)
+    # Поставки теряют строки с товарами склада — клиенты должны их перечитать.
+    touch(Supply.objects.filter(supply_products__product__storage_id=storage_id), sync_seq)
+    raw_delete(SupplyProduct.objects.filter(product__storage_id=storage_id))
+    raw_delete(products)
+
+
+def delete_company_contents(company_id):
+    # Поставки первыми: поставщик защищён от удаления, пока на него ссылаются поставки.
+    raw_delete(SupplyProduct.objects.filter(supply__company_id=company_id))
+    raw_delete(Supply.objects.filter(company_id=company_id))
+    raw_delete(SupplyProduct.objects.filter(product__storage__company_id=company_id))
+    raw_delete(Product.objects.filter(storage__company_id=company_id))
+    raw_delete(Supplier.objects.filter(company_id=company_id))
@@ -0,0 +1,228 @@
+"""Поток изменений остатков по SSE: GET /api/events/stock/ под ASGI.
+
+Поставка пишет StockEvent в той же транзакции, что и остатки (исходящая
+очередь в базе). В каждом процессе одна задача Broker опрашивает канал
+(CRM_STOCK_EVENTS_CHANNEL, по умолчанию — таблица StockEvent) и раскладывает
+события по очередям подписчиков своей компании. Простаивающее соединение —
+это корутина и небольшая очередь: ни потока, ни запросов к базе на каждое,
+поэтому тысячи подписчиков стоят один опрос в CRM_STOCK_EVENTS_POLL_INTERVAL.
+Запись в этом же процессе будит опрос сразу после коммита.
+
+Клиент переподключается с Last-Event-ID и получает пропущенное из базы.
+Если история неполна (старше CRM_STOCK_EVENTS_RETENTION или больше
+CRM_STOCK_EVENTS_REPLAY_LIMIT событий) — приходит event: reset, и остатки
+нужно перечитать через /api/products/. Отстающий клиент с переполненной
+очередью отключается и догоняет так же. Старые события удаляет команда
+prune_stock_events по расписанию — независимо от того, есть ли подписчики.
+
+OutboxChannel рассчитан на SQLite, где записи идут по одной и порядок id
+совпадает с порядком коммитов; для базы с параллельными писателями канал
+заменяется (LISTEN/NOTIFY, Redis и т.п.) с тем же интерфейсом.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Product, StockEvent
+
+# Событий за один опрос канала.
+FETCH_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+
+def record_stock_changes(company_id, product_ids, supply_id, batch_size):
+    """События с остатками после изменения: INSERT ... SELECT из crm_product в той же транзакции."""
+    database = router.db_for_write(StockEvent)
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(StockEvent._meta.get_field(name).column)
+        for name in ('company', 'product_id', 'quantity', 'supply_id', 'created_at')
+    )
+    created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        select_sql, params = (
+            Product.objects.using(database).filter(id__in=batch).order_by('id').values_list('id', 'quantity')
+            .query.sql_with_params()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(StockEvent._meta.db_table)} ({columns}) '
+                f'SELECT %s, changed.{quote("id")}, changed.{quote("quantity")}, %s, %s FROM ({select_sql}) changed',
+                [company_id, supply_id, created_at, *params],
+            )
+
+
+def prune_stock_events(retention=None):
+    """Удаляет события старше retention секунд (по умолчанию CRM_STOCK_EVENTS_RETENTION); возвращает их число."""
+    if retention is None:
+        retention = settings.CRM_STOCK_EVENTS_RETENTION
+    deleted, _ = StockEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=retention)).delete()
+    return deleted
+
+
+class OutboxChannel:
+    """Межпроцессный канал поверх таблицы StockEvent."""
+
+    async def latest_id(self):
+        return await StockEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+
+    async def fetch(self, after_id, limit):
+        return [event async for event in StockEvent.objects.filter(id__gt=after_id).order_by('id')[:limit]]
+
+    async def replay(self, company_id, after_id, limit):
+        """События компании после after_id или None, если часть истории уже не восстановить."""
+        bounds = await StockEvent.objects.aaggregate(oldest=Min('id'), newest=Max('id'))
+        if bounds['newest'] is None:
+            # Пусто: либо всё вычищено по сроку, либо событий ещё не было.
+            return None if after_id else []
+        if not bounds['oldest'] - 1 <= after_id <= bounds['newest']:
+            return None
+        events = [
+            event async for event in
+            StockEvent.objects.filter(company_id=company_id, id__gt=after_id).order_by('id')[:limit + 1]
+        ]
+        return events if len(events) <= limit else None
+
+
+@lru_cache
+def _channel(path):
+    return import_string(path)()
+
+
+def get_channel():
+    return _channel(settings.CRM_STOCK_EVENTS_CHANNEL)
+
+
+class Subscription:
+    __slots__ = ('company_id', 'queue', 'overflowed')
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        self.queue = asyncio.Queue(settings.CRM_STOCK_EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    """Раздача событий подписчикам процесса; опрос канала идёт, пока есть подписчики."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._task = None
+        self._loop = None
+        self._wake = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def subscribe(self, company_id):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый цикл событий (перезапуск, тесты): задача и подписчики старого больше не работают.
+            self._subscribers.clear()
+            self._task = None
+        if not self.running:
+            # Позиция берётся до подписки: всё, что закоммичено позже, дойдёт до подписчика.
+            last_id = await get_channel().latest_id()
+            if not self.running:
+                self._loop = loop
+                self._wake = asyncio.Event()
+                self._task = loop.create_task(self._run(last_id))
+        subscription = Subscription(company_id)
+        self._subscribers[company_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.company_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.company_id]
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self):
+        """Будит опрос после коммита записи; можно вызывать из любого потока."""
+        loop, wake = self._loop, self._wake
+        if self.running and not loop.is_closed():
+            loop.call_soon_threadsafe(wake.set)
+
+    async def _run(self, last_id):
+        channel = get_channel()
+        while True:
+            try:
+                events = await channel.fetch(last_id, FETCH_BATCH)
+            except Exception:
+                logger.exception('Не удалось прочитать события остатков')
+                events = []
+            for event in events:
+                last_id = event.id
+                for subscription in tuple(self._subscribers.get(event.company_id, ())):
+                    subscription.put(event)
+            if len(events) == FETCH_BATCH:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.CRM_STOCK_EVENTS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+broker = Broker()
+
+
+def format_event(event):
+    data = {
+        'product_id': event.product_id, 'quantity': event.quantity, 'supply_id': event.supply_id,
+        'created_at': event.created_at.isoformat(),
+    }
+    return f'id: {event.id}\nevent: stock\ndata: {json.dumps(data)}\n\n'
+
+
+async def stream(company_id, last_event_id=None):
+    """Тело ответа text/event-stream для подписчика компании."""
+    subscription = await broker.subscribe(company_id)
+    try:
+        replay = []
+        if last_event_id is not None:
+            replay = await get_channel().replay(company_id, last_event_id, settings.CRM_STOCK_EVENTS_REPLAY_LIMIT)
+        yield f'retry: {settings.CRM_STOCK_EVENTS_RETRY_MS}\n\n'
+        sent = last_event_id or 0
+        if replay is None:
+            yield 'event: reset\ndata: {}\n\n'
+            replay, sent = [], 0
+        for event in replay:
+            yield format_event(event)
+            sent = event.id
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.CRM_STOCK_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            # События из очереди, уже отданные при догоняющей выборке, пропускаются.
+            if event.id > sent:
+                yield format_event(event)
+                sent = event.id
+    finally:
+        broker.unsubscribe(subscription)
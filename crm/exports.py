@@ -0,0 +1,86 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Supplier, Product, SupplyProduct
+from .pagination import keyset_filter
+
+EXPORT_CHUNK_SIZE = 2000
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    NDJSON: 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def keyset_rows(queryset, lookups, ordering):
+    """Строки values_list(*lookups) в порядке ordering, пачками по EXPORT_CHUNK_SIZE.
+
+    Каждая пачка — отдельный запрос по ключу после предыдущей, прочитанный
+    целиком: между пачками на соединении нет открытого курсора, и в него
+    можно писать (прогресс задачи), а SQLite без WAL не держит блокировку
+    чтения на всё время выгрузки. Последнее поле ordering должно быть уникальным.
+    """
+    extra = [order for order in ordering if order not in lookups]
+    keys = [(lookups + extra).index(order) for order in ordering]
+    queryset = queryset.order_by(*ordering).values_list(*lookups, *extra)
+    position = None
+    while True:
+        page = queryset if position is None else queryset.filter(keyset_filter(ordering, position))
+        rows = list(page[:EXPORT_CHUNK_SIZE])
+        for row in rows:
+            yield row[:len(lookups)]
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        position = [rows[-1][index] for index in keys]
+
+
+def product_rows(storage_id):
+    columns = ['id', 'title', 'quantity', 'purchase_price']
+    return columns, keyset_rows(Product.objects.filter(storage_id=storage_id), columns, ['id'])
+
+
+def supplier_rows(company_id):
+    columns = ['id', 'name', 'inn', 'contact_info']
+    return columns, keyset_rows(Supplier.objects.filter(company_id=company_id), columns, ['id'])
+
+
+def supply_line_rows(company_id):
+    """Строки поставок, развёрнутые по товарам: одна запись на SupplyProduct."""
+    fields = [
+        ('supply_id', 'supply_id'),
+        ('date', 'supply__date'),
+        ('supplier_id', 'supply__supplier_id'),
+        ('supplier_name', 'supply__supplier__name'),
+        ('product_id', 'product_id'),
+        ('product_title', 'product__title'),
+        ('quantity', 'quantity'),
+        ('purchase_price', 'product__purchase_price'),
+    ]
+    rows = keyset_rows(
+        SupplyProduct.objects.filter(supply__company_id=company_id),
+        [lookup for _, lookup in fields], ['supply__date', 'supply_id', 'id'],
+    )
+    return [column for column, _ in fields], rows
+
+
+def stream_rows(columns, rows, output):
+    """Генератор строк файла выгрузки; заголовок отдаётся до первого запроса к базе."""
+    if output == NDJSON:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        for row in rows:
+            yield encoder.encode(dict(zip(columns, row))) + '\n'
+        return
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
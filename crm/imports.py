@@ -0,0 +1,296 @@
+import codecs
+import csv
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from .models import Supplier, Product
+from .validators import INN_ERROR, is_valid_inn
+from .versioning import next_version
+
+IMPORT_BATCH_SIZE = 1000
+UPSERT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+PRICE_MAX_DIGITS = Product._meta.get_field('purchase_price').max_digits
+PRICE_DECIMAL_PLACES = Product._meta.get_field('purchase_price').decimal_places
+
+
+class CsvImportError(Exception):
+    """Файл нельзя разобрать целиком (кодировка, нет обязательных колонок)."""
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self.detail = None
+
+    @property
+    def processed(self):
+        """Строк файла, уже учтённых в отчёте (записанных или с ошибкой)."""
+        return self.created + self.error_count
+
+    def state(self):
+        return {'created': self.created, 'failed': self.error_count, 'errors': self.errors}
+
+    @classmethod
+    def from_state(cls, state):
+        """Отчёт, восстановленный из state(): импорт продолжается после уже учтённых строк."""
+        report = cls()
+        report.created, report.error_count, report.errors = state['created'], state['failed'], state['errors']
+        return report
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        report = {
+            'created': self.created,
+            'failed': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+        }
+        if self.detail:
+            report['detail'] = self.detail
+        return report
+
+
+def read_csv(uploaded_file, required_columns):
+    """Читает загруженный CSV построчно, не загружая файл в память целиком.
+
+    Возвращает итератор пар (номер строки в файле, dict строки).
+    """
+    reader = csv.DictReader(codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+    try:
+        columns = set(reader.fieldnames or [])
+    except (UnicodeDecodeError, csv.Error):
+        raise CsvImportError("Файл должен быть в кодировке UTF-8.")
+    missing = sorted(set(required_columns) - columns)
+    if missing:
+        raise CsvImportError(f"В файле нет обязательных колонок: {', '.join(missing)}.")
+    return enumerate(reader, start=2)
+
+
+def batches(report, rows):
+    """Режет строки на пачки; ошибка разбора посреди файла останавливает импорт.
+
+    Уже записанные пачки остаются, причина остановки попадает в report.detail.
+    """
+    while True:
+        try:
+            batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        except (UnicodeDecodeError, csv.Error):
+            report.detail = "Импорт остановлен: файл повреждён или не в кодировке UTF-8."
+            return
+        if not batch:
+            return
+        yield batch
+
+
+def _clean(row, column):
+    return (row.get(column) or '').strip()
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        return None
+    if not price.is_finite() or price < 0:
+        return None
+    if price.as_tuple().exponent < -PRICE_DECIMAL_PLACES:
+        return None
+    if len(price.quantize(Decimal(1)).as_tuple().digits) > PRICE_MAX_DIGITS - PRICE_DECIMAL_PLACES:
+        return None
+    return price
+
+
+def _write(report, model, objects, rows, company_id, checkpoint=None):
+    try:
+        with transaction.atomic():
+            seq = next_version(company_id=company_id)
+            for obj in objects:
+                obj.sync_seq = seq
+            model.objects.bulk_create(objects)
+            report.created += len(objects)
+            if checkpoint is not None:
+                # Позиция сохраняется в транзакции пачки: повтор не запишет её второй раз.
+                checkpoint(report)
+    except IntegrityError:
+        for row in rows:
+            report.add_error(row, {'non_field_errors': ["Строка конфликтует с параллельно созданной записью."]})
+        if checkpoint is not None:
+            checkpoint(report)
+
+
+def _rows(report, uploaded_file, required_columns):
+    # Строки, учтённые в отчёте прошлой попытки, пропускаются; номера строк сохраняются.
+    return islice(read_csv(uploaded_file, required_columns), report.processed, None)
+
+
+def import_products(uploaded_file, principal, checkpoint=None, report=None):
+    """Импорт товаров: колонки title, purchase_price и необязательная storage.
+
+    checkpoint, если задан, вызывается с отчётом после каждой пачки, для
+    записанной — в её транзакции. report — отчёт прерванной попытки
+    (ImportReport.from_state): уже учтённые строки пропускаются.
+    """
+    report = report or ImportReport()
+    own_storage = str(principal.storage_id)
+    for batch in batches(report, _rows(report, uploaded_file, ['title', 'purchase_price'])):
+        # Принадлежность складов проверяется один раз на пачку.
+        foreign_storages = {_clean(row, 'storage') for _, row in batch} - {'', own_storage}
+        objects, rows = [], []
+        for line, row in batch:
+            errors = {}
+            title = _clean(row, 'title')
+            if not title:
+                errors['title'] = ["Обязательное поле."]
+            elif len(title) > 255:
+                errors['title'] = ["Не более 255 символов."]
+            price = _parse_price(_clean(row, 'purchase_price'))
+            if price is None:
+                errors['purchase_price'] = ["Некорректная цена."]
+            if _clean(row, 'storage') in foreign_storages:
+                errors['storage'] = ["Склад не принадлежит вашей компании."]
+            if errors:
+                report.add_error(line, errors)
+                continue
+            objects.append(Product(storage_id=principal.storage_id, title=title, quantity=0, purchase_price=price))
+            rows.append(line)
+        if objects:
+            _write(report, Product, objects, rows, principal.company_id, checkpoint)
+        elif checkpoint is not None:
+            checkpoint(report)
+    return report
+
+
+def import_suppliers(uploaded_file, principal, checkpoint=None, report=None):
+    """Импорт поставщиков: колонки name, inn и необязательная contact_info; checkpoint и report — как у import_products."""
+    report = report or ImportReport()
+    seen_inns = set()
+    for batch in batches(report, _rows(report, uploaded_file, ['name', 'inn'])):
+        # Формат и уникальность ИНН проверяются на всю пачку одним запросом.
+        inns = {_clean(row, 'inn') for _, row in batch}
+        existing = set(Supplier.objects.filter(inn__in=[inn for inn in inns if is_valid_inn(inn)])
+                       .values_list('inn', flat=True))
+        objects, rows = [], []
+        for line, row in batch:
+            errors = {}
+            name = _clean(row, 'name')
+            if not name:
+                errors['name'] = ["Обязательное поле."]
+            elif len(name) > 255:
+                errors['name'] = ["Не более 255 символов."]
+            inn = _clean(row, 'inn')
+            if not is_valid_inn(inn):
+                errors['inn'] = [INN_ERROR]
+            elif inn in existing:
+                errors['inn'] = ["Поставщик с таким ИНН уже существует."]
+            elif inn in seen_inns:
+                errors['inn'] = ["ИНН повторяется в файле."]
+            if errors:
+                report.add_error(line, errors)
+                continue
+            seen_inns.add(inn)
+            objects.append(Supplier(
+                company_id=principal.company_id, name=name, inn=inn, contact_info=_clean(row, 'contact_info'),
+            ))
+            rows.append(line)
+        if objects:
+            _write(report, Supplier, objects, rows, principal.company_id, checkpoint)
+        elif checkpoint is not None:
+            checkpoint(report)
+    return report
+
+
+UPSERT_FIELDS = ('company', 'inn', 'name', 'contact_info', 'sync_seq', 'updated_at')
+
+
+def upsert_batch_size():
+    """Размер пачки upsert: не больше UPSERT_BATCH_SIZE и столько, чтобы INSERT пачки уложился в лимит параметров базы."""
+    connection = connections[router.db_for_write(Supplier)]
+    fields = [Supplier._meta.get_field(name) for name in UPSERT_FIELDS]
+    return connection.ops.bulk_batch_size(fields, [None] * UPSERT_BATCH_SIZE)
+
+
+def _upsert_own(items, company_id, sync_seq):
+    """Один INSERT ... ON CONFLICT(inn) DO UPDATE, который обновляет только поставщиков company_id.
+
+    items не длиннее upsert_batch_size(). Возвращает ИНН записанных строк.
+    ИНН, занятый другой компанией (в том числе параллельно, после выборки в
+    upsert_suppliers), в ответ не попадает.
+    """
+    connection = connections[router.db_for_write(Supplier)]
+    quote = connection.ops.quote_name
+    table = quote(Supplier._meta.db_table)
+    company, inn, *updated = [quote(Supplier._meta.get_field(name).column) for name in UPSERT_FIELDS]
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    row = '(' + ', '.join(['%s'] * len(UPSERT_FIELDS)) + ')'
+    params = [
+        value for item in items
+        for value in (company_id, item['inn'], item['name'], item['contact_info'], sync_seq, now)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({company}, {inn}, {", ".join(updated)}) VALUES {", ".join([row] * len(items))} '
+            f'ON CONFLICT ({inn}) DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in updated)} '
+            f'WHERE {table}.{company} = excluded.{company} RETURNING {inn}',
+            params,
+        )
+        return {value for value, in cursor.fetchall()}
+
+
+def upsert_suppliers(items, principal):
+    """Идемпотентно создаёт или обновляет поставщиков по ИНН.
+
+    items — провалидированные dict с name, inn, contact_info. На пачку
+    выполняется один SELECT и INSERT ... ON CONFLICT(inn) DO UPDATE.
+    Поставщики других компаний не трогаются (строка с их ИНН попадает в
+    errors), а записи без изменений не попадают в INSERT вовсе.
+    """
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+    foreign = {'inn': ["Поставщик с таким ИНН принадлежит другой компании."]}
+    seen_inns = set()
+    size = upsert_batch_size()
+    for start in range(0, len(items), size):
+        batch = list(enumerate(items[start:start + size], start=start))
+        with transaction.atomic():
+            existing = {
+                supplier['inn']: supplier
+                for supplier in Supplier.objects.filter(inn__in=[item['inn'] for _, item in batch])
+                .values('inn', 'company_id', 'name', 'contact_info')
+            }
+            pending = []
+            for index, item in batch:
+                inn = item['inn']
+                if inn in seen_inns:
+                    report['errors'].append({'index': index, 'errors': {'inn': ["ИНН повторяется в запросе."]}})
+                    continue
+                seen_inns.add(inn)
+                current = existing.get(inn)
+                if current is not None and current['company_id'] != principal.company_id:
+                    report['errors'].append({'index': index, 'errors': foreign})
+                    continue
+                if current is not None and (current['name'], current['contact_info']) == (item['name'], item['contact_info']):
+                    report['unchanged'] += 1
+                    continue
+                pending.append((index, item, current is None))
+            if not pending:
+                continue
+            written = _upsert_own(
+                [item for _, item, _ in pending], principal.company_id, next_version(company_id=principal.company_id),
+            )
+            for index, item, new in pending:
+                if item['inn'] not in written:
+                    report['errors'].append({'index': index, 'errors': foreign})
+                else:
+                    report['inserted' if new else 'updated'] += 1
+    report['errors'].sort(key=lambda error: error['index'])
+    return report
@@ -0,0 +1,272 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import exports, imports
+from .models import Job
+from .principal import principal_cache
+
+EXPORT_PRODUCTS = 'export_products'
+EXPORT_SUPPLIERS = 'export_suppliers'
+EXPORT_SUPPLIES = 'export_supplies'
+IMPORT_PRODUCTS = 'import_products'
+IMPORT_SUPPLIERS = 'import_suppliers'
+
+# Сколько строк обрабатывать между записями прогресса в базу.
+PROGRESS_EVERY = 5000
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+class JobError(Exception):
+    """Ошибка, которую бессмысленно повторять (плохой файл, нет доступа)."""
+
+
+class JobLost(Exception):
+    """Задачу сочли зависшей и вернули в очередь: эта попытка больше ничего не пишет."""
+
+
+def job_handler(kind):
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def job_kinds():
+    return sorted(_handlers)
+
+
+def job_dir():
+    path = Path(settings.CRM_JOB_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def job_path(name):
+    return job_dir() / name
+
+
+def submit_job(kind, principal, params=None, upload=None):
+    """Ставит задачу в очередь; загруженный файл сохраняется в CRM_JOB_DIR."""
+    params = dict(params or {})
+    if upload is not None:
+        name = f'input-{uuid.uuid4().hex}.csv'
+        with open(job_path(name), 'wb') as target:
+            for chunk in upload.chunks():
+                target.write(chunk)
+        params['input'] = name
+    return Job.objects.create(
+        company_id=principal.company_id,
+        user_id=principal.user_id,
+        kind=kind,
+        params=params,
+        run_after=timezone.now(),
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_job(worker, candidates=5):
+    """Забирает одну готовую задачу.
+
+    Захват — условный UPDATE ... WHERE status = 'pending': из нескольких
+    воркеров, выбравших одну и ту же задачу, строку обновит только один.
+    """
+    now = timezone.now()
+    ready = (
+        Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+        .order_by('run_after', 'id').values_list('id', flat=True)[:candidates]
+    )
+    for job_id in list(ready):
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def recover_stale_jobs():
+    """Возвращает в очередь задачи, чей воркер пропал (locked_at старше CRM_JOB_STALE_TIMEOUT)."""
+    deadline = timezone.now() - timedelta(seconds=settings.CRM_JOB_STALE_TIMEOUT)
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=deadline)
+    failed = stale.filter(attempts__gte=settings.CRM_JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED, locked_by='', locked_at=None, finished_at=timezone.now(),
+        error="Воркер не завершил задачу за отведённое время.",
+    )
+    requeued = stale.update(status=Job.PENDING, locked_by='', locked_at=None, run_after=timezone.now())
+    return requeued + failed
+
+
+def retry_delay(attempts):
+    return settings.CRM_JOB_RETRY_BACKOFF * 2 ** (attempts - 1)
+
+
+def _own(job):
+    # Строка задачи, пока её держит эта попытка: при повторном захвате растёт attempts.
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, attempts=job.attempts)
+
+
+def _finish(job, **fields):
+    # Если задачу уже перехватили как зависшую, результат этого воркера не записывается.
+    return _own(job).update(locked_by='', locked_at=None, **fields)
+
+
+def _remove_input(job):
+    if 'input' in job.params:
+        job_path(job.params['input']).unlink(missing_ok=True)
+
+
+def run_job(job):
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise JobError(f"Неизвестный тип задачи: {job.kind}.")
+        result = handler(job)
+    except JobLost:
+        logger.warning('Задача %s (%s) перехвачена другим воркером, попытка %s прервана', job.pk, job.kind, job.attempts)
+        return
+    except JobError as exc:
+        finished = _finish(job, status=Job.FAILED, error=str(exc), finished_at=timezone.now())
+    except Exception as exc:
+        logger.exception('Задача %s (%s) упала на попытке %s', job.pk, job.kind, job.attempts)
+        error = f'{type(exc).__name__}: {exc}'
+        if job.attempts < settings.CRM_JOB_MAX_ATTEMPTS:
+            run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            _finish(job, status=Job.PENDING, error=error, run_after=run_after)
+            return
+        finished = _finish(job, status=Job.FAILED, error=error, finished_at=timezone.now())
+    else:
+        finished = _finish(
+            job, status=Job.SUCCEEDED, result=result, result_file=job.result_file,
+            error='', finished_at=timezone.now(),
+        )
+    # Файл нужен попытке, которая перехватила задачу, если эта уже не её владелец.
+    if finished:
+        _remove_input(job)
+
+
+def save_checkpoint(job, report):
+    """Сохраняет отчёт импорта в params задачи; вызывается в транзакции записанной пачки.
+
+    Повтор задачи продолжит импорт после учтённых строк. Если задачу уже
+    перехватили, JobLost откатывает пачку вместе с позицией.
+    """
+    params = {**job.params, 'checkpoint': report.state()}
+    if not _own(job).update(params=params, progress=report.processed, locked_at=timezone.now()):
+        raise JobLost()
+    job.params = params
+
+
+def report_progress(job, processed):
+    """Прогресс выгрузки (заодно сигнал «воркер жив»); пишется между пачками, когда курсор уже закрыт."""
+    if not _own(job).update(progress=processed, locked_at=timezone.now()):
+        raise JobLost()
+
+
+def run_pending(worker=None):
+    """Выполняет задачи, пока очередь не опустеет; возвращает число выполненных."""
+    worker = worker or worker_name()
+    done = 0
+    while (job := claim_job(worker)) is not None:
+        run_job(job)
+        done += 1
+    return done
+
+
+def _principal(job):
+    principal = principal_cache.get_or_resolve(job.user_id) if job.user_id else None
+    if principal is None or principal.company_id != job.company_id:
+        raise JobError("Автор задачи больше не состоит в компании.")
+    return principal
+
+
+def _export(job, columns, rows):
+    output = job.params.get('output', exports.CSV)
+    if output not in exports.CONTENT_TYPES:
+        raise JobError("Формат выгрузки должен быть csv или ndjson.")
+    job.result_file = f'result-{job.pk}.{output}'
+    lines = 0
+    with open(job_path(job.result_file), 'w', encoding='utf-8', newline='') as target:
+        for line in exports.stream_rows(columns, rows, output):
+            target.write(line)
+            lines += 1
+            if lines % PROGRESS_EVERY == 0:
+                report_progress(job, lines)
+    return {'rows': lines - 1 if output == exports.CSV else lines}
+
+
+@job_handler(EXPORT_PRODUCTS)
+def export_products(job):
+    principal = _principal(job)
+    if principal.storage_id is None:
+        raise JobError("У компании нет склада.")
+    return _export(job, *exports.product_rows(principal.storage_id))
+
+
+@job_handler(EXPORT_SUPPLIERS)
+def export_suppliers(job):
+    return _export(job, *exports.supplier_rows(_principal(job).company_id))
+
+
+@job_handler(EXPORT_SUPPLIES)
+def export_supplies(job):
+    return _export(job, *exports.supply_line_rows(_principal(job).company_id))
+
+
+def _import(job, run_import):
+    principal = _principal(job)
+    state = job.params.get('checkpoint')
+    try:
+        with open(job_path(job.params['input']), 'rb') as source:
+            report = run_import(
+                source, principal, checkpoint=lambda report: save_checkpoint(job, report),
+                report=imports.ImportReport.from_state(state) if state else None,
+            )
+    except (KeyError, FileNotFoundError):
+        raise JobError("Файл для импорта не найден.")
+    except imports.CsvImportError as exc:
+        raise JobError(str(exc))
+    return report.as_dict()
+
+
+@job_handler(IMPORT_PRODUCTS)
+def import_products(job):
+    if _principal(job).storage_id is None:
+        raise JobError("У компании нет склада.")
+    return _import(job, imports.import_products)
+
+
+@job_handler(IMPORT_SUPPLIERS)
+def import_suppliers(job):
+    return _import(job, imports.import_suppliers)
+
+
+def work(stop, poll_interval, once=False):
+    """Цикл воркера: берёт задачи, пока не выставлен stop (threading/multiprocessing Event).
+
+    Текущая задача всегда доводится до конца; если процесс убит, задачу
+    вернёт в очередь recover_stale_jobs у любого другого воркера.
+    """
+    worker = worker_name()
+    while not stop.is_set():
+        job = claim_job(worker)
+        if job is not None:
+            run_job(job)
+            continue
+        if once:
+            return
+        recover_stale_jobs()
+        stop.wait(poll_interval)
@@ -0,0 +1,174 @@
+"""Журнал движений остатков и остатки на момент времени.
+
+Каждое изменение остатка или цены товара (поставка, ручная корректировка,
+правка товара, перенос на другой склад, удаление) добавляет StockMovement
+в той же транзакции. Движения пишутся INSERT ... SELECT из crm_product уже
+после изменения, поэтому quantity и purchase_price в журнале — это
+значения в базе, а не посчитанные в Python.
+
+Снимки (manage.py snapshot_stock, по расписанию) фиксируют остатки склада
+на последнее движение. Остатки на момент T — ближайший снимок не позже T
+плюс движения после него: объём чтения ограничен периодом между снимками,
+а не всей историей. manage.py reconcile_stock сверяет журнал с
+Product.quantity.
+"""
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, Case, ExpressionWrapper, F, Max, Value, When
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot, StockSnapshotLine
+
+CENT = Decimal('0.01')
+
+
+def record_movements(products, kind, delta, quantity=F('quantity'), storage=F('storage_id'), supply_id=None, reason=''):
+    """Движения для товаров queryset products; delta, quantity и storage — выражения по строке товара."""
+    database = router.db_for_write(StockMovement)
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(StockMovement._meta.get_field(name).column)
+        for name in ('storage', 'product_id', 'delta', 'quantity', 'purchase_price', 'kind', 'supply_id', 'reason',
+                     'created_at')
+    )
+    select_sql, params = (
+        products.using(database).order_by()
+        .annotate(
+            movement_storage=ExpressionWrapper(storage, output_field=BigIntegerField()),
+            movement_delta=ExpressionWrapper(delta, output_field=BigIntegerField()),
+            movement_quantity=ExpressionWrapper(quantity, output_field=BigIntegerField()),
+        )
+        .values_list('movement_storage', 'id', 'movement_delta', 'movement_quantity', 'purchase_price')
+        .query.sql_with_params()
+    )
+    moved = ', '.join(
+        f'moved.{quote(name)}'
+        for name in ('movement_storage', 'id', 'movement_delta', 'movement_quantity', 'purchase_price')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(StockMovement._meta.db_table)} ({columns}) '
+            f'SELECT {moved}, %s, %s, %s, %s FROM ({select_sql}) moved',
+            [kind, supply_id, reason, connection.ops.adapt_datetimefield_value(timezone.now()), *params],
+        )
+
+
+def record_increments(increments, kind, batch_size, supply_id=None, reason=''):
+    """Движения после increment_stock: {product_id: прибавленное количество}."""
+    items = list(increments.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        delta = Case(
+            *[When(id=product_id, then=Value(quantity)) for product_id, quantity in batch],
+            output_field=BigIntegerField(),
+        )
+        products = Product.objects.filter(id__in=[product_id for product_id, _ in batch])
+        record_movements(products, kind, delta, supply_id=supply_id, reason=reason)
+
+
+def record_product_update(product, previous_storage_id, previous_price):
+    """Перенос на другой склад или новая цена после сохранения товара."""
+    products = Product.objects.filter(pk=product.pk)
+    if product.storage_id != previous_storage_id:
+        record_movements(
+            products, StockMovement.TRANSFER, -F('quantity'), quantity=Value(0), storage=Value(previous_storage_id),
+        )
+        record_movements(products, StockMovement.TRANSFER, F('quantity'))
+    elif product.purchase_price != previous_price:
+        record_movements(products, StockMovement.UPDATE, Value(0))
+
+
+def record_removal(products):
+    """Списание остатка удаляемых товаров; вызывать до удаления."""
+    record_movements(products.filter(quantity__gt=0), StockMovement.REMOVAL, -F('quantity'), quantity=Value(0))
+
+
+def _replay(storage_id, snapshot, movements):
+    """{product_id: (quantity, purchase_price)} по снимку и движениям после него."""
+    state = {}
+    if snapshot is not None:
+        lines = snapshot.lines.values_list('product_id', 'quantity', 'purchase_price')
+        state = {product_id: (quantity, price) for product_id, quantity, price in lines.iterator(chunk_size=2000)}
+        movements = movements.filter(id__gt=snapshot.last_movement_id)
+    applied = 0
+    rows = movements.filter(storage_id=storage_id).order_by('id').values_list('product_id', 'quantity', 'purchase_price')
+    for product_id, quantity, price in rows.iterator(chunk_size=2000):
+        state[product_id] = (quantity, price)
+        applied += 1
+    return state, applied
+
+
+def inventory_at(storage_id, moment):
+    """Остатки склада на момент moment: (снимок или None, число применённых движений, состояние)."""
+    snapshot = (
+        StockSnapshot.objects.filter(storage_id=storage_id, taken_at__lte=moment).order_by('-taken_at', '-id').first()
+    )
+    state, applied = _replay(storage_id, snapshot, StockMovement.objects.filter(created_at__lte=moment))
+    return snapshot, applied, state
+
+
+def valuation(state):
+    """Строки с ненулевым остатком и их стоимость по цене на тот же момент."""
+    items, total = [], Decimal(0)
+    for product_id, (quantity, price) in sorted(state.items()):
+        if not quantity:
+            continue
+        value = (price * quantity).quantize(CENT)
+        total += value
+        items.append({'product_id': product_id, 'quantity': quantity, 'purchase_price': price, 'value': value})
+    return items, total
+
+
+def take_snapshot(storage_id):
+    """Снимок остатков склада на последнее движение; None, если с прошлого снимка движений не было."""
+    with transaction.atomic():
+        last_id = StockMovement.objects.filter(storage_id=storage_id).aggregate(last=Max('id'))['last']
+        previous = StockSnapshot.objects.filter(storage_id=storage_id).order_by('-taken_at', '-id').first()
+        if last_id is None or (previous is not None and previous.last_movement_id >= last_id):
+            return None
+        state, _ = _replay(storage_id, previous, StockMovement.objects.filter(id__lte=last_id))
+        snapshot = StockSnapshot.objects.create(storage_id=storage_id, taken_at=timezone.now(), last_movement_id=last_id)
+        StockSnapshotLine.objects.bulk_create(
+            [
+                StockSnapshotLine(snapshot=snapshot, product_id=product_id, quantity=quantity, purchase_price=price)
+                for product_id, (quantity, price) in state.items() if quantity
+            ],
+            batch_size=1000,
+        )
+    return snapshot
+
+
+def reconcile(storage_id, full=False):
+    """Расхождения журнала с Product.quantity: [(product_id, quantity, сумма движений, остаток в журнале)].
+
+    Сумма delta считается от последнего снимка (full — от начала журнала)
+    и должна совпасть и с остатком последнего движения, и с товаром.
+    quantity None — товар удалён, а по журналу остаток не нулевой.
+    """
+    snapshot = None
+    if not full:
+        snapshot = StockSnapshot.objects.filter(storage_id=storage_id).order_by('-taken_at', '-id').first()
+    ledger = {}
+    movements = StockMovement.objects.filter(storage_id=storage_id)
+    if snapshot is not None:
+        for product_id, quantity in snapshot.lines.values_list('product_id', 'quantity').iterator(chunk_size=2000):
+            ledger[product_id] = [quantity, quantity]
+        movements = movements.filter(id__gt=snapshot.last_movement_id)
+    rows = movements.order_by('id').values_list('product_id', 'delta', 'quantity')
+    for product_id, delta, quantity in rows.iterator(chunk_size=2000):
+        balance = ledger.setdefault(product_id, [0, 0])
+        balance[0] += delta
+        balance[1] = quantity
+
+    mismatches = []
+    products = Product.objects.filter(storage_id=storage_id).values_list('id', 'quantity')
+    for product_id, quantity in products.iterator(chunk_size=2000):
+        balance, last = ledger.pop(product_id, (0, 0))
+        if not balance == last == quantity:
+            mismatches.append((product_id, quantity, balance, last))
+    for product_id, (balance, last) in ledger.items():
+        if balance or last:
+            mismatches.append((product_id, None, balance, last))
+    return mismatches
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crm.models import User
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает эндпоинт под WSGI, его же под ASGI (синхронное представление в потоке) и '
+        'async-версию /api/async/... под ASGI: RPS и p50/p99 при заданном числе одновременных соединений. Приложения вызываются в этом же процессе, без HTTP-сервера; '
+        'WSGI моделируется потоком на соединение.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', required=True, help='Пользователь, от имени которого идут запросы.')
+        parser.add_argument('--path', default='/api/products/', help='Синхронный путь с параметрами; async — /api/async/...')
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['email']} не найден.")
+        token = f'Bearer {AccessToken.for_user(user)}'
+        path, query = (options['path'].split('?', 1) + [''])[:2]
+        if not path.startswith('/api/'):
+            raise CommandError('--path должен начинаться с /api/.')
+        async_path = '/api/async/' + path[len('/api/'):]
+
+        from config.asgi import application as asgi_application
+        from config.wsgi import application as wsgi_application
+
+        results = [
+            ('WSGI', path, self.run_wsgi(wsgi_application, path, query, token, options)),
+            ('ASGI', path, self.run_asgi(asgi_application, path, query, token, options)),
+            ('ASGI', async_path, self.run_asgi(asgi_application, async_path, query, token, options)),
+        ]
+        for name, url, (elapsed, latencies, errors) in results:
+            self.stdout.write(
+                f'{name} {url}: {len(latencies) / elapsed:8.0f} req/s, '
+                f'p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, '
+                f'p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, errors {errors}'
+            )
+
+    def run_wsgi(self, application, path, query, token, options):
+        latencies, errors = [], []
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                environ = {
+                    'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                    'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': token, 'REMOTE_ADDR': '127.0.0.1',
+                    'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                    'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                    'wsgi.run_once': False,
+                }
+                statuses = []
+                started = time.perf_counter()
+                body = application(environ, lambda status, headers: statuses.append(status))
+                b''.join(body)
+                body.close()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    if not statuses[0].startswith('200'):
+                        errors.append(statuses[0])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for _ in range(options['concurrency']):
+                pool.submit(client)
+        return time.perf_counter() - started, latencies, len(errors)
+
+    def run_asgi(self, application, path, query, token, options):
+        latencies, errors = [], []
+
+        async def request():
+            finished = asyncio.Event()
+            sent = False
+            status = None
+
+            async def receive():
+                nonlocal sent
+                if not sent:
+                    sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                elif not message.get('more_body'):
+                    finished.set()
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+                'query_string': query.encode(), 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                'headers': [(b'host', b'localhost'), (b'authorization', token.encode())],
+            }
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+
+        async def client(remaining):
+            for _ in remaining:
+                await request()
+
+        async def main():
+            remaining = iter(range(options['requests']))
+            await asyncio.gather(*(client(remaining) for _ in range(options['concurrency'])))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        return time.perf_counter() - started, latencies, len(errors)
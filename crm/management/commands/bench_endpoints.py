@@ -0,0 +1,289 @@
+import http.client
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crm.models import User, Company, Product, SupplyProduct, Job
+
+# Дополнительные условия на объект для <pk>: у результата задачи должен быть файл.
+PK_FILTERS = {
+    'job_result': {'status': Job.SUCCEEDED, 'result_file__gt': ''},
+}
+# Потоковые ответы (SSE) не завершаются: замерять нечего, а клиент бенчмарка зависнет.
+STREAMING_ROUTES = {'stock_events'}
+# Значения прочих параметров маршрутов.
+SAMPLE_KWARGS = {
+    'format': '.json',
+}
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон всех GET-эндпоинтов из config/urls.py: req/s, p50/p95/p99 и число '
+        'запросов к базе на эндпоинт. В процессе (WSGI-приложение без HTTP) или через локальный '
+        'HTTP-сервер; результат пишется в JSON и сравнивается с базовым (--baseline).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', required=True, help='Пользователь, от имени которого идут запросы.')
+        parser.add_argument('--mode', choices=['inprocess', 'server'], default='inprocess')
+        parser.add_argument('--url', help='Адрес уже запущенного сервера для --mode server; '
+                                          'без него поднимается локальный сервер на свободном порту.')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на эндпоинт.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=3, help='Запросов на прогрев, не учитываются.')
+        parser.add_argument('--only', action='append', default=[], help='Имя маршрута; можно повторять.')
+        parser.add_argument('--extra', action='append', default=[],
+                            help='Дополнительный путь с параметрами, например /api/products/?q=молоко.')
+        parser.add_argument('--output', help='Куда записать результаты в JSON.')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Допустимый рост p95 относительно базового (0.25 = +25%%).')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['email']} не найден.")
+        self.token = f'Bearer {AccessToken.for_user(user)}'
+        self.wsgi_application = get_wsgi_application()
+
+        endpoints, skipped = self.discover(user, options['only'])
+        endpoints += [(path, iri_to_uri(path)) for path in options['extra']]
+        for name, reason in skipped:
+            self.stdout.write(f'{name}: пропущен ({reason})')
+
+        server = None
+        if options['mode'] == 'server':
+            base_url = options['url']
+            if base_url is None:
+                server, base_url = self.start_server()
+            send = self.http_sender(base_url)
+        else:
+            send = self.send_inprocess
+
+        results = {}
+        try:
+            for name, path in endpoints:
+                results[name] = self.run_endpoint(send, path, options)
+                self.write_result(name, results[name])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        report = {
+            'meta': {
+                'mode': options['mode'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'created_at': timezone.now().isoformat(),
+                'dataset': {
+                    'companies': Company.objects.count(),
+                    'products': Product.objects.count(),
+                    'supply_lines': SupplyProduct.objects.count(),
+                },
+            },
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(report, target, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def discover(self, user, only):
+        """GET-маршруты верхнего уровня с подставленными параметрами из данных компании user."""
+        endpoints, skipped = [], []
+        for pattern in get_resolver().url_patterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name:
+                continue
+            if only and pattern.name not in only:
+                continue
+            if pattern.name in STREAMING_ROUTES:
+                skipped.append((pattern.name, 'бесконечный поток SSE'))
+                continue
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if view_class is not None and not hasattr(view_class, 'get'):
+                continue
+            kwargs = {}
+            for param in pattern.pattern.regex.groupindex:
+                if param == 'pk':
+                    kwargs[param] = self.sample_pk(pattern.name, view_class, user)
+                else:
+                    kwargs[param] = SAMPLE_KWARGS.get(param)
+            missing = [param for param, value in kwargs.items() if value is None]
+            if missing:
+                skipped.append((pattern.name, f"нет значения для {', '.join(missing)}"))
+                continue
+            endpoints.append((pattern.name, reverse(pattern.name, kwargs=kwargs)))
+        return endpoints, skipped
+
+    def sample_pk(self, name, view_class, user):
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        model = getattr(getattr(serializer_class, 'Meta', None), 'model', None)
+        if model is None:
+            return None
+        queryset = model._default_manager.filter(**PK_FILTERS.get(name, {}))
+        field_names = {field.name for field in model._meta.get_fields()}
+        if 'company' in field_names:
+            queryset = queryset.filter(company_id=user.company_id)
+        elif 'storage' in field_names:
+            queryset = queryset.filter(storage__company_id=user.company_id)
+        return queryset.order_by('pk').values_list('pk', flat=True).first()
+
+    def send_inprocess(self, path):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': self.token, 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        statuses = []
+        body = self.wsgi_application(environ, lambda status, headers: statuses.append(status))
+        try:
+            size = sum(len(chunk) for chunk in body)
+        finally:
+            body.close()
+        return int(statuses[0].split()[0]), size
+
+    def http_sender(self, base_url):
+        parts = urlsplit(base_url)
+
+        def send(path):
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+            try:
+                conn.request('GET', parts.path.rstrip('/') + path, headers={'Authorization': self.token})
+                response = conn.getresponse()
+                return response.status, len(response.read())
+            finally:
+                conn.close()
+        return send
+
+    def start_server(self):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        server.set_app(self.wsgi_application)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f'http://127.0.0.1:{server.server_port}'
+
+    def count_queries(self, path):
+        # Считаются на одном запросе в этом потоке после прогрева (кэш Principal уже заполнен);
+        # в режиме server это та же база.
+        with CaptureQueriesContext(connection) as ctx:
+            status, _ = self.send_inprocess(path)
+        return status, len(ctx)
+
+    def run_endpoint(self, send, path, options):
+        for _ in range(options['warmup']):
+            send(path)
+        status, queries = self.count_queries(path)
+
+        latencies, errors, sizes = [], [], []
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                started = time.perf_counter()
+                code, size = send(path)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    sizes.append(size)
+                    if code >= 400:
+                        errors.append(code)
+
+        started = time.perf_counter()
+        if options['concurrency'] <= 1:
+            client()
+        else:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for _ in range(options['concurrency']):
+                    pool.submit(client)
+        wall = time.perf_counter() - started
+
+        return {
+            'path': path,
+            'status': status,
+            'queries': queries,
+            'requests': len(latencies),
+            'errors': len(errors),
+            'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'bytes': int(statistics.median(sizes)),
+        }
+
+    def write_result(self, name, result):
+        self.stdout.write(
+            f"{name:<28} {result['path']:<36} {result['status']} {result['rps']:8.1f} req/s "
+            f"p50 {result['p50_ms']:7.2f} p95 {result['p95_ms']:7.2f} p99 {result['p99_ms']:7.2f} ms "
+            f"queries {result['queries']:>3} errors {result['errors']}"
+        )
+
+    def compare(self, report, baseline_path, tolerance):
+        """Сравнивает с базовым прогоном; рост числа запросов или p95 сверх tolerance — ошибка."""
+        try:
+            with open(baseline_path, encoding='utf-8') as source:
+                data = json.load(source)
+            baseline = data['endpoints']
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f'Не удалось прочитать базовый прогон {baseline_path}: {exc}')
+        if data.get('meta', {}).get('mode') != report['meta']['mode']:
+            self.stdout.write(self.style.WARNING('Базовый прогон снят в другом режиме: задержки несравнимы.'))
+
+        regressions = []
+        for name, result in report['endpoints'].items():
+            base = baseline.get(name)
+            if base is None:
+                self.stdout.write(f'{name}: нет в базовом прогоне')
+                continue
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            self.stdout.write(
+                f"{name:<28} p95 {base['p95_ms']:7.2f} -> {result['p95_ms']:7.2f} ms ({change:+.0%}), "
+                f"queries {base['queries']} -> {result['queries']}"
+            )
+            if result['queries'] > base['queries']:
+                regressions.append(f"{name}: запросов к базе {base['queries']} -> {result['queries']}")
+            if change > tolerance:
+                regressions.append(f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+            if result['errors'] > base['errors']:
+                regressions.append(f"{name}: ошибок {base['errors']} -> {result['errors']}")
+        missing = sorted(set(baseline) - set(report['endpoints']))
+        if missing:
+            self.stdout.write(f"Только в базовом прогоне: {', '.join(missing)}")
+        if regressions:
+            raise CommandError('Регрессии относительно базового прогона:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий относительно базового прогона нет.'))
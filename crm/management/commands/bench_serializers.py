@@ -0,0 +1,80 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.mappers import ValuesMapper
+from crm.models import Company, Storage, Supplier, Product, Supply, SupplyProduct
+from crm.serializers import ProductSerializer, SupplySerializer
+from crm.views import supplies_with_lines
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает ModelSerializer и ValuesMapper на страницах товаров и поставок: '
+        'выборка и сериализация, медиана по повторам. Данные создаются во временной '
+        'транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--supplies', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=5, help='Строк в каждой поставке.')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        company = Company.objects.create(name='Bench', inn='000000000000')
+        storage = Storage.objects.create(company=company, address='Bench')
+        supplier = Supplier.objects.create(company=company, name='Bench', inn='0000000000')
+        products = Product.objects.bulk_create([
+            Product(storage=storage, title=f'Товар {i}', quantity=i, purchase_price=f'{i % 1000}.99')
+            for i in range(options['products'])
+        ])
+        supplies = Supply.objects.bulk_create([Supply(company=company, supplier=supplier) for _ in range(options['supplies'])])
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=supply, product=products[(index + line) % len(products)], quantity=line + 1)
+            for index, supply in enumerate(supplies) for line in range(options['lines'])
+        ])
+
+        cases = [
+            ('products', Product.objects.filter(storage=storage).order_by('id'), ProductSerializer),
+            ('supplies', supplies_with_lines(Supply.objects.filter(company=company)).order_by('-date', '-id'),
+             SupplySerializer),
+        ]
+        for name, queryset, serializer_class in cases:
+            mapper = ValuesMapper(serializer_class)
+
+            def slow():
+                return serializer_class(list(queryset.all()), many=True).data
+
+            def fast():
+                return mapper.to_representation(list(mapper.values(queryset)))
+
+            if [dict(item) for item in slow()] != fast():
+                self.stderr.write(f'{name}: выдача ValuesMapper отличается от сериализатора')
+            slow_time, fast_time = self.measure(slow, options['repeat']), self.measure(fast, options['repeat'])
+            self.stdout.write(
+                f'{name:>9} ({queryset.count()} строк): serializer {slow_time * 1000:8.1f} ms, '
+                f'values {fast_time * 1000:8.1f} ms, x{slow_time / fast_time:.1f}'
+            )
+
+    def measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -0,0 +1,112 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+PROFILES = {
+    # Настройки Django по умолчанию: rollback journal, synchronous=FULL, BEGIN DEFERRED.
+    'default': {'pragmas': {}, 'begin': 'BEGIN', 'timeout': 5},
+    'production': {
+        'pragmas': settings.SQLITE_PRAGMAS,
+        'begin': 'BEGIN IMMEDIATE',
+        'timeout': settings.SQLITE_PRAGMAS['busy_timeout'] / 1000,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность SQLite при конкурентных чтениях и записях для профилей default и production.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--products', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        for name, profile in PROFILES.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = Path(tmp) / 'bench.sqlite3'
+                self.seed(path, profile, options['products'])
+                stats = self.run_profile(path, profile, options)
+            self.stdout.write(
+                f"{name:>10}: reads {stats['reads'] / options['seconds']:9.0f}/s, "
+                f"writes {stats['writes'] / options['seconds']:7.0f}/s, "
+                f"locked errors {stats['locked']}"
+            )
+
+    def connect(self, path, profile):
+        conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None, check_same_thread=False)
+        for pragma, value in profile['pragmas'].items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        return conn
+
+    def seed(self, path, profile, products):
+        conn = self.connect(path, profile)
+        conn.execute('CREATE TABLE product (id INTEGER PRIMARY KEY, storage_id INTEGER, title TEXT, quantity INTEGER)')
+        conn.execute('CREATE INDEX product_storage ON product (storage_id)')
+        conn.execute('CREATE TABLE supply_line (id INTEGER PRIMARY KEY, product_id INTEGER, quantity INTEGER)')
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO product (storage_id, title, quantity) VALUES (?, ?, 0)',
+            ((i % 100, f'Товар {i}') for i in range(products)),
+        )
+        conn.execute('COMMIT')
+        conn.close()
+
+    def run_profile(self, path, profile, options):
+        stats = {'reads': 0, 'writes': 0, 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def count(key):
+            with lock:
+                stats[key] += 1
+
+        def reader():
+            conn = self.connect(path, profile)
+            while time.monotonic() < deadline:
+                try:
+                    conn.execute(
+                        'SELECT id, title, quantity FROM product WHERE storage_id = ? LIMIT 100',
+                        (random.randrange(100),),
+                    ).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError:
+                    count('locked')
+            conn.close()
+
+        def writer():
+            conn = self.connect(path, profile)
+            while time.monotonic() < deadline:
+                product_ids = random.sample(range(1, options['products'] + 1), 10)
+                try:
+                    conn.execute(profile['begin'])
+                    conn.executemany(
+                        'INSERT INTO supply_line (product_id, quantity) VALUES (?, 1)',
+                        ((product_id,) for product_id in product_ids),
+                    )
+                    conn.executemany(
+                        'UPDATE product SET quantity = quantity + 1 WHERE id = ?',
+                        ((product_id,) for product_id in product_ids),
+                    )
+                    conn.execute('COMMIT')
+                    count('writes')
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    count('locked')
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return stats
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from crm.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Строит OpenAPI-схему (JSON и YAML) в CRM_SCHEMA_DIR; запускать при каждом деплое.'
+
+    def handle(self, *args, **options):
+        for path in write_schema():
+            self.stdout.write(self.style.SUCCESS(f'Схема записана: {path}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from crm.events import prune_stock_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление событий остатков старше CRM_STOCK_EVENTS_RETENTION (запускать по расписанию, например '
+        'раз в час). Клиент, переподключившийся после удалённой истории, получает event: reset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention', type=int, help='Срок хранения в секундах вместо настройки.')
+
+    def handle(self, *args, **options):
+        deleted = prune_stock_events(options['retention'])
+        self.stdout.write(f'Удалено событий: {deleted}.')
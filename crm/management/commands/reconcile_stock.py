@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.ledger import reconcile
+from crm.models import Storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет журнал движений с остатками товаров: сумма изменений от последнего снимка '
+        '(с --full — от начала журнала) должна совпадать с остатком в журнале и с Product.quantity. '
+        'При расхождениях завершается с ошибкой.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage', type=int, help='Только этот склад.')
+        parser.add_argument('--full', action='store_true', help='Проверять весь журнал, не доверяя снимкам.')
+
+    def handle(self, *args, **options):
+        storages = Storage.objects.order_by('id')
+        if options['storage'] is not None:
+            storages = storages.filter(pk=options['storage'])
+        found = 0
+        for storage_id in storages.values_list('id', flat=True):
+            for product_id, quantity, balance, last in reconcile(storage_id, full=options['full']):
+                found += 1
+                actual = 'товар удалён' if quantity is None else f'остаток {quantity}'
+                self.stdout.write(
+                    f'Склад {storage_id}, товар {product_id}: {actual}, сумма движений {balance}, '
+                    f'в журнале {last}.'
+                )
+        if found:
+            raise CommandError(f'Расхождений: {found}.')
+        self.stdout.write('Расхождений нет.')
@@ -0,0 +1,58 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from crm.jobs import work
+
+
+def _run_worker(poll_interval, once):
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    try:
+        work(stop, poll_interval, once)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Запускает пул процессов, выполняющих фоновые задачи из таблицы crm_job.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.CRM_JOB_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=settings.CRM_JOB_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true', help='Выйти, когда очередь опустеет.')
+
+    def handle(self, *args, **options):
+        processes, poll_interval, once = options['processes'], options['poll_interval'], options['once']
+        if processes < 1:
+            raise CommandError('--processes должно быть не меньше 1.')
+        if processes == 1:
+            _run_worker(poll_interval, once)
+            return
+
+        # Соединения родителя не должны переходить в дочерние процессы.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_run_worker, args=(poll_interval, once)) for _ in range(processes)]
+        for process in workers:
+            process.start()
+        self.stdout.write(f'Запущено воркеров: {processes}.')
+
+        def forward(signum, frame):
+            for process in workers:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            # SIGINT получает вся группа процессов: воркеры сами доделают текущие задачи.
+            for process in workers:
+                process.join()
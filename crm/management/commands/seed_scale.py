@@ -0,0 +1,154 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from crm.ledger import record_movements
+from crm.models import User, Company, Storage, Supplier, Product, Supply, SupplyProduct, StockMovement
+
+ADJECTIVES = ['Молоко', 'Сыр', 'Кофе', 'Чай', 'Сахар', 'Мука', 'Масло', 'Рис', 'Гречка', 'Соль',
+              'Кабель', 'Болт', 'Гайка', 'Лампа', 'Краска', 'Бумага', 'Клей', 'Перчатки']
+VARIANTS = ['отборный', 'классический', 'премиум', 'эконом', 'фермерский', 'медный', 'стальной',
+            'белый', 'чёрный', 'большой', 'малый', 'упаковка', 'весовой']
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими арендаторами для нагрузочных тестов: компании со складом, '
+        'владельцем и поставщиками, товары, поставки и строки поставок. Большие таблицы пишутся '
+        'executemany пачками по --batch-size строк, остатки товаров сходятся со строками поставок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=1_000_000, help='Всего товаров.')
+        parser.add_argument('--lines', type=int, default=5_000_000, help='Всего строк поставок.')
+        parser.add_argument('--lines-per-supply', type=int, default=5)
+        parser.add_argument('--suppliers', type=int, default=10, help='Поставщиков на компанию.')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней разбросаны поставки.')
+        parser.add_argument('--password', default='Scale-pass-123', help='Пароль всех владельцев.')
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        companies = options['companies']
+        if companies <= 0 or options['products'] < companies or options['lines_per_supply'] <= 0:
+            raise CommandError('Нужна хотя бы одна компания и по товару на компанию.')
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.password = make_password(options['password'])
+        self.next_ids = {
+            model: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            for model in (User, Company, Storage, Supplier, Product, Supply, SupplyProduct)
+        }
+        self.reset_buffers()
+
+        started = time.perf_counter()
+        first_company = self.next_ids[Company]
+        for number in range(companies):
+            products = options['products'] // companies + (number < options['products'] % companies)
+            lines = options['lines'] // companies + (number < options['lines'] % companies)
+            self.add_company(products, lines, options)
+            if len(self.rows[SupplyProduct]) + len(self.rows[Product]) >= options['batch_size'] or number == companies - 1:
+                self.flush()
+                self.report(number + 1, companies, started)
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с. Вход: scale{first_company}@example.com "
+            f"/ {options['password']}"
+        ))
+
+    def allocate(self, model, count=1):
+        first = self.next_ids[model]
+        self.next_ids[model] += count
+        return range(first, first + count)
+
+    def reset_buffers(self):
+        self.objects = {User: [], Company: [], Storage: [], Supplier: []}
+        self.rows = {Product: [], Supply: [], SupplyProduct: []}
+        self.totals = getattr(self, 'totals', dict.fromkeys([Company, Product, Supply, SupplyProduct], 0))
+
+    def add_company(self, product_count, line_count, options):
+        rnd = self.random
+        company_id = self.allocate(Company)[0]
+        storage_id = self.allocate(Storage)[0]
+        self.objects[Company].append(Company(id=company_id, name=f'Компания {company_id}', inn=f'9{company_id:011d}'))
+        self.objects[Storage].append(Storage(id=storage_id, company_id=company_id, address=f'Склад {company_id}'))
+        email = f'scale{company_id}@example.com'
+        self.objects[User].append(User(
+            id=self.allocate(User)[0], email=email, username=email, password=self.password,
+            company_id=company_id, is_company_owner=True,
+        ))
+        supplier_ids = self.allocate(Supplier, options['suppliers'])
+        self.objects[Supplier].extend(
+            Supplier(id=supplier_id, company_id=company_id, name=f'Поставщик {supplier_id}',
+                     inn=f'8{supplier_id:09d}', contact_info=f'+7 900 {supplier_id % 10_000_000:07d}')
+            for supplier_id in supplier_ids
+        )
+
+        product_ids = self.allocate(Product, product_count)
+        quantities = dict.fromkeys(product_ids, 0)
+        per_supply = min(options['lines_per_supply'], product_count)
+        supply_ids = self.allocate(Supply, -(-line_count // per_supply))
+        remaining = line_count
+        for supply_id in supply_ids:
+            date = self.now - timedelta(seconds=rnd.randrange(options['days'] * 86400))
+            self.rows[Supply].append((supply_id, company_id, rnd.choice(supplier_ids), date))
+            count = min(per_supply, remaining)
+            remaining -= count
+            for product_id in rnd.sample(product_ids, count):
+                quantity = rnd.randint(1, 50)
+                quantities[product_id] += quantity
+                self.rows[SupplyProduct].append((self.allocate(SupplyProduct)[0], supply_id, product_id, quantity))
+        self.rows[Product].extend(
+            (product_id, storage_id, f'{rnd.choice(ADJECTIVES)} {rnd.choice(VARIANTS)} {product_id}',
+             quantity, f'{rnd.randint(1, 5000)}.{rnd.randint(0, 99):02d}')
+            for product_id, quantity in quantities.items()
+        )
+
+    def flush(self):
+        with transaction.atomic():
+            for model, objects in self.objects.items():
+                model.objects.bulk_create(objects, batch_size=1000)
+            # Сгенерированные строки считаются записанными до первой синхронизации (sync_seq = 0).
+            now = connection.ops.adapt_datetimefield_value(self.now)
+            self.insert(
+                Product, ['id', 'storage', 'title', 'quantity', 'purchase_price', 'updated_at', 'sync_seq'],
+                [(*row, now, 0) for row in self.rows[Product]],
+            )
+            if self.rows[Product]:
+                # Остатки сгенерированы сразу: в журнал движений они попадают начальными.
+                product_ids = (self.rows[Product][0][0], self.rows[Product][-1][0])
+                record_movements(
+                    Product.objects.filter(id__range=product_ids, quantity__gt=0), StockMovement.OPENING, F('quantity'),
+                )
+            supplies = [
+                (supply_id, company_id, supplier_id, connection.ops.adapt_datetimefield_value(date), now, 0)
+                for supply_id, company_id, supplier_id, date in self.rows[Supply]
+            ]
+            self.insert(Supply, ['id', 'company', 'supplier', 'date', 'updated_at', 'sync_seq'], supplies)
+            self.insert(SupplyProduct, ['id', 'supply', 'product', 'quantity'], self.rows[SupplyProduct])
+        self.totals[Company] += len(self.objects[Company])
+        for model in (Product, Supply, SupplyProduct):
+            self.totals[model] += len(self.rows[model])
+        self.reset_buffers()
+
+    def insert(self, model, fields, rows):
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+    def report(self, done, total, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{done}/{total} компаний: товаров {self.totals[Product]}, поставок {self.totals[Supply]}, '
+            f'строк {self.totals[SupplyProduct]} ({self.totals[SupplyProduct] / elapsed:.0f} строк/с)'
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from crm.ledger import take_snapshot
+from crm.models import Storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Снимок остатков складов по журналу движений (запускать по расписанию, например раз в сутки). '
+        'Остатки на момент времени считаются от ближайшего снимка, поэтому частота снимков ограничивает '
+        'объём чтения /api/stock/at/. Склады без новых движений пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage', type=int, help='Только этот склад.')
+
+    def handle(self, *args, **options):
+        storages = Storage.objects.order_by('id')
+        if options['storage'] is not None:
+            storages = storages.filter(pk=options['storage'])
+        taken = 0
+        for storage_id in storages.values_list('id', flat=True):
+            snapshot = take_snapshot(storage_id)
+            if snapshot is not None:
+                taken += 1
+                self.stdout.write(f'Склад {storage_id}: снимок {snapshot.pk} на движение {snapshot.last_movement_id}.')
+        self.stdout.write(f'Снимков: {taken}.')
@@ -0,0 +1,22 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную SQLite-базу в файл реплики (онлайн-бэкап, запись не блокируется).'
+
+    def handle(self, *args, **options):
+        replica = settings.CRM_DB_REPLICA
+        if not replica:
+            raise CommandError('Реплика не настроена: задайте CRM_DB_REPLICA_NAME.')
+        source = sqlite3.connect(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'])
+        target = sqlite3.connect(settings.DATABASES[replica]['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f'Реплика {settings.DATABASES[replica]["NAME"]} обновлена.'))
@@ -0,0 +1,157 @@
+"""Быстрая сериализация списков из QuerySet.values_list() без ModelSerializer.
+
+ValuesMapper один раз разбирает поля сериализатора и дальше собирает те же
+словари прямо из кортежей строк: модели и объекты полей на каждую строку не
+создаются, to_representation вызывается только там, где значение из базы
+нужно преобразовать (Decimal, даты). Поддерживаются простые поля,
+PrimaryKeyRelatedField, вложенный сериализатор по ForeignKey (через JOIN) и
+вложенный many=True по обратной связи (один запрос на страницу, строки по pk).
+"""
+import decimal
+from collections import defaultdict
+from operator import itemgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+# Поля, у которых to_representation возвращает значение из values_list без изменений.
+PLAIN_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.PrimaryKeyRelatedField)
+
+
+def _column(columns, name):
+    if name not in columns:
+        columns.append(name)
+    return columns.index(name)
+
+
+def _none(row):
+    return None
+
+
+def _converted(index, convert):
+    def get(row):
+        value = row[index]
+        return None if value is None else convert(value)
+    return get
+
+
+def _decimal(field):
+    """DecimalField.to_representation без копирования контекста decimal на каждую строку."""
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            return field.to_representation(value)
+        return '{:f}'.format(value.quantize(exponent, rounding=field.rounding, context=context))
+    return convert
+
+
+def _nested(index, getters):
+    def get(row):
+        if row[index] is None:
+            return None
+        return {name: field(row) for name, field in getters}
+    return get
+
+
+class ValuesMapper:
+    """Представление serializer_class для строк values_list(*mapper.columns).
+
+    Поля разбираются при первом использовании, а не при импорте.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.columns = None
+
+    def compile(self):
+        if self.columns is not None:
+            return
+        columns, many = [], []
+        getters = self._compile(self.serializer_class(), '', columns, many)
+        self.getters = getters
+        self.many = many
+        self.pk_index = _column(columns, self.model._meta.pk.name) if many else None
+        self.columns = columns
+
+    def _compile(self, serializer, prefix, columns, many):
+        getters = []
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if field.source == '*':
+                raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name}: поле без колонки.")
+            source = prefix + field.source.replace('.', '__')
+            if isinstance(field, serializers.ListSerializer):
+                if prefix:
+                    raise ImproperlyConfigured(f"{self.serializer_class.__name__}: many=True только на верхнем уровне.")
+                many.append((field.field_name, field.source, ValuesMapper(type(field.child))))
+                # Значение подставит to_representation; ключ нужен сейчас, чтобы сохранить порядок полей.
+                getters.append((field.field_name, _none))
+            elif isinstance(field, serializers.BaseSerializer):
+                nested = self._compile(field, source + '__', columns, many)
+                getters.append((field.field_name, _nested(_column(columns, source), nested)))
+            elif isinstance(field, PLAIN_FIELDS):
+                getters.append((field.field_name, itemgetter(_column(columns, source))))
+            elif isinstance(field, serializers.DecimalField):
+                getters.append((field.field_name, _converted(_column(columns, source), _decimal(field))))
+            else:
+                getters.append((field.field_name, _converted(_column(columns, source), field.to_representation)))
+        return getters
+
+    def values(self, queryset, extra=()):
+        """values_list с колонками маппера; extra — поля, нужные сверх них (например, для курсора)."""
+        self.compile()
+        extra = [name for name in extra if name not in self.columns]
+        return queryset.prefetch_related(None).values_list(*self.columns, *extra, named=True)
+
+    def to_representation(self, rows):
+        data = self._represent(rows)
+        for name, relation, mapper in self.many:
+            children = list(self._children(relation, mapper, rows))
+            self._attach(data, rows, name, relation, mapper, children)
+        return data
+
+    async def ato_representation(self, rows):
+        """to_representation для async-представлений: вложенные строки читаются через async ORM."""
+        data = self._represent(rows)
+        for name, relation, mapper in self.many:
+            children = [row async for row in self._children(relation, mapper, rows)]
+            self._attach(data, rows, name, relation, mapper, children)
+        return data
+
+    def _represent(self, rows):
+        self.compile()
+        getters = self.getters
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+    def _link(self, relation):
+        return self.model._meta.get_field(relation).field.name
+
+    def _children(self, relation, mapper, rows):
+        """Строки values_list вложенного mapper для всей страницы одним запросом."""
+        mapper.compile()
+        if mapper.many:
+            raise ImproperlyConfigured(f"{mapper.serializer_class.__name__}: вложенные many=True не поддерживаются.")
+        ids = [row[self.pk_index] for row in rows]
+        link = self._link(relation)
+        queryset = mapper.model._default_manager.filter(**{f'{link}__in': ids}).order_by('pk')
+        if not ids:
+            queryset = queryset.none()
+        return mapper.values(queryset, extra=(link,))
+
+    def _attach(self, data, rows, name, relation, mapper, children):
+        link = self._link(relation)
+        groups = defaultdict(list)
+        for row, item in zip(children, mapper.to_representation(children)):
+            groups[getattr(row, link)].append(item)
+        for item, row in zip(data, rows):
+            item[name] = groups[row[self.pk_index]]
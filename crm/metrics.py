@@ -0,0 +1,227 @@
+"""Метрики запросов: SQL, аутентификация, сериализация и общее время.
+
+RequestMetricsMiddleware заводит на каждый запрос RequestMetrics в
+contextvar; обёртка выполнения SQL (connection.execute_wrappers, ставится
+при открытии соединения, поэтому работает и в потоках sync_to_async под
+ASGI) и таймеры auth/serialize пишут в него. По завершении запроса:
+заголовок Server-Timing, лог медленных запросов с самыми дорогими SQL и
+гистограммы по имени маршрута, которые отдаёт /metrics в формате Prometheus.
+Счётчики живут в памяти процесса, как и статистика кэша списков.
+
+db — время выполнения запросов (execute); чтение строк курсором идёт уже
+после обёртки и попадает в serialize/view.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы длительности, секунды.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_ROUTE = 'metrics'
+
+_current = ContextVar('crm_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_time', 'auth_time', 'serialize_time', 'statements')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.auth_time = 0.0
+        self.serialize_time = 0.0
+        # Текст SQL -> [число выполнений, суммарное время]: повторы (N+1) видны одной строкой.
+        self.statements = {}
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        stat = self.statements.get(sql)
+        if stat is None:
+            self.statements[sql] = [1, duration]
+        else:
+            stat[0] += 1
+            stat[1] += duration
+
+    def top_queries(self, limit):
+        return sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+
+def current():
+    return _current.get()
+
+
+def sql_timer(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_sql_timer(sender, connection, **kwargs):
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+class RouteStats:
+    __slots__ = ('buckets', 'count', 'total', 'queries', 'db_time', 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    """Гистограммы длительности и счётчики по (маршрут, метод) в пределах процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, method, status, duration, metrics):
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = RouteStats()
+            stats.buckets[bisect_left(BUCKETS, duration)] += 1
+            stats.count += 1
+            stats.total += duration
+            stats.queries += metrics.queries
+            stats.db_time += metrics.db_time
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        with self._lock:
+            routes = sorted(
+                (key, stats.buckets[:], stats.count, stats.total, stats.queries, stats.db_time, dict(stats.statuses))
+                for key, stats in self._routes.items()
+            )
+        lines = [
+            '# HELP crm_request_duration_seconds Время обработки запроса.',
+            '# TYPE crm_request_duration_seconds histogram',
+        ]
+        for (route, method), buckets, count, total, _, _, _ in routes:
+            labels = f'route="{route}",method="{method}"'
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += value
+                lines.append(f'crm_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'crm_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'crm_request_duration_seconds_count{{{labels}}} {count}')
+        lines += ['# HELP crm_requests_total Запросы по коду ответа.', '# TYPE crm_requests_total counter']
+        for (route, method), _, _, _, _, _, statuses in routes:
+            for status, value in sorted(statuses.items()):
+                lines.append(f'crm_requests_total{{route="{route}",method="{method}",status="{status}"}} {value}')
+        lines += ['# HELP crm_db_queries_total Запросы к базе.', '# TYPE crm_db_queries_total counter']
+        for (route, method), _, _, _, queries, _, _ in routes:
+            lines.append(f'crm_db_queries_total{{route="{route}",method="{method}"}} {queries}')
+        lines += ['# HELP crm_db_seconds_total Время запросов к базе.', '# TYPE crm_db_seconds_total counter']
+        for (route, method), _, _, _, _, db_time, _ in routes:
+            lines.append(f'crm_db_seconds_total{{route="{route}",method="{method}"}} {db_time:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route or 'unmatched'
+
+
+def server_timing(metrics, elapsed):
+    return (
+        f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries", '
+        f'auth;dur={metrics.auth_time * 1000:.2f}, '
+        f'serialize;dur={metrics.serialize_time * 1000:.2f}, '
+        f'view;dur={elapsed * 1000:.2f}'
+    )
+
+
+class RequestMetricsMiddleware:
+    """Собирает RequestMetrics на запрос; стоит первым, чтобы мерить всю цепочку."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        elapsed = perf_counter() - metrics.started
+        route = route_name(request)
+        if route == METRICS_ROUTE:
+            return response
+        registry.observe(route, request.method, response.status_code, elapsed, metrics)
+        if settings.CRM_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(metrics, elapsed)
+        if elapsed * 1000 >= settings.CRM_SLOW_REQUEST_MS:
+            self.log_slow(request, response, metrics, elapsed)
+        return response
+
+    def log_slow(self, request, response, metrics, elapsed):
+        top = '\n'.join(
+            f'  {seconds * 1000:8.2f} ms x{count}: {sql[:500]}'
+            for sql, (count, seconds) in metrics.top_queries(settings.CRM_SLOW_REQUEST_TOP_QUERIES)
+        )
+        logger.warning(
+            'Медленный запрос %s %s -> %s: %.1f ms, запросов к базе %s (%.1f ms), auth %.1f ms, serialize %.1f ms\n%s',
+            request.method, request.get_full_path(), response.status_code, elapsed * 1000,
+            metrics.queries, metrics.db_time * 1000, metrics.auth_time * 1000, metrics.serialize_time * 1000, top,
+        )
+
+
+def metrics_view(request):
+    allowed = settings.CRM_METRICS_ALLOWED_IPS
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
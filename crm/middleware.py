@@ -0,0 +1,75 @@
+"""Встроенные middleware Django с хуками, которые под ASGI выполняются в цикле событий.
+
+MiddlewareMixin.__acall__ под ASGI отправляет каждый process_request и
+process_response в поток через sync_to_async. Это по два перехода на
+middleware на каждый запрос, хотя хуки ниже только читают заголовки и
+cookie. Для них переход в поток нужен лишь тогда, когда хук может
+обратиться к базе: при сохранении сессии или сообщений.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, common, csrf, security
+
+
+class InlineHooksMixin:
+    """__acall__ без sync_to_async для хуков, которые не ходят в базу."""
+
+    def request_needs_thread(self, request):
+        return False
+
+    def response_needs_thread(self, request, response):
+        return False
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            if self.request_needs_thread(request):
+                response = await sync_to_async(self.process_request, thread_sensitive=True)(request)
+            else:
+                response = self.process_request(request)
+        response = response or await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            if self.response_needs_thread(request, response):
+                response = await sync_to_async(self.process_response, thread_sensitive=True)(request, response)
+            else:
+                response = self.process_response(request, response)
+        return response
+
+
+class SecurityMiddleware(InlineHooksMixin, security.SecurityMiddleware):
+    pass
+
+
+class SessionMiddleware(InlineHooksMixin, sessions.SessionMiddleware):
+    def response_needs_thread(self, request, response):
+        session = getattr(request, 'session', None)
+        return session is not None and (session.modified or settings.SESSION_SAVE_EVERY_REQUEST)
+
+
+class CommonMiddleware(InlineHooksMixin, common.CommonMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(InlineHooksMixin, csrf.CsrfViewMiddleware):
+    def request_needs_thread(self, request):
+        # Токен в сессии: чтение загружает её из базы.
+        return settings.CSRF_USE_SESSIONS
+
+
+class AuthenticationMiddleware(InlineHooksMixin, auth.AuthenticationMiddleware):
+    # request.user ленивый: пользователь читается из базы при первом обращении, не здесь.
+    pass
+
+
+class MessageMiddleware(InlineHooksMixin, messages.MessageMiddleware):
+    def response_needs_thread(self, request, response):
+        # update() перечитывает и сохраняет сообщения, только если их читали или добавляли.
+        storage = getattr(request, '_messages', None)
+        return storage is not None and (storage.used or storage.added_new)
+
+
+class XFrameOptionsMiddleware(InlineHooksMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
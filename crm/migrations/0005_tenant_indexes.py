@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_supplier_inn'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='supply',
+            name='company',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='supplies', to='crm.company'),
+        ),
+        migrations.AlterField(
+            model_name='supplyproduct',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='supply_products', to='crm.product'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['storage', 'title'], name='crm_product_storage_title'),
+        ),
+        migrations.AddIndex(
+            model_name='supply',
+            index=models.Index(fields=['company', 'date'], name='crm_supply_company_date'),
+        ),
+        migrations.AddIndex(
+            model_name='supplyproduct',
+            index=models.Index(fields=['product', 'supply'], name='crm_supplyprod_product_supply'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:12
+
+import crm.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+from crm.search import install_product_fts, uninstall_product_fts
+
+
+def install(apps, schema_editor):
+    install_product_fts(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_product_fts(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_tenant_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='crm.product')),
+                ('title', crm.models.SearchTextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'crm_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
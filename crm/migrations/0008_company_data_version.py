@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='data_modified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from crm.search import install_product_fts
+
+
+def install(apps, schema_editor):
+    # На SQLite AddField/RemoveField пересоздают crm_product вместе с триггерами FTS.
+    install_product_fts(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_company_data_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, install),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('sync_seq', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sync_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='sync_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='supply',
+            name='sync_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='supply',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['storage', 'sync_seq'], name='crm_product_storage_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='supplier',
+            index=models.Index(fields=['company', 'sync_seq'], name='crm_supplier_company_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='supply',
+            index=models.Index(fields=['company', 'sync_seq'], name='crm_supply_company_seq'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='company',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='crm.company'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['company', 'sync_seq'], name='crm_tombstone_company_seq'),
+        ),
+        migrations.RunPython(install, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('supply_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('company', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_events', to='crm.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'id'], name='crm_stockevent_company_id')],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def open_ledger(apps, schema_editor):
+    # Текущие остатки становятся первыми движениями журнала: дальше он сходится с Product.quantity.
+    StockMovement = apps.get_model('crm', 'StockMovement')
+    Product = apps.get_model('crm', 'Product')
+    connection = schema_editor.connection
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f'INSERT INTO {quote(StockMovement._meta.db_table)} '
+        f'(storage_id, product_id, kind, delta, quantity, purchase_price, reason, created_at) '
+        f"SELECT storage_id, id, 'opening', quantity, quantity, purchase_price, '', %s "
+        f'FROM {quote(Product._meta.db_table)} WHERE quantity > 0',
+        [connection.ops.adapt_datetimefield_value(timezone.now())],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_stock_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('last_movement_id', models.BigIntegerField()),
+                ('storage', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='crm.storage')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('purchase_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='crm.stocksnapshot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('kind', models.CharField(max_length=20)),
+                ('delta', models.BigIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('purchase_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('supply_id', models.BigIntegerField(blank=True, null=True)),
+                ('reason', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField()),
+                ('storage', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='crm.storage')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['storage', 'id'], name='crm_stockmovement_storage_id')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['storage', 'taken_at'], name='crm_stocksnapshot_storage_at'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,15 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, router, transaction
 from django.core.exceptions import ValidationError
 
 class Company(models.Model):
+    VERSION_FIELDS = ('data_version', 'data_modified_at')
+
     name = models.CharField(max_length=255)
     inn = models.CharField(max_length=12, unique=True)
+    # Версия данных компании для ETag/Last-Modified, см. crm/versioning.py.
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
+    data_modified_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Company"
@@ -13,6 +18,16 @@ class Company(models.Model):
     def __str__(self):
         return f"{self.name} (ИНН: {self.inn})"
 
+    def save(self, *args, **kwargs):
+        # Версию увеличивает только bump_company_version (UPDATE ... + 1): устаревший
+        # экземпляр, например из кэша Principal, не должен откатить её при сохранении.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.VERSION_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -35,43 +50,275 @@ class Storage(models.Model):
         return f"{company_name} — склад: {self.address}"
 
 
-class Supplier(models.Model):
+class SyncedModel(models.Model):
+    """Строка, которую клиенты забирают дельтой через /api/sync/ (crm/sync.py).
+
+    sync_seq — версия данных компании (Company.data_version), с которой строка
+    записана последний раз: save() увеличивает версию и помечает ею строку в
+    одной транзакции. Массовые операции ставят sync_seq и updated_at сами.
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+    sync_seq = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def sync_scope(self):
+        """{'company_id': ...} или {'storage_id': ...}: чью версию увеличивать."""
+        raise NotImplementedError
+
+    def save(self, *args, sync_seq=None, **kwargs):
+        from .versioning import next_version  # versioning импортирует модели
+
+        database = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        # Без точки сохранения: запись и версия откатываются вместе с внешней транзакцией.
+        with transaction.atomic(using=database, savepoint=False):
+            # Версия увеличивается до записи строки: блокировка строки компании держится
+            # до коммита, и порядок sync_seq совпадает с порядком коммитов.
+            self.sync_seq = next_version(**self.sync_scope()) if sync_seq is None else sync_seq
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'sync_seq', 'updated_at'}
+            super().save(*args, **kwargs)
+
+
+class Supplier(SyncedModel):
     company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='suppliers')
     name = models.CharField(max_length=255)
     inn = models.CharField(max_length=12, unique=True)
     contact_info = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'sync_seq'], name='crm_supplier_company_seq'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.company.name})"
 
+    def sync_scope(self):
+        return {'company_id': self.company_id}
+
 
-class Product(models.Model):
+class Product(SyncedModel):
     storage = models.ForeignKey('Storage', on_delete=models.CASCADE, related_name='products')
     title = models.CharField(max_length=255)
     quantity = models.PositiveIntegerField(default=0)
     purchase_price = models.DecimalField(max_digits=12, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['storage', 'title'], name='crm_product_storage_title'),
+            models.Index(fields=['storage', 'sync_seq'], name='crm_product_storage_seq'),
+        ]
+
     def __str__(self):
         return f"{self.title} ({self.quantity})"
 
+    def sync_scope(self):
+        return {'storage_id': self.storage_id}
+
+
+class SearchTextField(models.TextField):
+    """Колонка полнотекстового индекса: поддерживает lookup __match (FTS5 MATCH)."""
+
+
+@SearchTextField.register_lookup
+class Match(models.Lookup):
+    """MATCH по всей таблице FTS5; колонки задаются в самом выражении (title : ...)."""
+    lookup_name = 'match'
 
-class Supply(models.Model):
-    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='supplies')
+    def as_sql(self, compiler, connection):
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{compiler.quote_name_unless_alias(self.lhs.alias)} MATCH {rhs}', rhs_params
+
+
+class ProductSearch(models.Model):
+    """Виртуальная таблица FTS5 над crm_product (только SQLite, см. crm/search.py)."""
+    product = models.OneToOneField(
+        'Product', primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING, related_name='search',
+    )
+    title = SearchTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'crm_product_fts'
+
+
+class Supply(SyncedModel):
+    # Индекс по company покрывает составной (company, date).
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='supplies', db_index=False)
     date = models.DateTimeField(auto_now_add=True)
     supplier = models.ForeignKey('Supplier', on_delete=models.PROTECT, related_name='supplies')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'date'], name='crm_supply_company_date'),
+            models.Index(fields=['company', 'sync_seq'], name='crm_supply_company_seq'),
+        ]
+
     def __str__(self):
         return f"Supply {self.id} from {self.supplier.name} ({self.date})"
 
+    def sync_scope(self):
+        return {'company_id': self.company_id}
+
 
 class SupplyProduct(models.Model):
     supply = models.ForeignKey('Supply', on_delete=models.CASCADE, related_name='supply_products')
-    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='supply_products')
+    # Индекс по product покрывает составной (product, supply).
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='supply_products', db_index=False)
     quantity = models.PositiveIntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'supply'], name='crm_supplyprod_product_supply'),
+        ]
+
     def clean(self):
         if self.quantity <= 0:
             raise ValidationError("Количество товара в поставке должно быть положительным.")
 
     def __str__(self):
         return f"{self.product.title} - {self.quantity} pcs in supply {self.supply.id}"
+
+
+class Tombstone(models.Model):
+    """Удалённая строка товара, поставщика или поставки для /api/sync/."""
+    PRODUCT = 'product'
+    SUPPLIER = 'supplier'
+    SUPPLY = 'supply'
+
+    # Индекс (company, sync_seq) покрывает и внешний ключ.
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='tombstones', db_index=False)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    sync_seq = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'sync_seq'], name='crm_tombstone_company_seq'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} удалён ({self.sync_seq})"
+
+
+class StockEvent(models.Model):
+    """Изменение остатка товара: исходящая очередь потока /api/events/stock/ (crm/events.py).
+
+    id служит Last-Event-ID; ссылки на товар и поставку — просто числа, чтобы
+    удаление товара не трогало уже отправленные события.
+    """
+    # Индекс (company, id) покрывает и внешний ключ.
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='stock_events', db_index=False)
+    product_id = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    supply_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'id'], name='crm_stockevent_company_id'),
+        ]
+
+    def __str__(self):
+        return f"Товар {self.product_id}: {self.quantity}"
+
+
+class StockMovement(models.Model):
+    """Движение остатка товара: журнал только на добавление (crm/ledger.py).
+
+    delta — изменение, quantity и purchase_price — остаток и цена после
+    движения. Товар — просто число: журнал переживает удаление товара.
+    """
+    OPENING = 'opening'
+    SUPPLY = 'supply'
+    ADJUSTMENT = 'adjustment'
+    UPDATE = 'update'
+    TRANSFER = 'transfer'
+    REMOVAL = 'removal'
+
+    # Индекс (storage, id) покрывает и внешний ключ.
+    storage = models.ForeignKey('Storage', on_delete=models.CASCADE, related_name='stock_movements', db_index=False)
+    product_id = models.BigIntegerField()
+    kind = models.CharField(max_length=20)
+    delta = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    purchase_price = models.DecimalField(max_digits=12, decimal_places=2)
+    supply_id = models.BigIntegerField(null=True, blank=True)
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['storage', 'id'], name='crm_stockmovement_storage_id'),
+        ]
+
+    def __str__(self):
+        return f"Товар {self.product_id}: {self.delta:+} ({self.kind})"
+
+
+class StockSnapshot(models.Model):
+    """Остатки склада на момент taken_at: движения журнала до last_movement_id включительно."""
+    # Индекс (storage, taken_at) покрывает и внешний ключ.
+    storage = models.ForeignKey('Storage', on_delete=models.CASCADE, related_name='stock_snapshots', db_index=False)
+    taken_at = models.DateTimeField()
+    last_movement_id = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['storage', 'taken_at'], name='crm_stocksnapshot_storage_at'),
+        ]
+
+    def __str__(self):
+        return f"Снимок склада {self.storage_id} на {self.taken_at}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey('StockSnapshot', on_delete=models.CASCADE, related_name='lines')
+    product_id = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    purchase_price = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return f"Товар {self.product_id}: {self.quantity}"
+
+
+class Job(models.Model):
+    """Фоновая задача (импорт, выгрузка); таблица служит очередью для manage.py runworkers."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (SUCCEEDED, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='jobs')
+    user = models.ForeignKey('User', null=True, on_delete=models.SET_NULL, related_name='jobs')
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    progress = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    result_file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='crm_job_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.kind} ({self.status})"
@@ -0,0 +1,184 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
+
+
+def encode_position(reverse, position):
+    payload = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode()).decode('ascii')
+
+
+def decode_position(encoded, ordering):
+    try:
+        payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        reverse = bool(payload['r'])
+        position = payload['p']
+    except (TypeError, ValueError, KeyError):
+        return None
+    if not isinstance(position, list) or len(position) != len(ordering):
+        return None
+    return Cursor(reverse=reverse, position=position)
+
+
+def position_of(instance, ordering):
+    values = []
+    for order in ordering:
+        field_name = order.lstrip('-')
+        value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+        values.append(str(value))
+    return values
+
+
+def reverse_ordering(ordering):
+    return tuple(order[1:] if order.startswith('-') else '-' + order for order in ordering)
+
+
+def keyset_filter(ordering, position):
+    """Условие «строго после position» для сортировки ordering.
+
+    Для (-date, -id) это date < d OR (date = d AND id < i): индекс
+    (company, date) сразу попадает в нужное место, без OFFSET.
+    """
+    condition = Q()
+    for index, order in enumerate(ordering):
+        field_name = order.lstrip('-')
+        lookup = 'lt' if order.startswith('-') else 'gt'
+        step = Q(**{f'{field_name}__{lookup}': position[index]})
+        for prev_order, prev_value in zip(ordering[:index], position[:index]):
+            step &= Q(**{prev_order.lstrip('-'): prev_value})
+        condition |= step
+    return condition
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация по уникальному составному ключу.
+
+    В отличие от CursorPagination из DRF курсор хранит значения всех полей
+    сортировки, поэтому любая страница выбирается одним WHERE по индексу
+    без OFFSET. Последнее поле сортировки должно быть уникальным (обычно id).
+    """
+    ordering = ('id',)
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset для async-представлений: страница читается через aiterator."""
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def page_queryset(self, queryset, request, view):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor.reverse
+
+        if self.reverse:
+            ordering = reverse_ordering(self.ordering)
+        else:
+            ordering = self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            try:
+                queryset = queryset.filter(keyset_filter(ordering, self.cursor.position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = position_of(self.page[-1], self.ordering)
+            return self.encode_cursor(Cursor(reverse=False, position=position))
+        # Пустая страница при движении назад: продолжаем с того же места.
+        return self.encode_cursor(Cursor(reverse=False, position=self.cursor.position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = position_of(self.page[0], self.ordering)
+            return self.encode_cursor(Cursor(reverse=True, position=position))
+        return self.encode_cursor(Cursor(reverse=True, position=self.cursor.position))
+
+    def get_ordering(self, request, queryset, view):
+        # Представление может подменить сортировку под запрос (например, выдача поиска по релевантности).
+        ordering = getattr(view, 'get_keyset_ordering', lambda: None)()
+        if ordering:
+            return tuple(ordering)
+        return super().get_ordering(request, queryset, view)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        cursor = decode_position(encoded, self.ordering)
+        if cursor is None:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor):
+        encoded = encode_position(cursor.reverse, cursor.position)
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class SupplierPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = 200
+    max_page_size = 2000
+
+
+class SupplyPagination(KeysetPagination):
+    ordering = ('-date', '-id')
+    page_size = 50
+    max_page_size = 500
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import User, Company
+
+
+def _field_values(instance):
+    return tuple((field.attname, getattr(instance, field.attname)) for field in instance._meta.concrete_fields)
+
+
+def _from_values(model, values):
+    instance = model(**dict(values))
+    instance._state.adding = False
+    instance._state.db = DEFAULT_DB_ALIAS
+    return instance
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Контекст арендатора для пользователя: кто он, какая компания и склад."""
+    user_id: int
+    company_id: int | None
+    is_company_owner: bool
+    storage_id: int | None
+    user_values: tuple
+    company_values: tuple | None
+
+    @classmethod
+    def from_user(cls, user):
+        company = user.company
+        storage = getattr(company, 'storage', None) if company is not None else None
+        return cls(
+            user_id=user.pk,
+            company_id=user.company_id,
+            is_company_owner=user.is_company_owner,
+            storage_id=storage.pk if storage is not None else None,
+            user_values=_field_values(user),
+            company_values=_field_values(company) if company is not None else None,
+        )
+
+    def build_user(self):
+        """Собирает свежий экземпляр User (и его Company) без запросов к базе."""
+        user = _from_values(User, self.user_values)
+        user.company = _from_values(Company, self.company_values) if self.company_values is not None else None
+        user.principal = self
+        return user
+
+
+class PrincipalCache:
+    """LRU-кэш Principal по id пользователя с ограничением по размеру и TTL.
+
+    Кэш живёт в памяти процесса; изменения членства в компании сбрасывают
+    его явно через invalidate_users / invalidate_company, а в остальных
+    процессах запись устаревает не позже, чем через CRM_PRINCIPAL_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return principal
+
+    def set(self, principal):
+        expires_at = time.monotonic() + settings.CRM_PRINCIPAL_CACHE_TTL
+        with self._lock:
+            self._entries[principal.user_id] = (expires_at, principal)
+            self._entries.move_to_end(principal.user_id)
+            while len(self._entries) > settings.CRM_PRINCIPAL_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def get_or_resolve(self, user_id):
+        principal = self.get(user_id)
+        if principal is None:
+            user = User.objects.select_related('company__storage').filter(pk=user_id).first()
+            if user is None:
+                return None
+            principal = Principal.from_user(user)
+            self.set(principal)
+        return principal
+
+    async def aget_or_resolve(self, user_id):
+        """Асинхронный вариант get_or_resolve для async-представлений."""
+        principal = self.get(user_id)
+        if principal is None:
+            user = await User.objects.select_related('company__storage').filter(pk=user_id).afirst()
+            if user is None:
+                return None
+            principal = Principal.from_user(user)
+            self.set(principal)
+        return principal
+
+    def invalidate_users(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def invalidate_company(self, company_id):
+        with self._lock:
+            stale = [
+                user_id for user_id, (_, principal) in self._entries.items()
+                if principal.company_id == company_id
+            ]
+            for user_id in stale:
+                del self._entries[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def get_principal(request):
+    """Principal текущего запроса: из аутентификации или из кэша."""
+    user = request.user
+    principal = getattr(user, 'principal', None)
+    if principal is None:
+        principal = principal_cache.get_or_resolve(user.pk)
+        user.principal = principal
+    return principal
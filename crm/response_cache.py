@@ -0,0 +1,92 @@
+"""Кэш сериализованных списков по арендатору (CRM_RESPONSE_CACHE_ALIAS).
+
+Ключ ответа — компания, эндпоинт, версия данных компании и параметры
+запроса. Версию (Company.data_version) ConditionalGetMixin читает из базы
+до выборки в каждом запросе; любая запись увеличивает её в своей
+транзакции (crm/versioning.py). Поэтому ответ, собранный из старых данных,
+лежит под старой версией и после коммита не находится ни в одном процессе,
+а сбрасывать кэш при записи не нужно: старые ответы просто истекают по
+CRM_RESPONSE_CACHE_TIMEOUT.
+"""
+import hashlib
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+PRODUCTS = 'products'
+SUPPLIERS = 'suppliers'
+SUPPLIES = 'supplies'
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов в пределах процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, endpoint, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[endpoint] += 1
+
+    def as_dict(self):
+        with self._lock:
+            endpoints = sorted(set(self.hits) | set(self.misses))
+            return {
+                'hits': sum(self.hits.values()),
+                'misses': sum(self.misses.values()),
+                'endpoints': {
+                    endpoint: {'hits': self.hits[endpoint], 'misses': self.misses[endpoint]}
+                    for endpoint in endpoints
+                },
+            }
+
+    def clear(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[settings.CRM_RESPONSE_CACHE_ALIAS]
+
+
+def response_key(company_id, endpoint, version, request):
+    """version — (data_version, data_modified_at) компании, прочитанные в этом запросе.
+
+    Время изменения тоже входит в ключ: id удалённой компании может достаться
+    новой, и её версии не должны совпасть со старыми ответами.
+    """
+    data_version, modified_at = version
+    params = sorted(request.query_params.lists())
+    # Ссылки пагинации абсолютные, поэтому схема и хост тоже входят в ключ.
+    raw = f'{request.scheme}://{request.get_host()}?{params}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    stamp = modified_at.timestamp() if modified_at is not None else 0
+    return f'crm:resp:{company_id}:{endpoint}:{data_version}:{stamp}:{digest}'
+
+
+def lookup(key, endpoint):
+    data = get_cache().get(key)
+    stats.record(endpoint, data is not None)
+    return data
+
+
+def store(key, data):
+    get_cache().set(key, data, timeout=settings.CRM_RESPONSE_CACHE_TIMEOUT)
+
+
+async def alookup(key, endpoint):
+    data = await get_cache().aget(key)
+    stats.record(endpoint, data is not None)
+    return data
+
+
+async def astore(key, data):
+    await get_cache().aset(key, data, timeout=settings.CRM_RESPONSE_CACHE_TIMEOUT)
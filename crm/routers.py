@@ -0,0 +1,133 @@
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Модели, списки и карточки которых можно читать с реплики.
+REPLICA_MODELS = {'crm.Product', 'crm.Supplier', 'crm.Supply', 'crm.SupplyProduct'}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_allowed = contextvars.ContextVar('crm_replica_allowed', default=False)
+_wrote = contextvars.ContextVar('crm_wrote', default=False)
+_request = contextvars.ContextVar('crm_routing_request', default=None)
+
+
+def pin_key(user_id):
+    return f'crm:primary-pin:{user_id}'
+
+
+def is_pinned(request):
+    """Закреплён ли пользователь запроса за основной базой.
+
+    Пользователь по JWT известен только после аутентификации во view, поэтому
+    закрепление проверяется при первом чтении crm-модели, а не в middleware,
+    и запоминается на запросе после того, как пользователь определён.
+    """
+    if request is None:
+        return False
+    if not hasattr(request, '_crm_primary_pinned'):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        cache = caches[settings.CRM_DB_PIN_CACHE_ALIAS]
+        request._crm_primary_pinned = cache.get(pin_key(user.pk)) is not None
+    return request._crm_primary_pinned
+
+
+def use_replica():
+    return _replica_allowed.get() and not _wrote.get() and not is_pinned(_request.get())
+
+
+class PrimaryReplicaRouter:
+    """Отправляет безопасные чтения crm-моделей на реплику CRM_DB_REPLICA.
+
+    Реплика используется только внутри GET/HEAD/OPTIONS-запроса, который
+    не закреплён за основной базой (см. ReplicaRoutingMiddleware). После
+    первой записи и внутри транзакции все чтения идут в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = settings.CRM_DB_REPLICA
+        if not replica or model._meta.label not in REPLICA_MODELS:
+            return None
+        if use_replica() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Запись в DatabaseCache (кэш списков) не меняет данные и не закрепляет клиента за основной базой.
+        if model._meta.app_label != 'django_cache':
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, settings.CRM_DB_REPLICA}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика — копия основной базы (см. manage.py sync_replica), схему в неё не накатываем.
+        if db == settings.CRM_DB_REPLICA:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Открывает окно чтения с реплики для безопасных запросов.
+
+    После пишущего запроса пользователь закрепляется за основной базой:
+    запись в кэше CRM_DB_PIN_CACHE_ALIAS с TTL CRM_DB_PRIMARY_STICKY_SECONDS.
+    Пока она есть, его чтения идут в основную базу, чтобы он видел свои
+    изменения, даже если реплика отстаёт, с любого клиента и без cookie.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Под ASGI middleware не должен переводить async-представления в поток.
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        tokens = self.open_window(request)
+        try:
+            return self.pin(request, self.get_response(request))
+        finally:
+            self.close_window(tokens)
+
+    async def __acall__(self, request):
+        tokens = self.open_window(request)
+        try:
+            return self.pin(request, await self.get_response(request))
+        finally:
+            self.close_window(tokens)
+
+    def open_window(self, request):
+        return (
+            _replica_allowed.set(request.method in SAFE_METHODS),
+            _wrote.set(False),
+            _request.set(request),
+        )
+
+    def close_window(self, tokens):
+        allowed_token, wrote_token, request_token = tokens
+        _replica_allowed.reset(allowed_token)
+        _wrote.reset(wrote_token)
+        _request.reset(request_token)
+
+    def pin(self, request, response):
+        if _wrote.get() and settings.CRM_DB_REPLICA:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                caches[settings.CRM_DB_PIN_CACHE_ALIAS].set(
+                    pin_key(user.pk), True, settings.CRM_DB_PRIMARY_STICKY_SECONDS,
+                )
+        return response
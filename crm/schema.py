@@ -0,0 +1,123 @@
+"""Заранее построенная OpenAPI-схема и ленивый drf_yasg.
+
+Схема строится один раз — командой manage.py generate_schema (в файлы
+CRM_SCHEMA_DIR) или при первом обращении к документации — и дальше
+отдаётся из памяти с ETag. drf_yasg импортируется только при построении
+схемы или при открытии Swagger UI / ReDoc, а не при загрузке urls.py.
+"""
+import hashlib
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework import permissions
+
+SCHEMA_INFO = {
+    'title': "Final Module API",
+    'default_version': 'v1',
+    'description': "API documentation",
+}
+
+CONTENT_TYPES = {
+    '.json': 'application/json; charset=utf-8',
+    '.yaml': 'application/yaml; charset=utf-8',
+}
+
+Document = namedtuple('Document', ['content', 'etag'])
+
+_documents = {}
+_ui_views = {}
+_lock = threading.Lock()
+
+
+def schema_path(fmt):
+    return Path(settings.CRM_SCHEMA_DIR) / f'openapi{fmt}'
+
+
+def generate_schema():
+    """Обходит все представления и возвращает {'.json': bytes, '.yaml': bytes}."""
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(openapi.Info(**SCHEMA_INFO))
+    schema = generator.get_schema(request=None, public=True)
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write_schema():
+    directory = Path(settings.CRM_SCHEMA_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for fmt, content in generate_schema().items():
+        schema_path(fmt).write_bytes(content)
+        paths.append(schema_path(fmt))
+    reset()
+    return paths
+
+
+def reset():
+    with _lock:
+        _documents.clear()
+
+
+def get_document(fmt):
+    document = _documents.get(fmt)
+    if document is not None:
+        return document
+    with _lock:
+        if not _documents:
+            try:
+                contents = {name: schema_path(name).read_bytes() for name in CONTENT_TYPES}
+            except FileNotFoundError:
+                contents = generate_schema()
+            for name, content in contents.items():
+                _documents[name] = Document(content, f'"{hashlib.md5(content).hexdigest()}"')
+        return _documents[fmt]
+
+
+def schema_view(request, format):
+    document = get_document(format)
+    response = get_conditional_response(request, etag=document.etag)
+    if response is None:
+        response = HttpResponse(document.content, content_type=CONTENT_TYPES[format])
+    response['ETag'] = document.etag
+    # Браузер может хранить схему, но перепроверяет её по ETag после каждого деплоя.
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _build_ui_view(renderer):
+    from drf_yasg import openapi
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from drf_yasg.views import get_schema_view
+
+    class UISchemaGenerator(OpenAPISchemaGenerator):
+        # Страница UI берёт из схемы только заголовок и версию, а саму схему
+        # загружает по SPEC_URL, поэтому представления здесь не обходятся.
+        def get_schema(self, request=None, public=False):
+            return openapi.Swagger(info=self.info, _url=self.url, _prefix='/', paths=openapi.Paths(paths={}))
+
+    view_class = get_schema_view(
+        openapi.Info(**SCHEMA_INFO),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+        generator_class=UISchemaGenerator,
+    )
+    return view_class.with_ui(renderer, cache_timeout=0)
+
+
+def ui_view(request, renderer):
+    if request.GET.get('format') == 'openapi':
+        # Старый адрес схемы drf_yasg (/swagger/?format=openapi).
+        return schema_view(request, '.json')
+    view = _ui_views.get(renderer)
+    if view is None:
+        view = _ui_views.setdefault(renderer, _build_ui_view(renderer))
+    return view(request)
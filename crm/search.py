@@ -0,0 +1,103 @@
+import logging
+import re
+from functools import lru_cache
+
+from django.db import connections
+from django.db.models import F, FloatField, Value
+
+# Сортировка выдачи поиска: сначала релевантность (bm25, меньше — лучше), затем id.
+SEARCH_ORDERING = ('search_rank', 'id')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+FTS_TABLE = 'crm_product_fts'
+
+logger = logging.getLogger(__name__)
+
+# storage_id тоже индексируется: условие «storage_id : N» сужает выдачу внутри
+# самого FTS, и bm25 считается только по товарам склада, а не по всей базе.
+# В ранжировании участвует только title (веса bm25: 0 для storage_id, 1 для title).
+FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        storage_id, title, content='crm_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(0.0, 1.0)')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON crm_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, storage_id, title) VALUES (new.id, new.storage_id, new.title);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON crm_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, storage_id, title)
+        VALUES ('delete', old.id, old.storage_id, old.title);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF storage_id, title ON crm_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, storage_id, title)
+        VALUES ('delete', old.id, old.storage_id, old.title);
+        INSERT INTO {FTS_TABLE}(rowid, storage_id, title) VALUES (new.id, new.storage_id, new.title);
+    END""",
+]
+
+
+def install_product_fts(schema_editor):
+    """Создаёт FTS5-индекс и триггеры синхронизации и перестраивает индекс.
+
+    Идемпотентна: миграции, которые пересоздают crm_product (и тем самым
+    удаляют триггеры), вызывают её повторно.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_SQL:
+        schema_editor.execute(sql)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_product_fts(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('ai', 'ad', 'au'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+# На MySQL/MariaDB сравнение строк регистронезависимо в самой collation, и
+# istartswith — это LIKE 'слово%' без функций над столбцом: он идёт диапазоном по
+# индексу (storage, title). На остальных базах Django оборачивает столбец в UPPER(),
+# и индекс не используется.
+PREFIX_INDEX_VENDORS = frozenset({'mysql'})
+
+
+@lru_cache
+def _warn_unindexed(vendor):
+    # Один раз на процесс и базу: медленный путь не должен быть незаметным.
+    logger.warning(
+        'Поиск товаров на %s идёт без FTS и без индекса: istartswith по всем товарам склада.', vendor,
+    )
+
+
+def search_terms(query):
+    return _TOKEN_RE.findall(query)
+
+
+def search_products(queryset, query, storage_id):
+    """Фильтрует товары склада по словам из query с префиксным совпадением.
+
+    На SQLite запрос идёт в FTS5 и ранжируется по bm25: каждое слово ищется
+    как начало любого слова названия. На других базах название должно
+    начинаться с query целиком (istartswith по словам через пробел, без
+    ранжирования), и такой запрос может идти по индексу (storage, title); если
+    база этого не умеет (PREFIX_INDEX_VENDORS), при первом поиске пишется
+    предупреждение в лог. Выборка получает аннотацию search_rank для
+    сортировки SEARCH_ORDERING.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        expression = ' AND '.join([f'storage_id : "{storage_id}"'] + [f'title : "{term}"*' for term in terms])
+        return queryset.filter(search__title__match=expression).annotate(search_rank=F('search__rank'))
+    if vendor not in PREFIX_INDEX_VENDORS:
+        _warn_unindexed(vendor)
+    return queryset.filter(title__istartswith=' '.join(terms)).annotate(
+        search_rank=Value(0.0, output_field=FloatField()),
+    )
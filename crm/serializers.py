@@ -1,8 +1,34 @@
+from collections import defaultdict
+from time import perf_counter
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
 from rest_framework import serializers
-from .models import User, Company, Storage, Supplier, Product, SupplyProduct, Supply
+from .models import User, Company, Storage, Supplier, Product, SupplyProduct, Supply, Job, StockMovement
+from . import events, ledger, metrics
+from .principal import get_principal
+from .validators import INN_ERROR, is_valid_inn
+from .stock import STOCK_UPDATE_BATCH_SIZE, StockConflict, increment_stock, locked_products, run_stock_transaction
+from .versioning import next_version
 from django.contrib.auth.password_validation import validate_password
 
 
+class TimedSerializerMixin:
+    """Время to_representation верхнего уровня попадает в метрики запроса (serialize)."""
+
+    def to_representation(self, instance):
+        request_metrics = metrics.current()
+        # Вложенные сериализаторы уже учтены во времени родителя.
+        if request_metrics is None or (self.parent is not None and self.parent is not self.root):
+            return super().to_representation(instance)
+        started = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            request_metrics.serialize_time += perf_counter() - started
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     password2 = serializers.CharField(write_only=True, required=True)
@@ -22,34 +48,71 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = ['id', 'name', 'inn']
 
 
-class StorageSerializer(serializers.ModelSerializer):
+class StorageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Storage
         fields = ['id', 'company', 'address']
         read_only_fields = ['company']
 
 
-class SupplierSerializer(serializers.ModelSerializer):
+class SupplierSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Supplier
-        fields = ['id', 'company', 'name', 'contact_info']
+        fields = ['id', 'company', 'name', 'inn', 'contact_info']
         read_only_fields = ['company']
 
+    def validate_inn(self, value):
+        if not is_valid_inn(value):
+            raise serializers.ValidationError(INN_ERROR)
+        return value
+
+
+class SupplierUpsertSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    inn = serializers.CharField(max_length=12)
+    contact_info = serializers.CharField(required=False, allow_blank=True, default='')
 
-class ProductSerializer(serializers.ModelSerializer):
+    def validate_inn(self, value):
+        if not is_valid_inn(value):
+            raise serializers.ValidationError(INN_ERROR)
+        return value
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'storage', 'title', 'quantity', 'purchase_price']
         read_only_fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        # Сохраняем только изменённые колонки, чтобы не затереть quantity,
+        # которую параллельно увеличивают поставки.
+        previous = instance.storage_id, instance.purchase_price
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        with transaction.atomic(savepoint=False):
+            instance.save(update_fields=list(validated_data))
+            ledger.record_product_update(instance, *previous)
+        return instance
+
+
+class StockAdjustmentSerializer(serializers.Serializer):
+    delta = serializers.IntegerField()
+    reason = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+    def validate_delta(self, value):
+        if value == 0:
+            raise serializers.ValidationError("Изменение остатка не может быть нулевым.")
+        return value
+
 
-class SupplyProductSerializer(serializers.ModelSerializer):
+class SupplyProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product_id = serializers.IntegerField(write_only=True)
     product = ProductSerializer(read_only=True)
 
@@ -58,7 +121,7 @@ class SupplyProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_id', 'quantity']
 
 
-class SupplySerializer(serializers.ModelSerializer):
+class SupplySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     supply_products = SupplyProductSerializer(many=True)
 
     class Meta:
@@ -68,27 +131,82 @@ class SupplySerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         supply_products_data = validated_data.pop('supply_products')
-        company = self.context['request'].user.company
-        if company is None:
+        request = self.context['request']
+        principal = get_principal(request)
+        if principal.company_id is None:
             raise serializers.ValidationError("Пользователь не привязан к компании.")
-        validated_data['company'] = company
-        supply = Supply.objects.create(**validated_data)
+        validated_data['company'] = request.user.company
 
         for item in supply_products_data:
-            product_id = item.get('product_id')
-            quantity = item.get('quantity')
-
-            if quantity <= 0:
+            if item.get('quantity') <= 0:
                 raise serializers.ValidationError("Количество товара должно быть положительным.")
 
-            try:
-                product = Product.objects.get(id=product_id, storage__company=company)
-            except Product.DoesNotExist:
-                raise serializers.ValidationError(f"Товар с id {product_id} не найден или не принадлежит вашей компании.")
+        increments = defaultdict(int)
+        for item in supply_products_data:
+            increments[item.get('product_id')] += item.get('quantity')
+
+        def write_supply():
+            # Версия берётся первой: строка компании блокируется раньше строк товаров.
+            seq = next_version(company_id=principal.company_id)
+            products = locked_products(Product.objects.filter(storage_id=principal.storage_id)).in_bulk(list(increments))
+            for item in supply_products_data:
+                if item.get('product_id') not in products:
+                    raise serializers.ValidationError(
+                        f"Товар с id {item.get('product_id')} не найден или не принадлежит вашей компании."
+                    )
+            supply = Supply(**validated_data)
+            supply.save(sync_seq=seq)
+            lines = SupplyProduct.objects.bulk_create([
+                SupplyProduct(supply=supply, product=products[item.get('product_id')], quantity=item.get('quantity'))
+                for item in supply_products_data
+            ])
+            increment_stock(increments, seq)
+            ledger.record_increments(increments, StockMovement.SUPPLY, STOCK_UPDATE_BATCH_SIZE, supply_id=supply.pk)
+            events.record_stock_changes(principal.company_id, increments, supply.pk, STOCK_UPDATE_BATCH_SIZE)
+            transaction.on_commit(events.broker.notify)
+            return supply, products, lines
+
+        try:
+            supply, products, lines = run_stock_transaction(write_supply)
+        except StockConflict:
+            raise serializers.ValidationError("Остатки изменились во время проведения поставки, повторите запрос.")
+
+        for product_id, quantity in increments.items():
+            products[product_id].quantity += quantity
+        supply_products = supply.supply_products.all()
+        supply_products._result_cache = lines
+        supply_products._prefetch_done = True
+        supply._prefetched_objects_cache = {'supply_products': supply_products}
+        return supply
+
 
-            SupplyProduct.objects.create(supply=supply, product=product, quantity=quantity)
 
-            product.quantity += quantity
-            product.save()
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    result_url = serializers.SerializerMethodField()
 
-        return supply
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'progress', 'result', 'result_url', 'error',
+                  'created_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_result_url(self, obj):
+        if not obj.result_file:
+            return None
+        return self.context['request'].build_absolute_uri(reverse('job_result', args=[obj.pk]))
+
+
+class BatchItemSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False, allow_null=True)
+
+
+class BatchSerializer(serializers.Serializer):
+    atomic = serializers.BooleanField(default=False)
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.CRM_BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f"В пакете не больше {settings.CRM_BATCH_MAX_REQUESTS} запросов.")
+        return value
@@ -0,0 +1,102 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connections, models, router, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Product
+
+STOCK_UPDATE_BATCH_SIZE = 500
+MAX_BACKOFF_DOUBLINGS = 5
+
+LOCK = 'lock'
+RETRY = 'retry'
+
+
+class StockConflict(Exception):
+    """Остатки изменились параллельно (например, товар удалён) — операцию нужно повторить."""
+
+
+class NegativeStock(Exception):
+    """Списание больше текущего остатка."""
+
+
+def increment_stock(increments, sync_seq):
+    """Прибавляет остатки одним UPDATE на пачку товаров: {product_id: quantity}.
+
+    Увеличение считается в базе (quantity = quantity + N) и из данных трогает
+    только колонку quantity, поэтому параллельные поставки не теряют друг
+    друга; товары помечаются версией sync_seq для /api/sync/.
+    """
+    now = timezone.now()
+    items = list(increments.items())
+    for start in range(0, len(items), STOCK_UPDATE_BATCH_SIZE):
+        batch = items[start:start + STOCK_UPDATE_BATCH_SIZE]
+        updated = Product.objects.filter(id__in=[product_id for product_id, _ in batch]).update(
+            quantity=F('quantity') + Case(
+                *[When(id=product_id, then=Value(quantity)) for product_id, quantity in batch],
+                output_field=models.PositiveIntegerField(),
+            ),
+            sync_seq=sync_seq,
+            updated_at=now,
+        )
+        if updated != len(batch):
+            raise StockConflict()
+
+
+def adjust_stock(queryset, delta, sync_seq):
+    """Меняет остаток одного товара на delta, не опуская его ниже нуля.
+
+    Проверка и изменение — один условный UPDATE, поэтому параллельная
+    поставка или списание не приводят к отрицательному остатку.
+    Возвращает False, если товара в queryset нет.
+    """
+    updated = queryset.filter(quantity__gte=max(-delta, 0)).update(
+        quantity=F('quantity') + delta, sync_seq=sync_seq, updated_at=timezone.now(),
+    )
+    if not updated:
+        if not queryset.exists():
+            return False
+        raise NegativeStock()
+    return True
+
+
+def contention_mode():
+    """CRM_STOCK_CONTENTION_MODE с поправкой на базу.
+
+    Без SELECT ... FOR UPDATE (SQLite) select_for_update ничего не блокирует,
+    поэтому LOCK там работает как RETRY: одна попытка без блокировки не
+    защищала бы от конфликтов.
+    """
+    mode = settings.CRM_STOCK_CONTENTION_MODE
+    if mode == LOCK and not connections[router.db_for_write(Product)].features.has_select_for_update:
+        return RETRY
+    return mode
+
+
+def locked_products(queryset):
+    """Блокирует строки товаров в режиме LOCK; в режиме RETRY читает без блокировок."""
+    if contention_mode() == LOCK:
+        return queryset.select_for_update()
+    return queryset
+
+
+def run_stock_transaction(func):
+    """Выполняет func() в транзакции с учётом contention_mode().
+
+    LOCK — одна попытка, строки товаров блокируются через select_for_update.
+    RETRY — оптимистично: при конфликте или занятой базе транзакция
+    повторяется с экспоненциальной задержкой.
+    """
+    attempts = settings.CRM_STOCK_RETRY_ATTEMPTS if contention_mode() == RETRY else 1
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                return func()
+        except (StockConflict, OperationalError):
+            if attempt == attempts:
+                raise
+            delay = settings.CRM_STOCK_RETRY_BACKOFF * 2 ** min(attempt - 1, MAX_BACKOFF_DOUBLINGS)
+            time.sleep(delay * random.uniform(0.5, 1.5))
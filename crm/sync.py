@@ -0,0 +1,154 @@
+"""Дельта-синхронизация для офлайн-клиентов: GET /api/sync/?since=<курсор>.
+
+Каждая запись товара, поставщика или поставки помечается sync_seq — новой
+версией данных компании (crm/versioning.py), удаление оставляет Tombstone
+с той же версией. Версия увеличивается под блокировкой строки компании,
+которая держится до коммита, поэтому порядок версий совпадает с порядком
+коммитов и курсор ничего не пропускает. Выборка идёт по индексам
+(склад или компания, sync_seq): стоимость пропорциональна числу изменений,
+а не размеру каталога.
+
+Изменения отдаются одним списком по (версия, источник, id) страницами по
+CRM_SYNC_PAGE_SIZE; курсор указывает позицию в этом порядке, поэтому и
+пачка импорта с одной версией делится на страницы. Курсор от другой
+компании или новее её текущей версии (компания удалена, id занят заново)
+даёт reset: true и выгрузку с начала; удаление самой компании клиенты
+узнают так же. В первой выгрузке (без since) надгробий нет.
+"""
+from heapq import merge
+
+from django.db import connections, router
+from django.utils import timezone
+
+from .models import Company, Tombstone
+
+_INITIAL = (-1, 0, 0)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class Source:
+    """Изменяемые строки одного типа: queryset компании и сериализатор для них."""
+
+    def __init__(self, kind, queryset, serializer_class):
+        self.kind = kind
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+
+
+def record_deletion(kind, company_id, object_id, sync_seq):
+    Tombstone.objects.create(
+        company_id=company_id, model=kind, object_id=object_id, sync_seq=sync_seq, deleted_at=timezone.now(),
+    )
+
+
+def record_deletions(queryset, kind, company_id, sync_seq):
+    """Надгробия для всех строк queryset одним INSERT ... SELECT; вызывать до удаления."""
+    database = router.db_for_write(Tombstone)
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    pk = queryset.model._meta.pk
+    select_sql, params = queryset.using(database).values_list(pk.name).query.sql_with_params()
+    columns = ', '.join(
+        quote(Tombstone._meta.get_field(name).column)
+        for name in ('company', 'model', 'object_id', 'sync_seq', 'deleted_at')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(Tombstone._meta.db_table)} ({columns}) '
+            f'SELECT %s, %s, deleted.{quote(pk.column)}, %s, %s FROM ({select_sql}) deleted',
+            [company_id, kind, sync_seq, connection.ops.adapt_datetimefield_value(timezone.now()), *params],
+        )
+
+
+def touch(queryset, sync_seq):
+    """Помечает строки изменёнными (например, поставки, у которых удалены строки с товарами)."""
+    return queryset.update(sync_seq=sync_seq, updated_at=timezone.now())
+
+
+def make_cursor(company_id, position):
+    return '.'.join(str(part) for part in (company_id, *position))
+
+
+def parse_cursor(value):
+    parts = value.split('.')
+    if len(parts) != 4 or not all(part.isdigit() for part in parts):
+        raise InvalidCursor()
+    company_id, *position = map(int, parts)
+    return company_id, tuple(position)
+
+
+def _after(queryset, source_index, position):
+    """Строки источника source_index строго после position = (версия, источник, id)."""
+    seq, index, last_id = position
+    if source_index < index:
+        return queryset.filter(sync_seq__gt=seq)
+    if source_index > index:
+        return queryset.filter(sync_seq__gte=seq)
+    # Диапазон от seq по индексу (…, sync_seq), уже отданные строки версии seq отбрасываются.
+    return queryset.filter(sync_seq__gte=seq).exclude(sync_seq=seq, pk__lte=last_id)
+
+
+def changes(principal, sources, since, limit, context=None):
+    """Страница изменений после курсора since (None — выгрузка с начала)."""
+    # Версия, строки и надгробия читаются из одной базы: с версией основной базы
+    # курсор при отстающей реплике ушёл бы дальше строк, которых на ней ещё нет.
+    database = router.db_for_read(sources[0].queryset.model)
+    version = (
+        Company.objects.using(database).filter(pk=principal.company_id)
+        .values_list('data_version', flat=True).first()
+    ) or 0
+    position, reset = _INITIAL, False
+    if since is not None:
+        company_id, position = parse_cursor(since)
+        if company_id != principal.company_id or position[0] > version:
+            position, reset = _INITIAL, True
+
+    querysets = [source.queryset.using(database) for source in sources]
+    deleted = len(sources)
+    if position != _INITIAL:
+        querysets.append(Tombstone.objects.using(database).filter(company_id=principal.company_id))
+    # Сначала только ключи (sync_seq, id) по индексу, не больше limit + 1 с каждого источника.
+    keys = [
+        [(seq, index, pk) for seq, pk in
+         _after(queryset, index, position).filter(sync_seq__lte=version)
+         .order_by('sync_seq', 'pk').values_list('sync_seq', 'pk')[:limit + 1]]
+        for index, queryset in enumerate(querysets)
+    ]
+    page = list(merge(*keys))[:limit + 1]
+    has_more = len(page) > limit
+    page = page[:limit]
+    # Полная страница заканчивается на последней отданной строке, неполная — на текущей версии.
+    end = page[-1] if has_more else (version, len(querysets), 0)
+
+    # Строки, удалённые между двумя запросами, пропускаются: их надгробие новее version.
+    found = {}
+    for index, queryset in enumerate(querysets):
+        ids = [pk for _, source_index, pk in page if source_index == index]
+        if not ids:
+            continue
+        objects = queryset.in_bulk(ids)
+        if index == deleted:
+            found[index] = objects
+        else:
+            rows = [objects[pk] for pk in ids if pk in objects]
+            data = sources[index].serializer_class(rows, many=True, context=context).data
+            found[index] = {row.pk: item for row, item in zip(rows, data)}
+
+    items = []
+    for seq, index, pk in page:
+        row = found[index].get(pk)
+        if row is None:
+            continue
+        if index == deleted:
+            items.append({'seq': seq, 'type': row.model, 'id': row.object_id, 'deleted': True})
+        else:
+            items.append({'seq': seq, 'type': sources[index].kind, 'id': pk, 'deleted': False, 'data': row})
+    return {
+        'cursor': make_cursor(principal.company_id, end),
+        'reset': reset,
+        'has_more': has_more,
+        'changes': items,
+    }
@@ -1,3 +1,2112 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient, APITestCase
+
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import events, exports, imports, jobs, ledger, metrics, response_cache, schema, search, stock, versioning
+from .authentication import CachedJWTAuthentication
+from .management.commands import bench_endpoints
+from .models import (
+    User, Company, Storage, Supplier, Product, Supply, SupplyProduct, StockEvent, StockMovement, StockSnapshot, Job,
+)
+from .principal import Principal, principal_cache
+from .routers import PrimaryReplicaRouter, _replica_allowed, _wrote
+
+
+class CrmTestMixin:
+    # Кэш списков включается только там, где проверяется он сам.
+    response_cache_alias = None
+
+    def setUp(self):
+        super().setUp()
+        principal_cache.clear()
+        # Тестовая база медленнее боевой: лог медленных запросов проверяется отдельно (RequestMetricsTests).
+        settings_override = override_settings(
+            CRM_RESPONSE_CACHE_ALIAS=self.response_cache_alias, CRM_SLOW_REQUEST_MS=60_000,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        if self.response_cache_alias:
+            response_cache.get_cache().clear()
+            response_cache.stats.clear()
+
+    def authenticate(self, user):
+        self.client.force_authenticate(user)
+        principal_cache.get_or_resolve(user.pk)
+
+    def create_tenant(self, inn='123456789012', email='owner@example.com'):
+        company = Company.objects.create(name='ООО Тест', inn=inn)
+        storage = Storage.objects.create(company=company, address='Склад 1')
+        user = User.objects.create_user(
+            email=email, username=email, password='Secret-pass-123',
+            company=company, is_company_owner=True,
+        )
+        return company, storage, user
+
+    def create_products(self, storage, count):
+        return Product.objects.bulk_create([
+            Product(storage=storage, title=f'Товар {i}', purchase_price='10.00') for i in range(count)
+        ])
+
+
+class SupplyCreateTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.authenticate(self.user)
+
+    def post_supply(self, lines):
+        return self.client.post('/api/supplies/', {
+            'supplier': self.supplier.id,
+            'supply_products': [{'product_id': pid, 'quantity': qty} for pid, qty in lines],
+        }, format='json')
+
+    def test_stock_is_incremented(self):
+        first, second = self.create_products(self.storage, 2)
+        response = self.post_supply([(first.id, 5), (second.id, 3), (first.id, 2)])
+
+        self.assertEqual(response.status_code, 201)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.quantity, 7)
+        self.assertEqual(second.quantity, 3)
+        self.assertEqual(SupplyProduct.objects.count(), 3)
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        products = self.create_products(self.storage, 50)
+
+        counts = []
+        for lines in (products[:1], products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.post_supply([(p.id, 1) for p in lines])
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_foreign_product_rejects_whole_supply(self):
+        product = self.create_products(self.storage, 1)[0]
+        other_company, other_storage, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        foreign = self.create_products(other_storage, 1)[0]
+
+        response = self.post_supply([(product.id, 5), (foreign.id, 5)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Supply.objects.exists())
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+
+    def test_product_update_does_not_overwrite_quantity(self):
+        product = self.create_products(self.storage, 1)[0]
+        stale = Product.objects.get(id=product.id)
+        self.post_supply([(product.id, 5)])
+
+        response = self.client.patch(f'/api/products/{stale.id}/', {'title': 'Новое название'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 5)
+        self.assertEqual(product.title, 'Новое название')
+
+
+@override_settings(CRM_STOCK_CONTENTION_MODE='retry', CRM_STOCK_RETRY_ATTEMPTS=50, CRM_STOCK_RETRY_BACKOFF=0.005)
+class ConcurrentSupplyTests(CrmTestMixin, TransactionTestCase):
+    threads = 8
+    supplies_per_thread = 5
+
+    def test_parallel_supplies_do_not_lose_increments(self):
+        company, storage, user = self.create_tenant()
+        supplier = Supplier.objects.create(company=company, name='Поставщик', inn='1234567890')
+        first, second = self.create_products(storage, 2)
+        errors = []
+
+        def worker():
+            client = APIClient()
+            client.force_authenticate(user)
+            # Тестовая база — общая in-memory SQLite (shared cache), где читатели
+            # блокируются табличными локами писателя; в файловой базе этого нет.
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA read_uncommitted = 1')
+            try:
+                for _ in range(self.supplies_per_thread):
+                    response = client.post('/api/supplies/', {
+                        'supplier': supplier.id,
+                        'supply_products': [
+                            {'product_id': first.id, 'quantity': 3},
+                            {'product_id': second.id, 'quantity': 1},
+                        ],
+                    }, format='json')
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.threads * self.supplies_per_thread
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.quantity, 3 * total)
+        self.assertEqual(second.quantity, total)
+        self.assertEqual(Supply.objects.count(), total)
+
+
+@override_settings(CRM_STOCK_CONTENTION_MODE='lock')
+class ConcurrentSupplyLockModeTests(ConcurrentSupplyTests):
+    def test_lock_mode_retries_without_row_locks(self):
+        with mock.patch.object(connection.features, 'has_select_for_update', False):
+            self.assertEqual(stock.contention_mode(), stock.RETRY)
+            self.assertFalse(stock.locked_products(Product.objects.all()).query.select_for_update)
+        with mock.patch.object(connection.features, 'has_select_for_update', True):
+            self.assertEqual(stock.contention_mode(), stock.LOCK)
+            self.assertTrue(stock.locked_products(Product.objects.all()).query.select_for_update)
+
+
+class SupplyListQueryTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.products = self.create_products(self.storage, 5)
+        self.authenticate(self.user)
+
+    def create_supplies(self, count):
+        supplies = Supply.objects.bulk_create([
+            Supply(company=self.company, supplier=self.supplier) for _ in range(count)
+        ])
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=supply, product=product, quantity=1)
+            for supply in supplies for product in self.products
+        ])
+        return supplies
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_list_query_count_is_constant(self):
+        self.create_supplies(1)
+        small, _ = self.count_queries('/api/supplies/')
+        self.create_supplies(30)
+        large, response = self.count_queries('/api/supplies/')
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data['results']), 31)
+        self.assertEqual(len(response.data['results'][0]['supply_products']), 5)
+        self.assertEqual(response.data['results'][0]['supply_products'][0]['product']['title'], 'Товар 0')
+
+    def test_detail_query_count(self):
+        supply = self.create_supplies(1)[0]
+        queries, response = self.count_queries(f'/api/supplies/{supply.id}/')
+
+        self.assertEqual(len(response.data['supply_products']), 5)
+        # версия данных компании, поставка и её строки вместе с товарами
+        self.assertEqual(queries, 3)
+
+
+class KeysetPaginationTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.authenticate(self.user)
+
+    def walk(self, url):
+        pages, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            queries.append(ctx.captured_queries[-1]['sql'])
+            url = response.data['next']
+        return pages, queries
+
+    def test_products_are_paged_by_id_without_offset(self):
+        products = self.create_products(self.storage, 25)
+
+        pages, queries = self.walk('/api/products/?page_size=10')
+
+        ids = [item['id'] for page in pages for item in page['results']]
+        self.assertEqual(ids, [p.id for p in products])
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertTrue(all('OFFSET' not in sql for sql in queries))
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_previous_link_returns_same_page(self):
+        self.create_products(self.storage, 25)
+        first = self.client.get('/api/products/?page_size=10').data
+        second = self.client.get(first['next']).data
+
+        back = self.client.get(second['previous']).data
+
+        self.assertEqual(back['results'], first['results'])
+        self.assertFalse(back['previous'])
+
+    def test_supplies_are_ordered_by_date_and_id(self):
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        supplies = Supply.objects.bulk_create([Supply(company=self.company, supplier=supplier) for _ in range(7)])
+        Supply.objects.update(date=supplies[0].date)
+
+        pages, _ = self.walk('/api/supplies/?page_size=3')
+
+        ids = [item['id'] for page in pages for item in page['results']]
+        self.assertEqual(ids, sorted((s.id for s in supplies), reverse=True))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class PrincipalCacheTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_principal_is_resolved_once(self):
+        self.create_products(self.storage, 3)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/api/products/')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/api/products/')
+
+        self.assertEqual(len(response.data['results']), 3)
+        # principal, версия данных компании и страница товаров
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+
+    def test_attach_user_invalidates_cached_principal(self):
+        employee = User.objects.create_user(email='emp@example.com', username='emp', password='Secret-pass-123')
+        employee_client = self.client_class()
+        employee_client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(employee)}')
+        self.assertEqual(employee_client.get('/api/company/detail/').status_code, 400)
+
+        response = self.client.post('/api/company/attach-user/', {'user_id': employee.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        response = employee_client.get('/api/company/detail/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.company.id)
+
+    def test_storage_changes_invalidate_company(self):
+        self.assertEqual(self.client.delete('/api/storage/detail/').status_code, 204)
+        self.assertEqual(self.client.get('/api/products/').data['results'], [])
+
+        response = self.client.post('/api/storage/', {'address': 'Склад 2'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/api/storage/detail/').data['address'], 'Склад 2')
+
+
+@override_settings(CRM_DB_REPLICA='replica')
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.tokens = [_replica_allowed.set(True), _wrote.set(False)]
+
+    def tearDown(self):
+        _wrote.reset(self.tokens[1])
+        _replica_allowed.reset(self.tokens[0])
+
+    def test_safe_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), 'replica')
+        self.assertEqual(self.router.db_for_read(Supply), 'replica')
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_reads_after_write_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_outside_safe_request_use_primary(self):
+        _replica_allowed.set(False)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    @override_settings(CRM_DB_REPLICA=None)
+    def test_no_replica_configured(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+
+
+@override_settings(CRM_DB_REPLICA='replica')
+class ReplicaRoutingTests(CrmTestMixin, TransactionTestCase):
+    databases = {'default', 'replica'}
+    client_class = APIClient
+
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.create_products(self.storage, 2)
+        self.authenticate(self.user)
+        caches[settings.CRM_DB_PIN_CACHE_ALIAS].clear()
+
+    def test_list_reads_from_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get('/api/products/')
+        self.assertEqual(len(response.data['results']), 2)
+        # версия для ETag читается с той же реплики, что и данные
+        self.assertEqual(len(replica), 2)
+
+    def test_write_pins_client_to_primary(self):
+        response = self.client.post('/api/products/', {
+            'storage': self.storage.id, 'title': 'Новый', 'purchase_price': '5.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies, {})
+
+        # Закрепление хранится на сервере: другой клиент того же пользователя тоже читает основную базу.
+        other_client = APIClient()
+        other_client.force_authenticate(self.user)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = other_client.get('/api/products/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(len(replica), 0)
+
+        colleague = User.objects.create_user(email='colleague@example.com', username='colleague', company=self.company)
+        self.authenticate(colleague)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get('/api/products/')
+        self.assertGreater(len(replica), 0)
+
+    def test_pin_expires(self):
+        with override_settings(CRM_DB_PRIMARY_STICKY_SECONDS=0.1):
+            self.client.post('/api/products/', {
+                'storage': self.storage.id, 'title': 'Новый', 'purchase_price': '5.00',
+            }, format='json')
+        time.sleep(0.2)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get('/api/products/')
+        self.assertGreater(len(replica), 0)
+
+
+class LaggingReplicaSyncTests(SimpleTestCase):
+    def test_cursor_does_not_pass_rows_missing_on_replica(self):
+        # Отставание реплики воспроизводится только на двух файлах: в тестах реплика — зеркало основной базы.
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        code = f"""
+import django, os
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = os.path.join({directory.name!r}, 'db.sqlite3')
+django.setup()
+from django.core.management import call_command
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+from crm.models import Company, Storage, User
+setup_test_environment()
+call_command('migrate', verbosity=0)
+company = Company.objects.create(name='ООО Тест', inn='123456789012')
+storage = Storage.objects.create(company=company, address='Склад 1')
+user = User.objects.create_user(email='owner@example.com', username='owner@example.com', company=company)
+# Писатель закрепляется за основной базой, поэтому читает другой пользователь компании.
+colleague = User.objects.create_user(email='colleague@example.com', username='colleague@example.com', company=company)
+writer, reader = APIClient(), APIClient()
+writer.force_authenticate(user)
+reader.force_authenticate(colleague)
+
+def create(title):
+    response = writer.post('/api/products/', {{'storage': storage.id, 'title': title, 'purchase_price': '1.00'}})
+    return response.data['id']
+
+def sync(since=None):
+    data = reader.get('/api/sync/', {{'since': since}} if since else {{}}).data
+    return data['cursor'], [item['id'] for item in data['changes']]
+
+create('Первый')
+call_command('sync_replica', stdout=open(os.devnull, 'w'))
+cursor, _ = sync()
+created = create('Второй')
+cursor, lagging = sync(cursor)
+call_command('sync_replica', stdout=open(os.devnull, 'w'))
+cursor, caught_up = sync(cursor)
+print(created, lagging, caught_up)
+"""
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True, capture_output=True, text=True,
+            env={
+                **os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings',
+                'CRM_DB_REPLICA_NAME': os.path.join(directory.name, 'db.replica.sqlite3'),
+            },
+        ).stdout
+        created, lagging, caught_up = output.strip().split(' ', 2)
+        self.assertEqual(lagging, '[]')
+        self.assertEqual(caught_up, f'[{created}]')
+
+
+class QueryPlanTests(CrmTestMixin, APITestCase):
+    """Каждый SELECT эндпоинтов должен идти по индексу, без полного скана таблицы."""
+
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.product = self.create_products(self.storage, 3)[0]
+        self.supply = Supply.objects.create(company=self.company, supplier=self.supplier)
+        SupplyProduct.objects.create(supply=self.supply, product=self.product, quantity=1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def assert_indexed(self, url):
+        principal_cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        page = response.data.get('next') if isinstance(response.data, dict) else None
+        if page:
+            with CaptureQueriesContext(connection) as next_ctx:
+                self.client.get(page)
+            ctx.captured_queries.extend(next_ctx.captured_queries)
+
+        for query in ctx.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[3] for row in cursor.fetchall()]
+            scans = [
+                step for step in plan
+                if step.startswith('SCAN') and 'USING' not in step and 'VIRTUAL TABLE' not in step
+            ]
+            self.assertEqual(scans, [], f'{url}: {query["sql"]}\n{plan}')
+
+    def test_endpoints_use_indexes(self):
+        for url in [
+            '/api/company/detail/',
+            '/api/storage/detail/',
+            '/api/suppliers/',
+            f'/api/suppliers/{self.supplier.id}/',
+            '/api/products/?page_size=2',
+            '/api/products/?' + urlencode({'q': 'Товар', 'page_size': 2}),
+            f'/api/products/{self.product.id}/',
+            '/api/supplies/',
+            f'/api/supplies/{self.supply.id}/',
+        ]:
+            self.assert_indexed(url)
+
+
+class ProductSearchTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.authenticate(self.user)
+        Product.objects.bulk_create([
+            Product(storage=self.storage, title=title, purchase_price='1.00')
+            for title in ['Молоко пастеризованное', 'Молоток стальной', 'Хлеб ржаной', 'Молоко молоко']
+        ])
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.data['results']]
+
+    def test_prefix_search_is_case_insensitive(self):
+        self.assertEqual(sorted(self.search('мол')), ['Молоко молоко', 'Молоко пастеризованное', 'Молоток стальной'])
+        self.assertEqual(self.search('ХЛЕБ ржан'), ['Хлеб ржаной'])
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('молоко')[0], 'Молоко молоко')
+
+    def test_search_is_tenant_scoped(self):
+        _, other_storage, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        Product.objects.create(storage=other_storage, title='Молоко чужое', purchase_price='1.00')
+        self.assertNotIn('Молоко чужое', self.search('молоко'))
+
+    def test_index_follows_updates_and_deletes(self):
+        product = Product.objects.get(title='Хлеб ржаной')
+        product.title = 'Батон нарезной'
+        product.save()
+        self.assertEqual(self.search('хлеб'), [])
+        self.assertEqual(self.search('батон'), ['Батон нарезной'])
+
+        product.delete()
+        self.assertEqual(self.search('батон'), [])
+
+    def test_search_pages_follow_rank(self):
+        titles = []
+        url = '/api/products/?' + urlencode({'q': 'мол', 'page_size': 1})
+        while url:
+            response = self.client.get(url)
+            titles += [item['title'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(titles, self.search('мол'))
+
+    def test_query_without_words_returns_nothing(self):
+        self.assertEqual(self.search('"*'), [])
+
+    def test_fallback_is_indexed_prefix_match(self):
+        search._warn_unindexed.cache_clear()
+        self.addCleanup(search._warn_unindexed.cache_clear)
+        products = Product.objects.filter(storage=self.storage)
+        with mock.patch.object(connection, 'vendor', 'mysql'), self.assertNoLogs('crm.search', 'WARNING'):
+            found = search.search_products(products, 'Хлеб, рж', self.storage.id)
+            self.assertEqual([product.title for product in found], ['Хлеб ржаной'])
+            self.assertIn('LIKE Хлеб рж% ', str(found.query))
+            self.assertFalse(search.search_products(products, 'ржаной', self.storage.id).exists())
+
+    def test_unindexed_fallback_is_logged(self):
+        search._warn_unindexed.cache_clear()
+        self.addCleanup(search._warn_unindexed.cache_clear)
+        products = Product.objects.filter(storage=self.storage)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), self.assertLogs('crm.search', 'WARNING') as logs:
+            found = search.search_products(products, 'Хлеб', self.storage.id)
+            self.assertEqual([product.title for product in found], ['Хлеб ржаной'])
+            search.search_products(products, 'Хлеб', self.storage.id)
+        self.assertEqual(len(logs.records), 1)
+
+
+class ExportTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.products = self.create_products(self.storage, 3)
+        self.authenticate(self.user)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_products_csv(self):
+        _, other_storage, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        self.create_products(other_storage, 2)
+
+        response, body = self.export('/api/products/export/')
+
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(rows[0], ['id', 'title', 'quantity', 'purchase_price'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(p.id) for p in self.products])
+        self.assertEqual(rows[1][1:], ['Товар 0', '0', '10.00'])
+
+    def test_supplies_ndjson_are_flattened_by_line(self):
+        supply = Supply.objects.create(company=self.company, supplier=self.supplier)
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=supply, product=product, quantity=2) for product in self.products[:2]
+        ])
+
+        _, body = self.export('/api/supplies/export/?output=ndjson')
+
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['supply_id'], supply.id)
+        self.assertEqual(lines[0]['supplier_name'], 'Поставщик')
+        self.assertEqual(lines[1]['product_title'], 'Товар 1')
+        self.assertEqual(lines[1]['purchase_price'], '10.00')
+
+    def test_supply_lines_are_read_in_keyset_chunks(self):
+        supplies = [Supply.objects.create(company=self.company, supplier=self.supplier) for _ in range(3)]
+        # Одинаковая дата у поставок: порядок держат supply_id и id строки.
+        Supply.objects.filter(pk__in=[supply.pk for supply in supplies]).update(date=supplies[0].date)
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=supply, product=product, quantity=1)
+            for supply in reversed(supplies) for product in self.products
+        ])
+
+        with mock.patch.object(exports, 'EXPORT_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as ctx:
+            columns, rows = exports.supply_line_rows(self.company.id)
+            rows = list(rows)
+
+        self.assertEqual(len(ctx), 5)
+        self.assertEqual(
+            [(row[0], row[4]) for row in rows],
+            [(supply.id, product.id) for supply in supplies for product in self.products],
+        )
+        self.assertEqual(len(rows[0]), len(columns))
+
+    def test_suppliers_csv(self):
+        _, body = self.export('/api/suppliers/export/')
+        self.assertEqual(body.splitlines()[1], f'{self.supplier.id},Поставщик,1234567890,')
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/api/products/export/?output=xml').status_code, 400)
+
+
+class ImportTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.authenticate(self.user)
+
+    def upload(self, url, content):
+        upload = SimpleUploadedFile('data.csv', content.encode('utf-8'), content_type='text/csv')
+        return self.client.post(url, {'file': upload}, format='multipart')
+
+    def test_products_import_reports_bad_rows(self):
+        _, other_storage, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        content = (
+            'title,purchase_price,storage\n'
+            'Молоко,55.90,\n'
+            ',10,\n'
+            'Хлеб,abc,\n'
+            f'Сыр,100,{other_storage.id}\n'
+            f'Масло,120.5,{self.storage.id}\n'
+        )
+
+        response = self.upload('/api/products/import/', content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 5])
+        self.assertIn('storage', response.data['errors'][2]['errors'])
+        self.assertEqual(
+            sorted(Product.objects.filter(storage=self.storage).values_list('title', flat=True)), ['Масло', 'Молоко'],
+        )
+
+    def test_products_are_written_in_batches(self):
+        content = 'title,purchase_price\n' + ''.join(f'Товар {i},1.00\n' for i in range(10))
+        with mock.patch('crm.imports.IMPORT_BATCH_SIZE', 4), CaptureQueriesContext(connection) as ctx:
+            response = self.upload('/api/products/import/', content)
+
+        self.assertEqual(response.data['created'], 10)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "crm_product"')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_suppliers_import_checks_inn(self):
+        Supplier.objects.create(company=self.company, name='Старый', inn='1111111111')
+        content = (
+            'name,inn,contact_info\n'
+            'Первый,2222222222,тел. 1\n'
+            'Дубль,2222222222,\n'
+            'Существующий,1111111111,\n'
+            'Кривой,12345,\n'
+            'Второй,333333333333,\n'
+        )
+
+        response = self.upload('/api/suppliers/import/', content)
+
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 5])
+        self.assertEqual(Supplier.objects.get(inn='2222222222').contact_info, 'тел. 1')
+
+    def test_missing_columns(self):
+        response = self.upload('/api/suppliers/import/', 'name\nПервый\n')
+        self.assertEqual(response.status_code, 400)
+
+    def test_supplier_api_validates_inn(self):
+        response = self.client.post('/api/suppliers/', {'name': 'Новый', 'inn': '12ab'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/suppliers/', {'name': 'Новый', 'inn': '1234567890'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class SupplierUpsertTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.authenticate(self.user)
+
+    def upsert(self, items):
+        response = self.client.post('/api/suppliers/upsert/', items, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_insert_update_unchanged(self):
+        Supplier.objects.create(company=self.company, name='Старое имя', inn='1111111111')
+        Supplier.objects.create(company=self.company, name='Без изменений', inn='2222222222')
+
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.upsert([
+                {'name': 'Новое имя', 'inn': '1111111111'},
+                {'name': 'Без изменений', 'inn': '2222222222'},
+                {'name': 'Новый', 'inn': '333333333333', 'contact_info': 'почта'},
+            ])
+
+        self.assertEqual((report['inserted'], report['updated'], report['unchanged']), (1, 1, 1))
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(Supplier.objects.get(inn='1111111111').name, 'Новое имя')
+        self.assertEqual(Supplier.objects.get(inn='333333333333').company, self.company)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 1)
+
+    def test_repeated_call_is_idempotent(self):
+        items = [{'name': 'Поставщик', 'inn': '1111111111'}]
+        self.upsert(items)
+        report = self.upsert(items)
+        self.assertEqual((report['inserted'], report['updated'], report['unchanged']), (0, 0, 1))
+
+    def test_other_company_supplier_is_protected(self):
+        other_company, _, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        Supplier.objects.create(company=other_company, name='Чужой', inn='1111111111')
+
+        report = self.upsert([{'name': 'Захват', 'inn': '1111111111'}])
+
+        self.assertEqual(report['errors'][0]['index'], 0)
+        self.assertEqual(Supplier.objects.get(inn='1111111111').name, 'Чужой')
+
+    def test_inn_taken_by_other_company_after_lookup(self):
+        other_company, _, _ = self.create_tenant(inn='999999999999', email='other@example.com')
+        # Выборка в upsert_suppliers прошла раньше, чем другая компания записала этот ИНН.
+        real_filter = Supplier.objects.filter
+
+        def filter_then_race(*args, **kwargs):
+            queryset = real_filter(*args, **kwargs)
+            list(queryset.values('inn'))
+            Supplier.objects.create(company=other_company, name='Чужой', inn='1111111111')
+            return queryset.none()
+
+        with mock.patch.object(Supplier.objects, 'filter', filter_then_race):
+            report = self.upsert([{'name': 'Захват', 'inn': '1111111111'}, {'name': 'Свой', 'inn': '2222222222'}])
+
+        self.assertEqual(report['errors'], [{'index': 0, 'errors': {'inn': ["Поставщик с таким ИНН принадлежит другой компании."]}}])
+        self.assertEqual((report['inserted'], report['updated']), (1, 0))
+        self.assertEqual(Supplier.objects.get(inn='1111111111').name, 'Чужой')
+        self.assertEqual(Supplier.objects.get(inn='2222222222').company, self.company)
+
+    def test_invalid_payload(self):
+        response = self.client.post('/api/suppliers/upsert/', [{'name': 'X', 'inn': 'abc'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_insert_per_batch(self):
+        size = imports.upsert_batch_size()
+        self.assertLessEqual(size * len(imports.UPSERT_FIELDS), connection.features.max_query_params)
+        items = [{'name': f'Поставщик {i}', 'inn': f'{1000000000 + i}'} for i in range(size + 1)]
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.upsert(items)
+        self.assertEqual(report['inserted'], size + 1)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 2)
+
+    @override_settings(CRM_SUPPLIER_UPSERT_MAX_ITEMS=2)
+    def test_request_size_is_limited(self):
+        items = [{'name': f'Поставщик {i}', 'inn': f'{1111111110 + i}'} for i in range(3)]
+        response = self.client.post('/api/suppliers/upsert/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Supplier.objects.exists())
+
+
+class JobTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        self.job_dir = job_dir.name
+        settings_override = override_settings(CRM_JOB_DIR=job_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.company, self.storage, self.user = self.create_tenant()
+        self.principal = Principal.from_user(self.user)
+        self.authenticate(self.user)
+
+    def test_export_job_lifecycle(self):
+        self.create_products(self.storage, 3)
+
+        response = self.client.post('/api/jobs/', {'kind': jobs.EXPORT_PRODUCTS, 'output': 'csv'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Job.PENDING)
+        self.assertTrue(response['Location'].endswith(f"/api/jobs/{response.data['id']}/"))
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        detail = self.client.get(response['Location'])
+        self.assertEqual(detail.data['status'], Job.SUCCEEDED)
+        self.assertEqual(detail.data['result'], {'rows': 3})
+        result = self.client.get(detail.data['result_url'])
+        self.assertEqual(result.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b''.join(result.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'title', 'quantity', 'purchase_price'])
+        self.assertEqual(len(rows), 4)
+
+    def test_async_import_returns_202(self):
+        upload = SimpleUploadedFile('data.csv', 'title,purchase_price\nМолоко,55.90\n,1\n'.encode(), 'text/csv')
+
+        response = self.client.post('/api/products/import/?async=1', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Product.objects.exists())
+        jobs.run_pending()
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual((job.result['created'], job.result['failed']), (1, 1))
+        self.assertEqual(job.progress, 2)
+        self.assertFalse(jobs.job_path(job.params['input']).exists())
+
+    def test_claim_is_exclusive(self):
+        job = jobs.submit_job(jobs.EXPORT_SUPPLIERS, self.principal)
+
+        self.assertEqual(jobs.claim_job('first').pk, job.pk)
+        self.assertIsNone(jobs.claim_job('second'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.RUNNING, 'first', 1))
+
+    @override_settings(CRM_JOB_MAX_ATTEMPTS=2, CRM_JOB_RETRY_BACKOFF=60)
+    def test_failed_job_is_retried_with_backoff(self):
+        def fail(job):
+            raise RuntimeError('нет связи')
+
+        with mock.patch.dict(jobs._handlers, {'boom': fail}), self.assertLogs('crm.jobs', 'ERROR'):
+            job = jobs.submit_job('boom', self.principal)
+            jobs.run_pending()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+            self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+            self.assertEqual(jobs.run_pending(), 0)
+
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            jobs.run_pending()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+            self.assertIn('нет связи', job.error)
+
+    def test_bad_file_fails_without_retry(self):
+        upload = SimpleUploadedFile('data.csv', b'name\n', 'text/csv')
+        job = jobs.submit_job(jobs.IMPORT_PRODUCTS, self.principal, upload=upload)
+
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn('title', job.error)
+
+    @override_settings(CRM_JOB_STALE_TIMEOUT=60)
+    def test_stale_job_is_requeued(self):
+        job = jobs.submit_job(jobs.EXPORT_SUPPLIERS, self.principal)
+        jobs.claim_job('dead-worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        call_command('runworkers', processes=1, once=True)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 2))
+
+    def import_job(self, rows):
+        content = '\n'.join(['title,purchase_price', *rows]).encode()
+        return jobs.submit_job(jobs.IMPORT_PRODUCTS, self.principal, upload=SimpleUploadedFile('data.csv', content))
+
+    @mock.patch.object(imports, 'IMPORT_BATCH_SIZE', 2)
+    def test_retried_import_resumes_after_committed_batches(self):
+        job = self.import_job(['Первый,1', ',1', 'Третий,1', 'Четвёртый,1', 'Пятый,1'])
+        save_checkpoint = jobs.save_checkpoint
+
+        def crash_on_second_write(job, report):
+            save_checkpoint(job, report)
+            if report.processed > 2:
+                raise RuntimeError('воркер упал')
+
+        with mock.patch.object(jobs, 'save_checkpoint', crash_on_second_write), self.assertLogs('crm.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (Job.PENDING, 2))
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Первый'])
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual((job.result['created'], job.result['failed']), (4, 1))
+        self.assertEqual([error['row'] for error in job.result['errors']], [3])
+        self.assertEqual(
+            sorted(Product.objects.values_list('title', flat=True)), ['Первый', 'Пятый', 'Третий', 'Четвёртый'],
+        )
+
+    def test_requeued_job_keeps_input_and_discards_batches(self):
+        job = self.import_job(['Молоко,1'])
+        claimed = jobs.claim_job('slow-worker')
+        # Пока первая попытка шла, задачу сочли зависшей и захватил другой воркер.
+        Job.objects.filter(pk=job.pk).update(locked_by='other-worker', attempts=2)
+
+        with self.assertLogs('crm.jobs', 'WARNING'):
+            jobs.run_job(claimed)
+
+        self.assertFalse(Product.objects.exists())
+        self.assertTrue(jobs.job_path(job.params['input']).exists())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.RUNNING, 'other-worker'))
+
+    def test_finished_elsewhere_job_keeps_input(self):
+        job = jobs.submit_job('noop', self.principal, params={'input': 'input-shared.csv'})
+        jobs.job_path('input-shared.csv').write_bytes(b'')
+        claimed = jobs.claim_job('slow-worker')
+        Job.objects.filter(pk=job.pk).update(locked_by='other-worker', attempts=2)
+
+        with mock.patch.dict(jobs._handlers, {'noop': lambda job: {}}):
+            jobs.run_job(claimed)
+
+        self.assertTrue(jobs.job_path('input-shared.csv').exists())
+
+    def test_export_progress_on_file_database(self):
+        # Тестовая база в памяти; блокировки файловой SQLite без WAL видны только на настоящем файле.
+        code = f"""
+import django, os
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = os.path.join({self.job_dir!r}, 'db.sqlite3')
+settings.CRM_JOB_DIR = {self.job_dir!r}
+django.setup()
+from django.core.management import call_command
+call_command('migrate', verbosity=0)
+from crm import jobs
+from crm.models import Company, Storage, User, Product, Job
+from crm.principal import Principal
+company = Company.objects.create(name='ООО Тест', inn='123456789012')
+storage = Storage.objects.create(company=company, address='Склад 1')
+user = User.objects.create_user(email='owner@example.com', username='owner@example.com', company=company)
+Product.objects.bulk_create(
+    [Product(storage=storage, title=f'Товар {{i}}', purchase_price='10.00') for i in range(jobs.PROGRESS_EVERY + 1)],
+    batch_size=500,
+)
+job = jobs.submit_job(jobs.EXPORT_PRODUCTS, Principal.from_user(user))
+jobs.run_job(jobs.claim_job('worker'))
+job.refresh_from_db()
+print(job.status, job.progress, job.result['rows'] if job.result else job.error)
+"""
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings', 'CRM_SQLITE_PROFILE': 'default'},
+        ).stdout
+        self.assertEqual(output.split(), [Job.SUCCEEDED, str(jobs.PROGRESS_EVERY), str(jobs.PROGRESS_EVERY + 1)])
+
+    def test_jobs_of_other_company_are_hidden(self):
+        other_company, _, other_user = self.create_tenant(inn='999999999999', email='other@example.com')
+        job = jobs.submit_job(jobs.EXPORT_SUPPLIERS, Principal.from_user(other_user))
+
+        response = self.client.get(f'/api/jobs/{job.pk}/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class AsgiServingTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.products = self.create_products(self.storage, 5)
+        self.supply = Supply.objects.create(company=self.company, supplier=self.supplier)
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=self.supply, product=product, quantity=2) for product in self.products[:2]
+        ])
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_middleware_stack_is_async_capable(self):
+        # Иначе Django переключает цепочку между потоком и циклом событий на каждом синхронном звене.
+        for path in settings.MIDDLEWARE:
+            with self.subTest(middleware=path):
+                self.assertTrue(getattr(import_string(path), 'async_capable', False))
+
+    async def test_session_is_saved_under_asgi(self):
+        # Вход меняет сессию: SessionMiddleware сохраняет её в потоке, а не в цикле событий.
+        await User.objects.filter(pk=self.user.pk).aupdate(is_staff=True)
+        response = await self.async_client.post(
+            '/admin/login/', {'username': self.user.email, 'password': 'Secret-pass-123', 'next': '/admin/'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        response = await self.async_client.get('/admin/')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_responses_match_wsgi(self):
+        urls = [
+            '/api/company/detail/',
+            '/api/storage/detail/',
+            '/api/suppliers/',
+            f'/api/suppliers/{self.supplier.id}/',
+            '/api/products/?page_size=2',
+            f'/api/products/{self.products[0].id}/',
+            f"/api/products/?{urlencode({'q': 'товар'})}",
+            f'/api/supplies/{self.supply.id}/',
+            '/api/products/999999/',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                expected = await sync_to_async(self.client.get)(url, headers=self.headers)
+                response = await self.async_client.get(url, headers=self.headers)
+                self.assertEqual((response.status_code, response.json()), (expected.status_code, expected.json()))
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    async def test_conditional_get(self):
+        response = await self.async_client.get('/api/products/', headers=self.headers)
+
+        response = await self.async_client.get(
+            '/api/products/', headers={**self.headers, 'If-None-Match': response['ETag']},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_authentication_errors(self):
+        response = await self.async_client.get('/api/products/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+    async def get_pair(self, url):
+        """Ответ синхронного эндпоинта и его async-версии /api/async/... (ссылки приведены к /api/)."""
+        expected = await sync_to_async(self.client.get)(url, headers=self.headers)
+        response = await self.async_client.get(url.replace('/api/', '/api/async/'), headers=self.headers)
+        body = json.loads(response.content.decode().replace('/api/async/', '/api/'))
+        return (response.status_code, body), (expected.status_code, expected.json())
+
+    async def test_async_endpoints_match_sync(self):
+        urls = [
+            '/api/company/detail/',
+            '/api/storage/detail/',
+            '/api/suppliers/',
+            f'/api/suppliers/{self.supplier.id}/',
+            '/api/products/?page_size=2',
+            f'/api/products/{self.products[0].id}/',
+            f"/api/products/?{urlencode({'q': 'товар'})}",
+            '/api/supplies/',
+            f'/api/supplies/{self.supply.id}/',
+            '/api/products/999999/',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response, expected = await self.get_pair(url)
+                self.assertEqual(response, expected)
+
+    @override_settings(CRM_FAST_LIST_SERIALIZATION=True)
+    async def test_async_fast_lists_match_sync(self):
+        for url in ('/api/products/?page_size=2', '/api/supplies/'):
+            with self.subTest(url=url):
+                response, expected = await self.get_pair(url)
+                self.assertEqual(response, expected)
+
+    async def test_async_pagination_cursor_is_followed(self):
+        page = (await self.async_client.get('/api/async/products/?page_size=3', headers=self.headers)).json()
+        second = (await self.async_client.get(page['next'], headers=self.headers)).json()
+
+        self.assertTrue(page['next'].startswith('http://testserver/api/async/products/'))
+        ids = [item['id'] for item in page['results'] + second['results']]
+        self.assertEqual(ids, [product.id for product in self.products])
+
+    @override_settings(CRM_RESPONSE_CACHE_ALIAS='crm_responses')
+    async def test_async_list_uses_etag_and_response_cache(self):
+        await response_cache.get_cache().aclear()
+        first = await self.async_client.get('/api/async/products/', headers=self.headers)
+        second = await self.async_client.get('/api/async/products/', headers=self.headers)
+        not_modified = await self.async_client.get(
+            '/api/async/products/', headers={**self.headers, 'If-None-Match': first['ETag']},
+        )
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('miss', 'hit'))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(not_modified.status_code, 304)
+
+    async def test_async_company_detail_is_read_from_database(self):
+        await sync_to_async(principal_cache.get_or_resolve)(self.user.pk)
+        # Обход API: кэш Principal хранит старое название.
+        await Company.objects.filter(pk=self.company.pk).aupdate(name='ООО Новое')
+
+        response = await self.async_client.get('/api/async/company/detail/', headers=self.headers)
+
+        self.assertEqual(response.json()['name'], 'ООО Новое')
+
+    async def test_async_errors(self):
+        response = await self.async_client.get('/api/async/products/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        response = await self.async_client.post('/api/async/products/', headers=self.headers)
+        self.assertEqual(response.status_code, 405)
+
+
+class ConditionalGetTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.products = self.create_products(self.storage, 3)
+        self.authenticate(self.user)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified_before_queryset_is_evaluated(self):
+        etag = self.etag('/api/products/')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertIn('Last-Modified', self.client.get('/api/products/'))
+
+    def test_representations_have_distinct_etags(self):
+        self.assertNotEqual(self.etag('/api/products/'), self.etag('/api/products/?page_size=1'))
+        self.assertNotEqual(self.etag('/api/products/'), self.etag('/api/suppliers/'))
+
+    def test_writes_change_etag(self):
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        unused = Supplier.objects.create(company=self.company, name='Без поставок', inn='2222222222')
+        writes = [
+            lambda: self.client.post('/api/products/', {
+                'storage': self.storage.id, 'title': 'Новый', 'purchase_price': '1.00',
+            }, format='json'),
+            lambda: self.client.patch(f'/api/products/{self.products[0].id}/', {'title': 'Другой'}, format='json'),
+            lambda: self.client.delete(f'/api/products/{self.products[1].id}/'),
+            lambda: self.client.post('/api/supplies/', {
+                'supplier': supplier.id, 'supply_products': [{'product_id': self.products[0].id, 'quantity': 1}],
+            }, format='json'),
+            lambda: self.client.post('/api/suppliers/upsert/', [{'name': 'Новый', 'inn': '1111111111'}], format='json'),
+            lambda: self.client.delete(f'/api/suppliers/{unused.id}/'),
+            lambda: self.client.patch('/api/storage/detail/', {'address': 'Склад 2'}, format='json'),
+            lambda: self.client.post('/api/products/import/', {
+                'file': SimpleUploadedFile('data.csv', 'title,purchase_price\nСыр,1\n'.encode(), 'text/csv'),
+            }, format='multipart'),
+        ]
+        for write in writes:
+            etag = self.etag('/api/products/')
+            response = write()
+            self.assertLess(response.status_code, 300, response.content)
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_company_detail_is_fresh(self):
+        etag = self.etag('/api/company/detail/')
+        # Переименование в другом процессе: кэш Principal здесь об этом не знает.
+        Company.objects.filter(pk=self.company.pk).update(name='Новое имя')
+        Company.objects.get(pk=self.company.pk).save()
+
+        response = self.client.get('/api/company/detail/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое имя')
+
+    def test_stale_instance_does_not_roll_back_version(self):
+        stale = Company.objects.get(pk=self.company.pk)
+        Product.objects.create(storage=self.storage, title='Новый', purchase_price='1.00')
+        version = Company.objects.get(pk=self.company.pk).data_version
+
+        stale.name = 'Новое имя'
+        stale.save()
+
+        self.assertEqual(Company.objects.get(pk=self.company.pk).data_version, version + 1)
+
+
+class ResponseCacheTests(CrmTestMixin, APITestCase):
+    response_cache_alias = 'crm_responses'
+
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.products = self.create_products(self.storage, 3)
+        self.authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_second_request_is_served_from_cache(self):
+        self.assertEqual(self.get('/api/products/')['X-Cache'], 'miss')
+        # версия для ETag читается всегда, страница товаров — нет
+        with self.assertNumQueries(1):
+            response = self.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(self.get('/api/products/?page_size=1')['X-Cache'], 'miss')
+
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save(update_fields=['is_staff'])
+        self.authenticate(self.user)
+        stats = self.client.get('/api/cache/stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual(stats['endpoints']['products'], {'hits': 1, 'misses': 2})
+
+    def test_any_write_moves_company_lists_to_new_version(self):
+        for url in ('/api/products/', '/api/suppliers/', '/api/supplies/'):
+            self.get(url)
+
+        response = self.client.post('/api/supplies/', {
+            'supplier': self.supplier.id,
+            'supply_products': [{'product_id': self.products[0].id, 'quantity': 4}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        products = self.get('/api/products/')
+        self.assertEqual(products['X-Cache'], 'miss')
+        self.assertEqual(products.data['results'][0]['quantity'], 4)
+        self.assertEqual(self.get('/api/supplies/')['X-Cache'], 'miss')
+        self.assertEqual(self.get('/api/suppliers/')['X-Cache'], 'miss')
+
+    def test_stale_body_is_not_served_under_new_etag(self):
+        # Запись без каких-либо хуков кэша (другой процесс, массовый UPDATE): важна только версия.
+        first = self.get('/api/products/')
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=7)
+        versioning.bump_company_version(self.company.id)
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.data['results'][0]['quantity'], 7)
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_cache_is_scoped_by_company(self):
+        self.get('/api/suppliers/')
+        other_company, _, other_user = self.create_tenant(inn='999999999999', email='other@example.com')
+        self.authenticate(other_user)
+
+        response = self.get('/api/suppliers/')
+
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.data['results'], [])
+
+
+class FastListSerializationTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        suppliers = Supplier.objects.bulk_create([
+            Supplier(company=self.company, name=f'Поставщик {i}', inn=f'12345678{i:02d}', contact_info='')
+            for i in range(3)
+        ])
+        products = Product.objects.bulk_create([
+            Product(storage=self.storage, title=f'Молоко {i}', quantity=i, purchase_price=f'{i}.5')
+            for i in range(7)
+        ])
+        supplies = Supply.objects.bulk_create([Supply(company=self.company, supplier=suppliers[i % 3]) for i in range(4)])
+        SupplyProduct.objects.bulk_create([
+            SupplyProduct(supply=supply, product=product, quantity=index + 1)
+            for index, supply in enumerate(supplies[:3]) for product in products[index:index + 2]
+        ])
+        self.authenticate(self.user)
+
+    def get_both(self, url):
+        responses = []
+        for fast in (False, True):
+            with override_settings(CRM_FAST_LIST_SERIALIZATION=fast), CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            responses.append((response, len(ctx)))
+        return responses
+
+    def test_fast_path_matches_serializers(self):
+        urls = [
+            '/api/suppliers/', '/api/suppliers/?page_size=2',
+            '/api/products/', '/api/products/?page_size=3', '/api/products/?q=молоко&page_size=2',
+            '/api/supplies/', '/api/supplies/?page_size=2',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                (slow, slow_queries), (fast, fast_queries) = self.get_both(url)
+                self.assertEqual(fast.content, slow.content)
+                self.assertLessEqual(fast_queries, slow_queries)
+                next_url = json.loads(slow.content)['next']
+                if next_url:
+                    (slow, _), (fast, _) = self.get_both(next_url)
+                    self.assertEqual(fast.content, slow.content)
+
+    def test_supply_lines_keep_nested_shape(self):
+        (_, _), (fast, _) = self.get_both('/api/supplies/')
+        results = json.loads(fast.content)['results']
+
+        self.assertEqual(results[0]['supply_products'], [])
+        line = results[-1]['supply_products'][0]
+        self.assertEqual(list(line), ['id', 'product', 'quantity'])
+        self.assertEqual(line['product']['purchase_price'], '0.50')
+
+
+class ScaleBenchmarkTests(CrmTestMixin, APITestCase):
+    def seed(self):
+        call_command(
+            'seed_scale', companies=3, products=10, lines=23, lines_per_supply=4, suppliers=2,
+            batch_size=5, stdout=io.StringIO(),
+        )
+
+    def test_seed_scale_builds_consistent_tenants(self):
+        self.seed()
+
+        self.assertEqual(Company.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(SupplyProduct.objects.count(), 23)
+        self.assertEqual(Supplier.objects.count(), 6)
+        for company in Company.objects.all():
+            owner = company.employees.get()
+            self.assertTrue(owner.is_company_owner)
+            self.assertTrue(owner.check_password('Scale-pass-123'))
+            products = Product.objects.filter(storage__company=company)
+            lines = SupplyProduct.objects.filter(supply__company=company)
+            self.assertEqual(
+                sum(products.values_list('quantity', flat=True)),
+                sum(lines.values_list('quantity', flat=True)),
+            )
+            self.assertFalse(lines.exclude(product__storage__company=company).exists())
+
+    def test_bench_endpoints_writes_and_checks_baseline(self):
+        self.seed()
+        # Как тестовый клиент: запросы идут в транзакции теста, соединение не закрывается.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        email = User.objects.order_by('pk').first().email
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.unlink, output.name)
+
+        call_command(
+            'bench_endpoints', email=email, requests=2, concurrency=1, warmup=0,
+            only=['product_list_create', 'supply_detail', 'schema-json'], extra=['/api/products/?q=товар'],
+            output=output.name, stdout=io.StringIO(),
+        )
+
+        with open(output.name, encoding='utf-8') as source:
+            report = json.load(source)
+        endpoints = report['endpoints']
+        self.assertEqual(set(endpoints), {'product_list_create', 'supply_detail', 'schema-json', '/api/products/?q=товар'})
+        self.assertEqual(report['meta']['dataset']['supply_lines'], 23)
+        for result in endpoints.values():
+            self.assertEqual((result['status'], result['errors'], result['requests']), (200, 0, 2))
+        self.assertEqual(endpoints['supply_detail']['queries'], 3)
+
+        endpoints['supply_detail']['queries'] = 2
+        with open(output.name, 'w', encoding='utf-8') as target:
+            json.dump(report, target)
+        with self.assertRaisesMessage(CommandError, 'supply_detail: запросов к базе 2 -> 3'):
+            call_command(
+                'bench_endpoints', email=email, requests=2, concurrency=1, warmup=0, only=['supply_detail'],
+                baseline=output.name, tolerance=1000, stdout=io.StringIO(),
+            )
+
+    def test_bench_endpoints_skips_streaming_routes(self):
+        user = self.create_tenant()[2]
+
+        endpoints, skipped = bench_endpoints.Command().discover(user, None)
+
+        self.assertNotIn('stock_events', dict(endpoints))
+        self.assertIn(('stock_events', 'бесконечный поток SSE'), skipped)
+
+
+class RequestMetricsTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.create_products(self.storage, 3)
+        self.authenticate(self.user)
+
+    def test_server_timing_reports_queries_and_serialization(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/')
+
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'auth', 'serialize', 'view'})
+        self.assertIn(f'desc="{len(ctx)} queries"', timing['db'])
+        self.assertGreater(float(timing['serialize'].removeprefix('dur=')), 0)
+
+    def test_slow_requests_are_logged_with_top_queries(self):
+        with override_settings(CRM_SLOW_REQUEST_MS=0), self.assertLogs('crm.metrics', 'WARNING') as logs:
+            self.client.get('/api/products/')
+
+        self.assertIn('Медленный запрос GET /api/products/ -> 200', logs.output[0])
+        self.assertIn('FROM "crm_product"', logs.output[0])
+
+    def test_metrics_endpoint_aggregates_by_route(self):
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        self.client.get('/api/suppliers/999/')
+
+        response = self.client.get('/metrics')
+        body = response.content.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('crm_request_duration_seconds_count{route="product_list_create",method="GET"} 2', body)
+        self.assertIn('crm_request_duration_seconds_bucket{route="product_list_create",method="GET",le="+Inf"} 2', body)
+        self.assertIn('crm_requests_total{route="supplier_detail",method="GET",status="404"} 1', body)
+        self.assertNotIn('route="metrics"', body)
+
+    def test_metrics_endpoint_is_limited_by_address(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 403)
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        self.schema_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.schema_dir.cleanup)
+        settings_override = override_settings(CRM_SCHEMA_DIR=self.schema_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema.reset()
+        self.addCleanup(schema.reset)
+
+    def test_schema_is_generated_once_and_revalidated_by_etag(self):
+        with mock.patch('crm.schema.generate_schema', wraps=schema.generate_schema) as generate:
+            response = self.client.get('/swagger.json')
+            self.client.get('/swagger.yaml')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(generate.call_count, 1)
+        self.assertIn('/products/', json.loads(response.content)['paths'])
+
+        cached = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_generated_files_are_served_without_generation(self):
+        call_command('generate_schema', stdout=io.StringIO())
+        schema.reset()
+
+        with mock.patch('crm.schema.generate_schema') as generate:
+            response = self.client.get('/swagger.yaml')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(generate.called)
+        self.assertEqual(response.content, schema.schema_path('.yaml').read_bytes())
+
+    def test_ui_pages_load_prebuilt_schema(self):
+        for url in ('/swagger/', '/redoc/'):
+            with mock.patch('crm.schema.generate_schema') as generate:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(generate.called)
+            self.assertIn(b'/swagger.json', response.content)
+
+    def test_urlconf_does_not_import_schema_generator(self):
+        code = (
+            'import sys, django; django.setup(); import config.urls; '
+            'print(sorted(m for m in sys.modules if m.startswith("drf_yasg.")))'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'},
+        ).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class BatchTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def post_batch(self, requests, atomic=False):
+        response = self.client.post('/api/batch/', {'atomic': atomic, 'requests': requests}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_receive_goods_flow_in_one_request(self):
+        authenticate = CachedJWTAuthentication.authenticate
+        with mock.patch.object(CachedJWTAuthentication, 'authenticate', autospec=True,
+                               side_effect=authenticate) as auth:
+            data = self.post_batch([
+                {'method': 'POST', 'path': '/api/suppliers/', 'body': {'name': 'Поставщик', 'inn': '1234567890'}},
+                {'method': 'POST', 'path': '/api/products/',
+                 'body': {'storage': self.storage.id, 'title': 'Молоко', 'purchase_price': '55.90'}},
+                {'method': 'POST', 'path': '/api/supplies/', 'body': {
+                    'supplier': '$0.id', 'supply_products': [{'product_id': '$1.id', 'quantity': 5}],
+                }},
+                {'method': 'PATCH', 'path': '/api/products/$1.id/', 'body': {'title': 'Молоко 3,2%'}},
+                {'method': 'GET', 'path': '/api/storage/detail/'},
+            ], atomic=True)
+
+        self.assertEqual(auth.call_count, 1)
+        self.assertFalse(data['rolled_back'])
+        self.assertEqual([item['status'] for item in data['responses']], [201, 201, 201, 200, 200])
+        supply = data['responses'][2]['body']
+        self.assertEqual(supply['supplier'], data['responses'][0]['body']['id'])
+        self.assertEqual(supply['supply_products'][0]['product']['quantity'], 5)
+        self.assertEqual(data['responses'][3]['body']['quantity'], 5)
+        self.assertEqual(data['responses'][4]['body']['address'], 'Склад 1')
+
+    def test_atomic_batch_rolls_back_on_error(self):
+        data = self.post_batch([
+            {'method': 'POST', 'path': '/api/suppliers/', 'body': {'name': 'Поставщик', 'inn': '1234567890'}},
+            {'method': 'POST', 'path': '/api/suppliers/', 'body': {'name': 'Второй', 'inn': 'abc'}},
+            {'method': 'GET', 'path': '/api/suppliers/'},
+        ], atomic=True)
+
+        self.assertTrue(data['rolled_back'])
+        self.assertEqual([item['status'] for item in data['responses']], [201, 400])
+        self.assertFalse(Supplier.objects.exists())
+
+    def test_non_atomic_batch_continues_after_error(self):
+        data = self.post_batch([
+            {'method': 'POST', 'path': '/api/suppliers/', 'body': {'name': 'Поставщик', 'inn': 'abc'}},
+            {'method': 'GET', 'path': '/api/suppliers/$0.id/'},
+            {'method': 'POST', 'path': '/api/suppliers/', 'body': {'name': 'Второй', 'inn': '1234567890'}},
+        ])
+
+        self.assertEqual([item['status'] for item in data['responses']], [400, 400, 201])
+        self.assertIn('$0', data['responses'][1]['body']['detail'])
+        self.assertEqual(Supplier.objects.get().name, 'Второй')
+
+    def test_steps_see_storage_created_earlier_in_batch(self):
+        company = Company.objects.create(name='ООО Без склада', inn='210987654321')
+        user = User.objects.create_user(
+            email='new@example.com', username='new', password='Secret-pass-123', company=company, is_company_owner=True,
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+        data = self.post_batch([
+            {'method': 'POST', 'path': '/api/storage/', 'body': {'address': 'Новый склад'}},
+            {'method': 'POST', 'path': '/api/products/',
+             'body': {'storage': '$0.id', 'title': 'Сыр', 'purchase_price': '10.00'}},
+            {'method': 'GET', 'path': '/api/products/'},
+        ], atomic=True)
+
+        self.assertEqual([item['status'] for item in data['responses']], [201, 201, 200])
+        self.assertEqual([product['title'] for product in data['responses'][2]['body']['results']], ['Сыр'])
+
+    def test_unsupported_sub_requests(self):
+        data = self.post_batch([
+            {'method': 'GET', 'path': '/api/products/export/'},
+            {'method': 'GET', 'path': '/api/events/stock/'},
+            {'method': 'POST', 'path': '/api/batch/', 'body': {'requests': []}},
+            {'method': 'GET', 'path': '/admin/'},
+            {'method': 'GET', 'path': '/api/nowhere/'},
+        ])
+
+        self.assertEqual([item['status'] for item in data['responses']], [400, 400, 400, 400, 404])
+
+    @override_settings(CRM_BATCH_MAX_REQUESTS=2)
+    def test_batch_size_is_limited(self):
+        response = self.client.post('/api/batch/', {
+            'requests': [{'method': 'GET', 'path': '/api/storage/detail/'}] * 3,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('requests', response.data)
+
+
+class SyncTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.authenticate(self.user)
+
+    def sync(self, since=None):
+        response = self.client.get('/api/sync/', {'since': since} if since is not None else {})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def changed(self, data):
+        return [(item['type'], item['id'], item['deleted']) for item in data['changes']]
+
+    def create_supply(self, supplier, product, quantity=3):
+        response = self.client.post('/api/supplies/', {
+            'supplier': supplier.id, 'supply_products': [{'product_id': product.id, 'quantity': quantity}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Supply.objects.get(pk=response.data['id'])
+
+    def test_initial_sync_returns_current_rows(self):
+        first, second = self.create_products(self.storage, 2)
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        supply = self.create_supply(supplier, first)
+
+        data = self.sync()
+
+        self.assertFalse(data['reset'])
+        self.assertFalse(data['has_more'])
+        self.assertCountEqual(self.changed(data), [
+            ('product', first.id, False), ('product', second.id, False),
+            ('supplier', supplier.id, False), ('supply', supply.id, False),
+        ])
+        rows = {(item['type'], item['id']): item['data'] for item in data['changes']}
+        self.assertEqual(rows[('product', first.id)]['quantity'], 3)
+        self.assertEqual(rows[('supply', supply.id)]['supply_products'][0]['product']['id'], first.id)
+
+    def test_delta_contains_only_changes_and_deletions(self):
+        kept, changed = self.create_products(self.storage, 2)
+        gone = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        cursor = self.sync()['cursor']
+
+        self.client.patch(f'/api/products/{changed.id}/', {'title': 'Новое название'})
+        self.client.delete(f'/api/suppliers/{gone.id}/')
+        created = Product.objects.create(storage=self.storage, title='Новый', purchase_price='1.00')
+        data = self.sync(cursor)
+
+        self.assertEqual(self.changed(data), [
+            ('product', changed.id, False), ('supplier', gone.id, True), ('product', created.id, False),
+        ])
+        self.assertEqual(data['changes'][0]['data']['title'], 'Новое название')
+        self.assertNotIn(('product', kept.id, False), self.changed(data))
+        self.assertEqual(self.changed(self.sync(data['cursor'])), [])
+
+    def test_storage_deletion_leaves_tombstones(self):
+        products = self.create_products(self.storage, 2)
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        supply = self.create_supply(supplier, products[0])
+        cursor = self.sync()['cursor']
+
+        self.assertEqual(self.client.delete('/api/storage/detail/').status_code, 204)
+        data = self.sync(cursor)
+
+        self.assertCountEqual(self.changed(data), [
+            ('product', products[0].id, True), ('product', products[1].id, True), ('supply', supply.id, False),
+        ])
+        supply_data = next(item['data'] for item in data['changes'] if item['type'] == 'supply')
+        self.assertEqual(supply_data['supply_products'], [])
+
+    @override_settings(CRM_SYNC_PAGE_SIZE=2)
+    def test_one_version_is_split_into_pages(self):
+        products = self.create_products(self.storage, 5)
+        pages, cursor = [], None
+        while True:
+            data = self.sync(cursor)
+            pages.append(self.changed(data))
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([item for page in pages for item in page], [('product', p.id, False) for p in products])
+
+    def test_stale_cursor_resets(self):
+        product = self.create_products(self.storage, 1)[0]
+        version = Company.objects.get(pk=self.company.pk).data_version
+        for cursor in (f'{self.company.id + 1}.0.0.0', f'{self.company.id}.{version + 1}.0.0'):
+            with self.subTest(cursor=cursor):
+                data = self.sync(cursor)
+                self.assertTrue(data['reset'])
+                self.assertEqual(self.changed(data), [('product', product.id, False)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/sync/', {'since': 'abc'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.data)
+
+
+class StockEventTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.products = self.create_products(self.storage, 2)
+        self.other_company = self.create_tenant(inn='210987654321', email='other@example.com')[0]
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def event(self, company, product, quantity):
+        return StockEvent.objects.create(
+            company=company, product_id=product.id, quantity=quantity, created_at=timezone.now(),
+        )
+
+    def test_supply_records_new_quantities(self):
+        first, second = self.products
+        Product.objects.filter(pk=first.pk).update(quantity=10)
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.authenticate(self.user)
+
+        response = self.client.post('/api/supplies/', {'supplier': supplier.id, 'supply_products': [
+            {'product_id': first.id, 'quantity': 3}, {'product_id': second.id, 'quantity': 4},
+            {'product_id': first.id, 'quantity': 2},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(StockEvent.objects.values_list('company_id', 'product_id', 'quantity', 'supply_id')),
+            [(self.company.id, first.id, 15, response.data['id']), (self.company.id, second.id, 4, response.data['id'])],
+        )
+
+    async def collect(self, stream):
+        return [chunk async for chunk in stream]
+
+    async def test_resumes_after_last_event_id(self):
+        seen = await sync_to_async(self.event)(self.company, self.products[0], 5)
+        await sync_to_async(self.event)(self.other_company, self.products[0], 7)
+        missed = await sync_to_async(self.event)(self.company, self.products[1], 9)
+
+        response = await self.async_client.get(
+            '/api/events/stock/', headers={**self.headers, 'Last-Event-ID': str(seen.id)},
+        )
+        chunks = aiter(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+        event = (await anext(chunks)).decode()
+        self.assertTrue(event.startswith(f'id: {missed.id}\nevent: stock\n'))
+        data = json.loads(event.split('data: ')[1])
+        self.assertEqual((data['product_id'], data['quantity'], data['supply_id']), (self.products[1].id, 9, None))
+
+    async def test_unknown_last_event_id_resets(self):
+        event = await sync_to_async(self.event)(self.company, self.products[0], 5)
+        stream = events.stream(self.company.id, event.id + 10)
+        try:
+            self.assertTrue((await anext(stream)).startswith('retry:'))
+            self.assertEqual(await anext(stream), 'event: reset\ndata: {}\n\n')
+        finally:
+            await stream.aclose()
+
+    @override_settings(CRM_STOCK_EVENTS_POLL_INTERVAL=0.01, CRM_STOCK_EVENTS_HEARTBEAT=0.05)
+    async def test_live_events_and_heartbeat(self):
+        stream = events.stream(self.company.id)
+        try:
+            await anext(stream)
+            await sync_to_async(self.event)(self.other_company, self.products[0], 7)
+            own = await sync_to_async(self.event)(self.company, self.products[0], 5)
+
+            self.assertTrue((await anext(stream)).startswith(f'id: {own.id}\n'))
+            self.assertEqual(await anext(stream), ': ping\n\n')
+        finally:
+            await stream.aclose()
+        self.assertFalse(events.broker.running)
+
+    @override_settings(CRM_STOCK_EVENTS_POLL_INTERVAL=0.01, CRM_STOCK_EVENTS_QUEUE_SIZE=1)
+    async def test_slow_subscriber_is_disconnected(self):
+        stream = events.stream(self.company.id)
+        await anext(stream)
+        for quantity in (1, 2):
+            await sync_to_async(self.event)(self.company, self.products[0], quantity)
+        # Клиент не читает, пока опрос раскладывает оба события.
+        await asyncio.sleep(0.1)
+
+        # Очередь переполнена: поток закрывается, клиент догонит по Last-Event-ID.
+        self.assertEqual(await asyncio.wait_for(self.collect(stream), 5), [])
+        self.assertFalse(events.broker.running)
+
+    async def test_authentication_required(self):
+        self.assertEqual((await self.async_client.get('/api/events/stock/')).status_code, 401)
+        response = await self.async_client.get('/api/events/stock/', {'last_event_id': 'x'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_available_under_wsgi(self):
+        response = self.client.get('/api/events/stock/', headers=self.headers)
+
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+    def test_prune_command_deletes_expired_events(self):
+        expired = self.event(self.company, self.products[0], 1)
+        StockEvent.objects.filter(pk=expired.pk).update(created_at=timezone.now() - timedelta(days=2))
+        kept = self.event(self.company, self.products[0], 2)
+        out = io.StringIO()
+
+        call_command('prune_stock_events', stdout=out)
+
+        self.assertEqual(list(StockEvent.objects.values_list('id', flat=True)), [kept.id])
+        self.assertIn('Удалено событий: 1.', out.getvalue())
+
+
+class StockLedgerTests(CrmTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.company, self.storage, self.user = self.create_tenant()
+        self.product, self.other = self.create_products(self.storage, 2)
+        self.supplier = Supplier.objects.create(company=self.company, name='Поставщик', inn='1234567890')
+        self.authenticate(self.user)
+
+    def supply(self, quantity):
+        response = self.client.post('/api/supplies/', {
+            'supplier': self.supplier.id, 'supply_products': [{'product_id': self.product.id, 'quantity': quantity}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response
+
+    def adjust(self, delta, reason=''):
+        return self.client.post(f'/api/products/{self.product.id}/adjust/', {'delta': delta, 'reason': reason})
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('id').values_list('kind', 'delta', 'quantity', 'purchase_price'))
+
+    def stock_at(self, **params):
+        response = self.client.get('/api/stock/at/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_writes_record_movements(self):
+        self.supply(5)
+        response = self.adjust(-2, 'брак')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['quantity'], 3)
+        self.client.patch(f'/api/products/{self.product.id}/', {'title': 'Переименован'})
+        self.client.patch(f'/api/products/{self.product.id}/', {'purchase_price': '12.00'})
+        self.client.delete(f'/api/products/{self.product.id}/')
+
+        self.assertEqual(self.movements(), [
+            (StockMovement.SUPPLY, 5, 5, Decimal('10.00')),
+            (StockMovement.ADJUSTMENT, -2, 3, Decimal('10.00')),
+            (StockMovement.UPDATE, 0, 3, Decimal('12.00')),
+            (StockMovement.REMOVAL, -3, 0, Decimal('12.00')),
+        ])
+        self.assertEqual(StockMovement.objects.get(kind=StockMovement.ADJUSTMENT).reason, 'брак')
+        self.assertEqual(StockEvent.objects.order_by('-id').values_list('quantity', flat=True).first(), 3)
+
+    def test_adjustment_cannot_make_stock_negative(self):
+        self.supply(2)
+
+        response = self.adjust(-3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('delta', response.data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 2)
+        self.assertEqual(StockMovement.objects.count(), 1)
+        self.assertEqual(self.adjust(0).status_code, 400)
+        self.assertEqual(self.client.post('/api/products/999999/adjust/', {'delta': 1}).status_code, 404)
+
+    def test_inventory_at_moment_with_and_without_snapshot(self):
+        now = timezone.now()
+        self.supply(5)
+        StockMovement.objects.update(created_at=now - timedelta(hours=3))
+        self.adjust(-2)
+        StockMovement.objects.filter(kind=StockMovement.ADJUSTMENT).update(created_at=now - timedelta(hours=2))
+        call_command('snapshot_stock', stdout=io.StringIO())
+        StockSnapshot.objects.update(taken_at=now - timedelta(minutes=90))
+        self.client.patch(f'/api/products/{self.product.id}/', {'purchase_price': '12.00'})
+        StockMovement.objects.filter(kind=StockMovement.UPDATE).update(created_at=now - timedelta(hours=1))
+
+        data = self.stock_at(at=(now - timedelta(minutes=150)).isoformat())
+        self.assertIsNone(data['snapshot_at'])
+        self.assertEqual(data['movements_applied'], 1)
+        self.assertEqual(data['products'], [
+            {'product_id': self.product.id, 'quantity': 5, 'purchase_price': Decimal('10.00'), 'value': Decimal('50.00')},
+        ])
+        self.assertEqual(data['total_value'], Decimal('50.00'))
+
+        data = self.stock_at(at=(now - timedelta(minutes=80)).isoformat())
+        self.assertIsNotNone(data['snapshot_at'])
+        self.assertEqual(data['movements_applied'], 0)
+        self.assertEqual(data['total_value'], Decimal('30.00'))
+
+        data = self.stock_at()
+        self.assertEqual(data['movements_applied'], 1)
+        self.assertEqual(data['total_value'], Decimal('36.00'))
+
+        self.assertEqual(self.stock_at(at='2000-01-01')['products'], [])
+        self.assertEqual(self.client.get('/api/stock/at/', {'at': 'вчера'}).status_code, 400)
+
+    def test_snapshot_is_skipped_without_new_movements(self):
+        self.supply(5)
+        self.assertIsNotNone(ledger.take_snapshot(self.storage.id))
+        self.assertIsNone(ledger.take_snapshot(self.storage.id))
+        self.adjust(1)
+        snapshot = ledger.take_snapshot(self.storage.id)
+        self.assertEqual(list(snapshot.lines.values_list('product_id', 'quantity')), [(self.product.id, 6)])
+
+    def test_reconcile_detects_stock_changed_outside_ledger(self):
+        self.supply(5)
+        self.adjust(-1)
+        call_command('snapshot_stock', stdout=io.StringIO())
+        self.supply(2)
+        output = io.StringIO()
+        call_command('reconcile_stock', stdout=output)
+        self.assertIn('Расхождений нет', output.getvalue())
+
+        Product.objects.filter(pk=self.product.pk).update(quantity=99)
+
+        for options in ({}, {'full': True}):
+            with self.subTest(**options), self.assertRaisesMessage(CommandError, 'Расхождений: 1'):
+                call_command('reconcile_stock', stdout=io.StringIO(), **options)
+        self.assertEqual(ledger.reconcile(self.storage.id), [(self.product.id, 99, 6, 6)])
+
+
+def batches(count, size):
+    return -(-count // size)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTests(CrmTestMixin, APITestCase):
+    """Бюджет запросов к базе на каждый маршрут.
+
+    Тесты прогоняются подклассами на 1, 10 и 1000 строк с одними и теми же
+    бюджетами: запрос на строку (N+1) сразу их превысит. Маршруты, которые
+    пишут rows строк из тела запроса, растут только на число пачек.
+    """
+    rows = 1
+
+    def setUp(self):
+        super().setUp()
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        settings_override = override_settings(CRM_JOB_DIR=job_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.company, self.storage, self.user = self.create_tenant()
+        self.products = self.create_products(self.storage, self.rows)
+        self.suppliers = Supplier.objects.bulk_create([
+            Supplier(company=self.company, name=f'Поставщик {i}', inn=f'{7000000000 + i}') for i in range(self.rows)
+        ])
+        supplies = Supply.objects.bulk_create([Supply(company=self.company, supplier=supplier) for supplier in self.suppliers])
+        # В первой поставке все товары, в остальных — по одному.
+        SupplyProduct.objects.bulk_create(
+            [SupplyProduct(supply=supplies[0], product=product, quantity=1) for product in self.products]
+            + [SupplyProduct(supply=supply, product=product, quantity=1)
+               for supply, product in zip(supplies[1:], self.products[1:])]
+        )
+        self.supply = supplies[0]
+        self.login(self.user)
+
+    def login(self, user):
+        # Настоящий JWT, а не force_authenticate: аутентификация входит в бюджет.
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        principal_cache.get_or_resolve(user.pk)
+
+    def assertBudget(self, budget, method, url, data=None, status=200, **kwargs):
+        with self.assertNumQueries(budget):
+            response = getattr(self.client, method)(url, data, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status, url)
+        return response
+
+    def bulk_batches(self, fields, count=None):
+        """Сколько INSERT даст bulk_create count строк (по умолчанию rows) с fields колонками."""
+        count = self.rows if count is None else count
+        return batches(count, connection.ops.bulk_batch_size([None] * fields, [None] * count))
+
+    def csv_upload(self, header, rows):
+        return SimpleUploadedFile('data.csv', '\n'.join([header, *rows]).encode(), 'text/csv')
+
+    def test_auth(self):
+        self.client.credentials()
+        self.assertBudget(1, 'post', '/api/token/', {'email': self.user.email, 'password': 'Secret-pass-123'})
+        self.assertBudget(1, 'post', '/api/token/refresh/', {'refresh': str(RefreshToken.for_user(self.user))})
+        self.assertBudget(3, 'post', '/api/register/', {
+            'email': 'new@example.com', 'username': 'new', 'password': 'Secret-pass-123', 'password2': 'Secret-pass-123',
+        }, status=201)
+
+    def test_company(self):
+        self.assertBudget(1, 'get', '/api/company/detail/')
+        self.assertBudget(2, 'patch', '/api/company/detail/', {'name': 'ООО Новое'})
+        self.login(self.user)
+        self.assertBudget(21, 'delete', '/api/company/detail/', status=204)
+        self.assertFalse(Product.objects.exists())
+
+        self.login(self.user)
+        self.assertBudget(4, 'post', '/api/company/', {'name': 'ООО Заново', 'inn': '210987654321'}, status=201)
+
+    def test_storage(self):
+        self.assertBudget(2, 'get', '/api/storage/detail/')
+        self.assertBudget(3, 'patch', '/api/storage/detail/', {'address': 'Склад 2'})
+        self.assertBudget(13, 'delete', '/api/storage/detail/', status=204)
+        self.assertFalse(SupplyProduct.objects.exists())
+
+        self.login(self.user)
+        self.assertBudget(2, 'post', '/api/storage/', {'address': 'Склад 3'}, status=201)
+
+    def test_suppliers(self):
+        supplier = self.suppliers[0]
+        self.assertBudget(2, 'get', '/api/suppliers/')
+        self.assertBudget(2, 'get', f'/api/suppliers/{supplier.id}/')
+        self.assertBudget(3, 'patch', f'/api/suppliers/{supplier.id}/', {'name': 'Поставщик'})
+        self.assertBudget(1, 'get', '/api/suppliers/export/')
+        created = self.assertBudget(3, 'post', '/api/suppliers/', {'name': 'Новый', 'inn': '6000000000'}, status=201)
+        self.assertBudget(7, 'delete', f"/api/suppliers/{created.data['id']}/", status=204)
+
+        upload = self.csv_upload('name,inn', [f'Импорт {i},{5000000000 + i}' for i in range(self.rows)])
+        self.assertBudget(4 + self.bulk_batches(6), 'post', '/api/suppliers/import/', {'file': upload}, format='multipart')
+        items = [{'name': f'Upsert {i}', 'inn': f'{4000000000 + i}'} for i in range(self.rows)]
+        # На каждую пачку upsert: SAVEPOINT, выборка по ИНН, один INSERT, версия компании, RELEASE.
+        budget = 5 * batches(self.rows, imports.upsert_batch_size())
+        self.assertBudget(budget, 'post', '/api/suppliers/upsert/', items, format='json')
+
+    def test_products(self):
+        product = self.products[0]
+        self.assertBudget(2, 'get', '/api/products/')
+        self.assertBudget(2, 'get', '/api/products/?q=Товар')
+        self.assertBudget(2, 'get', f'/api/products/{product.id}/')
+        self.assertBudget(3, 'patch', f'/api/products/{product.id}/', {'title': 'Товар'})
+        self.assertBudget(1, 'get', '/api/products/export/')
+        self.assertBudget(3, 'post', '/api/products/', {
+            'storage': self.storage.id, 'title': 'Новый', 'purchase_price': '1.00',
+        }, status=201)
+        # Новая цена добавляет движение в журнал.
+        self.assertBudget(4, 'patch', f'/api/products/{product.id}/', {'purchase_price': '11.00'})
+        # Версия, условный UPDATE, движение и событие в транзакции, затем товар для ответа.
+        self.assertBudget(7, 'post', f'/api/products/{product.id}/adjust/', {'delta': 2})
+        self.assertBudget(2, 'get', '/api/stock/at/')
+        self.assertBudget(9, 'delete', f'/api/products/{product.id}/', status=204)
+
+        upload = self.csv_upload('title,purchase_price', [f'Импорт {i},1.00' for i in range(self.rows)])
+        self.assertBudget(3 + self.bulk_batches(6), 'post', '/api/products/import/', {'file': upload}, format='multipart')
+
+    def test_supplies(self):
+        self.assertBudget(3, 'get', '/api/supplies/')
+        response = self.assertBudget(3, 'get', f'/api/supplies/{self.supply.id}/')
+        self.assertEqual(len(response.data['supply_products']), self.rows)
+        self.assertBudget(1, 'get', '/api/supplies/export/')
+
+        lines = [{'product_id': product.id, 'quantity': 1} for product in self.products]
+        # Товары (in_bulk пачками по числу параметров), INSERT строк, UPDATE остатков, движения и события тоже пачками.
+        budget = (
+            5 + batches(self.rows, connection.features.max_query_params)
+            + self.bulk_batches(3) + 3 * batches(self.rows, stock.STOCK_UPDATE_BATCH_SIZE)
+        )
+        self.assertBudget(budget, 'post', '/api/supplies/', {
+            'supplier': self.suppliers[0].id, 'supply_products': lines,
+        }, status=201, format='json')
+
+    def test_async_reads(self):
+        # Те же бюджеты, что у синхронных эндпоинтов: версия для ETag, страница и её связи.
+        budgets = {
+            '/api/async/company/detail/': 1,
+            '/api/async/storage/detail/': 2,
+            '/api/async/suppliers/': 2,
+            f'/api/async/suppliers/{self.suppliers[0].id}/': 2,
+            '/api/async/products/': 2,
+            '/api/async/products/?q=Товар': 2,
+            f'/api/async/products/{self.products[0].id}/': 2,
+            '/api/async/supplies/': 3,
+            f'/api/async/supplies/{self.supply.id}/': 3,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                self.assertBudget(budget, 'get', url)
+
+    def test_attach_user(self):
+        other = User.objects.create_user(email='staff@example.com', username='staff', password='Secret-pass-123')
+        self.assertBudget(2, 'post', '/api/company/attach-user/', {'user_id': other.id})
+
+    def test_jobs(self):
+        response = self.assertBudget(1, 'post', '/api/jobs/', {'kind': jobs.EXPORT_PRODUCTS, 'output': 'csv'}, status=202)
+        jobs.run_pending()
+        self.assertBudget(1, 'get', f"/api/jobs/{response.data['id']}/")
+        self.assertBudget(1, 'get', f"/api/jobs/{response.data['id']}/result/")
+
+    def test_batch(self):
+        # Подзапросы укладываются в свои бюджеты, Principal берётся из кэша; atomic добавляет SAVEPOINT/RELEASE.
+        requests = [
+            {'method': 'GET', 'path': '/api/storage/detail/'},
+            {'method': 'GET', 'path': '/api/products/'},
+            {'method': 'GET', 'path': f'/api/supplies/{self.supply.id}/'},
+        ]
+        self.assertBudget(7, 'post', '/api/batch/', {'requests': requests}, format='json')
+        self.assertBudget(9, 'post', '/api/batch/', {'requests': requests, 'atomic': True}, format='json')
+
+    def test_sync(self):
+        data = {'has_more': True, 'cursor': None}
+        while data['has_more']:
+            data = self.client.get('/api/sync/', {'since': data['cursor']} if data['cursor'] else {}).data
+        cursor = data['cursor']
+        # Версия компании и по запросу ключей на источник, включая надгробия.
+        self.assertBudget(5, 'get', '/api/sync/', {'since': cursor})
+        self.client.patch(f'/api/products/{self.products[0].id}/', {'title': 'Товар'})
+        self.assertBudget(6, 'get', '/api/sync/', {'since': cursor})
+
+    def test_service_routes(self):
+        for url in ('/metrics', '/swagger.json'):
+            with self.subTest(url=url):
+                self.assertBudget(0, 'get', url)
+        # статистика кэша только для staff; отказ тоже без запросов
+        self.assertBudget(0, 'get', '/api/cache/stats/', status=403)
+
+
+class QueryBudget10Tests(QueryBudgetTests):
+    rows = 10
+
+
+class QueryBudget1000Tests(QueryBudgetTests):
+    rows = 1000
@@ -0,0 +1,9 @@
+import re
+
+INN_RE = re.compile(r'^(\d{10}|\d{12})$')
+
+INN_ERROR = "ИНН должен состоять из 10 или 12 цифр."
+
+
+def is_valid_inn(value):
+    return bool(INN_RE.match(value))
@@ -0,0 +1,68 @@
+"""Версия данных компании для условных GET (ETag / Last-Modified) и дельта-синхронизации.
+
+Любая запись в Company, Storage, Supplier, Product или Supply увеличивает
+Company.data_version в той же транзакции, поэтому версия и данные
+становятся видны читателям одновременно. Company и Storage ловятся
+сигналами, Supplier, Product и Supply — в SyncedModel.save(), которая
+помечает строку новой версией (sync_seq, см. crm/sync.py); массовые
+операции (bulk_create, update, удаления) вызывают next_version явно.
+"""
+from django.db import connections, router
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Company, Storage
+
+
+def bump_company_version(company_id):
+    Company.objects.filter(pk=company_id).update(
+        data_version=F('data_version') + 1, data_modified_at=timezone.now(),
+    )
+
+
+def next_version(company_id=None, storage_id=None):
+    """Увеличивает версию компании (по id компании или склада) и возвращает новую.
+
+    Возвращённым значением помечаются записанные строки (sync_seq); вызывать
+    в той же транзакции, что и запись. Где база умеет UPDATE ... RETURNING
+    (SQLite 3.35+, PostgreSQL), это один запрос.
+    """
+    database = router.db_for_write(Company)
+    connection = connections[database]
+    if storage_id is not None:
+        companies = Company.objects.filter(storage__pk=storage_id)
+    else:
+        companies = Company.objects.filter(pk=company_id)
+    if not connection.features.can_return_columns_from_insert:
+        companies.using(database).update(data_version=F('data_version') + 1, data_modified_at=timezone.now())
+        return companies.using(database).values_list('data_version', flat=True).first()
+    quote = connection.ops.quote_name
+    version, modified, pk = (
+        quote(Company._meta.get_field(name).column) for name in ('data_version', 'data_modified_at', 'id')
+    )
+    where_sql, params = companies.using(database).values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {quote(Company._meta.db_table)} SET {version} = {version} + 1, {modified} = %s '
+            f'WHERE {pk} IN ({where_sql}) RETURNING {version}',
+            [connection.ops.adapt_datetimefield_value(timezone.now()), *params],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, **kwargs):
+    bump_company_version(instance.pk)
+
+
+@receiver(post_save, sender=Storage)
+@receiver(post_delete, sender=Storage)
+def company_data_changed(sender, instance, **kwargs):
+    bump_company_version(instance.company_id)
+
+# На post_delete для Product и Supplier намеренно не подписываемся: обработчик
+# отключил бы быстрое каскадное удаление (по UPDATE на каждую строку при
+# удалении компании или склада). Эти удаления вызывают next_version сами.
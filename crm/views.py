@@ -1,18 +1,205 @@
-from rest_framework import generics, permissions
+import hashlib
+from datetime import datetime, time
+from time import perf_counter
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Prefetch
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from rest_framework import generics, mixins, permissions, status
 from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import User, Company, Storage, Supplier, Product, Supply, SupplyProduct
+from . import batch, events, exports, imports, jobs, ledger, metrics, response_cache, sync
+from .deletion import delete_company_contents, delete_storage_contents
+from .versioning import next_version
+from .mappers import ValuesMapper
+from .pagination import SupplierPagination, ProductPagination, SupplyPagination
+from .principal import get_principal, principal_cache
+from .search import SEARCH_ORDERING, search_products
+from .stock import STOCK_UPDATE_BATCH_SIZE, NegativeStock, adjust_stock
+from .models import User, Company, Storage, Supplier, Product, Supply, SupplyProduct, Tombstone, Job, StockMovement
 from .serializers import (
     RegisterSerializer,
     CompanySerializer,
     StorageSerializer,
     SupplierSerializer,
     ProductSerializer,
+    StockAdjustmentSerializer,
     SupplySerializer,
+    SupplierUpsertSerializer,
+    JobSerializer,
+    BatchSerializer,
 )
 
 
+class ConditionalGetMixin:
+    """GET с ETag и Last-Modified по версии данных компании (Company.data_version).
+
+    Версия читается одним запросом по первичному ключу до выборки и
+    сериализации, и при совпадении If-None-Match сразу отдаётся 304.
+    Читается она из той же базы, что и данные, чтобы отстающая реплика
+    не пометила старые данные новой версией. Прочитанная версия остаётся
+    в self.data_version для кэша списков (CachedListMixin).
+
+    aget() — то же для async-представлений (crm/async_views.py): шаги те же,
+    в базу ходят async-варианты методов (aget_version, aget_object, alist).
+    """
+    data_version = None
+
+    def version_queryset(self, company_id):
+        database = router.db_for_read(self.get_serializer_class().Meta.model)
+        return Company.objects.using(database).filter(pk=company_id).values_list('data_version', 'data_modified_at')
+
+    def get_version(self, company_id):
+        return self.version_queryset(company_id).first()
+
+    async def aget_version(self, company_id):
+        return await self.version_queryset(company_id).afirst()
+
+    def get(self, request, *args, **kwargs):
+        company_id = get_principal(request).company_id
+        version = self.get_version(company_id) if company_id is not None else None
+        if version is None:
+            return super().get(request, *args, **kwargs)
+        etag, response = self.check_etag(request, company_id, version)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.tag_response(response, etag, version)
+
+    async def aget(self, request, *args, **kwargs):
+        company_id = get_principal(request).company_id
+        version = await self.aget_version(company_id) if company_id is not None else None
+        if version is None:
+            return await self.aread(request, *args, **kwargs)
+        etag, response = self.check_etag(request, company_id, version)
+        if response is None:
+            response = await self.aread(request, *args, **kwargs)
+        return self.tag_response(response, etag, version)
+
+    def check_etag(self, request, company_id, version):
+        """ETag ответа и готовый 304, если он совпал с If-None-Match."""
+        self.data_version = version
+        # В ETag входят адрес с параметрами и формат: у каждой страницы и представления свой тег.
+        representation = f'{company_id}:{request.get_full_path()}:{request.accepted_media_type}'
+        etag = f'"{version[0]}-{hashlib.md5(representation.encode()).hexdigest()[:16]}"'
+        # Сравнивается только ETag: у If-Modified-Since точность в секунду, и две записи
+        # за одну секунду дали бы ложный 304.
+        return etag, get_conditional_response(request, etag=etag)
+
+    def tag_response(self, response, etag, version):
+        modified_at = version[1]
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if modified_at is not None:
+                response['Last-Modified'] = http_date(modified_at.timestamp())
+        return response
+
+    async def aread(self, request, *args, **kwargs):
+        # Как get() generic-представлений DRF: список или один объект.
+        if isinstance(self, mixins.ListModelMixin):
+            return await self.alist(request, *args, **kwargs)
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = await aget_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+
+class CachedListMixin:
+    """Кэш сериализованных страниц списка по компании, см. crm/response_cache.py.
+
+    Ключ строится по версии данных, которую прочитал ConditionalGetMixin;
+    без неё (нет компании) список собирается заново.
+    """
+    cache_endpoint = None
+
+    def cache_key(self, request):
+        company_id = get_principal(request).company_id
+        version = getattr(self, 'data_version', None)
+        if company_id is None or version is None or not settings.CRM_RESPONSE_CACHE_ALIAS:
+            return None
+        return response_cache.response_key(company_id, self.cache_endpoint, version, request)
+
+    def list(self, request, *args, **kwargs):
+        key = self.cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        data = response_cache.lookup(key, self.cache_endpoint)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'hit'})
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.store(key, response.data)
+        response['X-Cache'] = 'miss'
+        return response
+
+    async def alist(self, request, *args, **kwargs):
+        key = self.cache_key(request)
+        if key is None:
+            return await super().alist(request, *args, **kwargs)
+        data = await response_cache.alookup(key, self.cache_endpoint)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'hit'})
+        response = await super().alist(request, *args, **kwargs)
+        if response.status_code == 200:
+            await response_cache.astore(key, response.data)
+        response['X-Cache'] = 'miss'
+        return response
+
+
+class FastListMixin:
+    """Страницы списка через ValuesMapper (crm/mappers.py) при CRM_FAST_LIST_SERIALIZATION.
+
+    Выдача та же, что у serializer_class, но строки читаются values_list без моделей.
+    alist() — список для async-представлений с тем же выбором сериализации.
+    """
+    list_mapper = None
+
+    def fast_list(self):
+        return settings.CRM_FAST_LIST_SERIALIZATION and self.list_mapper is not None
+
+    def mapped_queryset(self, request, queryset):
+        # Курсор строится из полей сортировки, поэтому они тоже попадают в выборку.
+        ordering = [order.lstrip('-') for order in self.paginator.get_ordering(request, queryset, self)]
+        return self.list_mapper.values(queryset, extra=ordering)
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(self.mapped_queryset(request, queryset))
+        request_metrics = metrics.current()
+        started = perf_counter()
+        data = self.list_mapper.to_representation(page)
+        if request_metrics is not None:
+            request_metrics.serialize_time += perf_counter() - started
+        return self.get_paginated_response(data)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not self.fast_list():
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        page = await self.paginator.apaginate_queryset(self.mapped_queryset(request, queryset), request, view=self)
+        request_metrics = metrics.current()
+        started = perf_counter()
+        data = await self.list_mapper.ato_representation(page)
+        if request_metrics is not None:
+            request_metrics.serialize_time += perf_counter() - started
+        return self.get_paginated_response(data)
+
+
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
@@ -26,37 +213,63 @@ class CompanyCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         user = self.request.user
-        if user.is_company_owner and user.company is not None:
+        principal = get_principal(self.request)
+        if principal.is_company_owner and principal.company_id is not None:
             raise ValidationError("Пользователь уже является владельцем компании.")
         company = serializer.save()
         user.company = company
         user.is_company_owner = True
-        user.save()
+        user.save(update_fields=['company', 'is_company_owner'])
+        principal_cache.invalidate_users(user.pk)
 
 
-class CompanyDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CompanyDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CompanySerializer
     permission_classes = [permissions.IsAuthenticated]
+    fresh_company = None
+
+    def get_version(self, company_id):
+        return self.fresh_version(Company.objects.filter(pk=company_id).first())
+
+    async def aget_version(self, company_id):
+        return self.fresh_version(await Company.objects.filter(pk=company_id).afirst())
+
+    def fresh_version(self, company):
+        # Для GET компания читается целиком вместе с версией: экземпляр из кэша
+        # Principal мог устареть, а ответ должен соответствовать ETag.
+        self.fresh_company = company
+        if company is None:
+            return None
+        return company.data_version, company.data_modified_at
 
     def get_object(self):
         user = self.request.user
-        if user.company is None:
+        if get_principal(self.request).company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
-        return user.company
+        return self.fresh_company or user.company
+
+    async def aget_object(self):
+        return self.get_object()
 
     def perform_update(self, serializer):
-        if not self.request.user.is_company_owner:
+        if not get_principal(self.request).is_company_owner:
             raise ValidationError("Только владелец компании может редактировать данные.")
         serializer.save()
+        principal_cache.invalidate_company(serializer.instance.pk)
 
     def perform_destroy(self, instance):
         user = self.request.user
-        if not user.is_company_owner:
+        if not get_principal(self.request).is_company_owner:
             raise ValidationError("Только владелец компании может удалить компанию.")
-        user.company = None
-        user.is_company_owner = False
-        user.save()
-        instance.delete()
+        company_id = instance.pk
+        with transaction.atomic():
+            user.company = None
+            user.is_company_owner = False
+            user.save(update_fields=['company', 'is_company_owner'])
+            delete_company_contents(company_id)
+            instance.delete()
+        principal_cache.invalidate_company(company_id)
+        principal_cache.invalidate_users(user.pk)
 
 
 class StorageCreateView(generics.CreateAPIView):
@@ -65,134 +278,244 @@ class StorageCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         user = self.request.user
-        if not user.is_company_owner:
+        principal = get_principal(self.request)
+        if not principal.is_company_owner:
             raise ValidationError("Только владелец компании может создавать склад.")
-        if user.company is None:
+        if principal.company_id is None:
             raise ValidationError("Пользователь не привязан к компании, склад создать нельзя.")
-        if hasattr(user.company, 'storage'):
+        if principal.storage_id is not None:
             raise ValidationError("У компании уже есть склад.")
         serializer.save(company=user.company)
+        principal_cache.invalidate_company(principal.company_id)
 
 
-class StorageDetailView(generics.RetrieveUpdateDestroyAPIView):
+class StorageDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = StorageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self):
-        user = self.request.user
-        if user.company is None:
+    def storage_queryset(self):
+        principal = get_principal(self.request)
+        if principal.company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
-        if not hasattr(user.company, 'storage'):
+        if principal.storage_id is None:
             raise ValidationError("У компании нет склада.")
-        return user.company.storage
+        return Storage.objects.filter(pk=principal.storage_id)
+
+    def found_storage(self, storage):
+        if storage is None:
+            principal_cache.invalidate_company(get_principal(self.request).company_id)
+            raise ValidationError("У компании нет склада.")
+        return storage
+
+    def get_object(self):
+        return self.found_storage(self.storage_queryset().first())
+
+    async def aget_object(self):
+        return self.found_storage(await self.storage_queryset().afirst())
 
     def perform_update(self, serializer):
-        user = self.request.user
-        if not user.is_company_owner:
+        if not get_principal(self.request).is_company_owner:
             raise ValidationError("Только владелец компании может редактировать склад.")
         serializer.save()
 
     def perform_destroy(self, instance):
-        user = self.request.user
-        if not user.is_company_owner:
+        if not get_principal(self.request).is_company_owner:
             raise ValidationError("Только владелец компании может удалить склад.")
-        instance.delete()
+        with transaction.atomic():
+            delete_storage_contents(instance.pk, instance.company_id, next_version(company_id=instance.company_id))
+            instance.delete()
+        principal_cache.invalidate_company(instance.company_id)
 
 
-class SupplierListCreateView(generics.ListCreateAPIView):
+class SupplierListCreateView(ConditionalGetMixin, CachedListMixin, FastListMixin, generics.ListCreateAPIView):
     serializer_class = SupplierSerializer
+    list_mapper = ValuesMapper(SupplierSerializer)
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SupplierPagination
+    cache_endpoint = response_cache.SUPPLIERS
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Supplier.objects.none()
-        user = self.request.user
-        if user is None or user.company is None:
+        principal = get_principal(self.request)
+        if principal is None or principal.company_id is None:
             return Supplier.objects.none()
-        return Supplier.objects.filter(company=user.company)
+        return Supplier.objects.filter(company_id=principal.company_id)
 
     def perform_create(self, serializer):
-        user = self.request.user
-        if user.company is None:
+        if get_principal(self.request).company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
-        serializer.save(company=user.company)
+        serializer.save(company=self.request.user.company)
 
 
-class SupplierRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class SupplierRetrieveUpdateDestroyView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = SupplierSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Supplier.objects.none()
-        user = self.request.user
-        if user is None or user.company is None:
+        principal = get_principal(self.request)
+        if principal is None or principal.company_id is None:
             return Supplier.objects.none()
-        return Supplier.objects.filter(company=user.company)
+        return Supplier.objects.filter(company_id=principal.company_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            sync.record_deletion(
+                Tombstone.SUPPLIER, instance.company_id, instance.pk, next_version(company_id=instance.company_id),
+            )
+            instance.delete()
+
+
+class SupplierUpsertView(APIView):
+    """Пакетный upsert поставщиков по ИНН: POST со списком {name, inn, contact_info}."""
+    permission_classes = [permissions.IsAuthenticated]
 
+    def post(self, request):
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        limit = settings.CRM_SUPPLIER_UPSERT_MAX_ITEMS
+        if isinstance(request.data, list) and len(request.data) > limit:
+            raise ValidationError(f"В запросе не больше {limit} поставщиков.")
+        serializer = SupplierUpsertSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        return Response(imports.upsert_suppliers(serializer.validated_data, principal))
 
-class ProductListCreateView(generics.ListCreateAPIView):
+
+class ProductListCreateView(ConditionalGetMixin, CachedListMixin, FastListMixin, generics.ListCreateAPIView):
     serializer_class = ProductSerializer
+    list_mapper = ValuesMapper(ProductSerializer)
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductPagination
+    cache_endpoint = response_cache.PRODUCTS
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Product.objects.none()
-        user = self.request.user
-        if user is None or user.company is None:
+        principal = get_principal(self.request)
+        if principal is None or principal.storage_id is None:
             return Product.objects.none()
-        return Product.objects.filter(storage__company=user.company)
+        queryset = Product.objects.filter(storage_id=principal.storage_id)
+        query = self.request.query_params.get('q')
+        if query is not None:
+            queryset = search_products(queryset, query, principal.storage_id)
+        return queryset
+
+    def get_keyset_ordering(self):
+        if 'q' in self.request.query_params:
+            return SEARCH_ORDERING
+        return None
 
     def perform_create(self, serializer):
-        user = self.request.user
-        if user.company is None:
+        if get_principal(self.request).company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
         serializer.save(quantity=0)
 
 
-class ProductRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class ProductRetrieveUpdateDestroyView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Product.objects.none()
-        user = self.request.user
-        if user is None or user.company is None:
+        principal = get_principal(self.request)
+        if principal is None or principal.storage_id is None:
             return Product.objects.none()
-        return Product.objects.filter(storage__company=user.company)
+        return Product.objects.filter(storage_id=principal.storage_id)
 
     def perform_update(self, serializer):
-        user = self.request.user
-        if user.company is None:
+        if get_principal(self.request).company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
         serializer.save()
 
+    def perform_destroy(self, instance):
+        company_id = get_principal(self.request).company_id
+        with transaction.atomic():
+            seq = next_version(storage_id=instance.storage_id)
+            sync.record_deletion(Tombstone.PRODUCT, company_id, instance.pk, seq)
+            # Строки поставок с товаром удаляются каскадом, поставки меняются.
+            sync.touch(Supply.objects.filter(supply_products__product=instance), seq)
+            ledger.record_removal(Product.objects.filter(pk=instance.pk))
+            instance.delete()
+
+
+class ProductAdjustView(APIView):
+    """Ручная корректировка остатка товара (инвентаризация, списание): {"delta": -3, "reason": "брак"}.
+
+    Изменение попадает в журнал движений (crm/ledger.py), в /api/sync/ и в поток остатков.
+    """
+    permission_classes = [permissions.IsAuthenticated]
 
-class SupplyListCreateView(generics.ListCreateAPIView):
+    def post(self, request, pk):
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        serializer = StockAdjustmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        delta, reason = serializer.validated_data['delta'], serializer.validated_data['reason']
+        products = Product.objects.filter(pk=pk, storage_id=principal.storage_id)
+        try:
+            with transaction.atomic():
+                seq = next_version(company_id=principal.company_id)
+                if not adjust_stock(products, delta, seq):
+                    raise Http404
+                ledger.record_increments({pk: delta}, StockMovement.ADJUSTMENT, STOCK_UPDATE_BATCH_SIZE, reason=reason)
+                events.record_stock_changes(principal.company_id, [pk], None, STOCK_UPDATE_BATCH_SIZE)
+                transaction.on_commit(events.broker.notify)
+        except NegativeStock:
+            raise ValidationError({'delta': ["Остаток не может стать отрицательным."]})
+        return Response(ProductSerializer(products.get()).data)
+
+
+def supplies_with_lines(queryset):
+    # Строки поставки и их товары подгружаются двумя запросами на всю выборку.
+    return queryset.prefetch_related(
+        Prefetch('supply_products', queryset=SupplyProduct.objects.select_related('product').order_by('id'))
+    )
+
+
+class SupplyListCreateView(ConditionalGetMixin, CachedListMixin, FastListMixin, generics.ListCreateAPIView):
     serializer_class = SupplySerializer
+    list_mapper = ValuesMapper(SupplySerializer)
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SupplyPagination
+    cache_endpoint = response_cache.SUPPLIES
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Supply.objects.none()
-        user = self.request.user
-        if user is None or user.company is None:
+        principal = get_principal(self.request)
+        if principal is None or principal.company_id is None:
             return Supply.objects.none()
-        return Supply.objects.filter(company=user.company)
+        return supplies_with_lines(Supply.objects.filter(company_id=principal.company_id))
 
     def perform_create(self, serializer):
-        user = self.request.user
-        if user.company is None:
+        if get_principal(self.request).company_id is None:
             raise ValidationError("Пользователь не привязан к компании.")
-        serializer.save(company=user.company)
+        serializer.save(company=self.request.user.company)
+
+
+class SupplyRetrieveView(ConditionalGetMixin, generics.RetrieveAPIView):
+    serializer_class = SupplySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Supply.objects.none()
+        principal = get_principal(self.request)
+        if principal is None or principal.company_id is None:
+            return Supply.objects.none()
+        return supplies_with_lines(Supply.objects.filter(company_id=principal.company_id))
 
 
 class AttachUserToCompanyView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        owner = request.user
+        owner = get_principal(request)
         if not owner.is_company_owner:
             return Response({"detail": "Только владелец компании может прикреплять пользователей."}, status=403)
 
@@ -205,10 +528,293 @@ class AttachUserToCompanyView(APIView):
         except User.DoesNotExist:
             return Response({"detail": "Пользователь не найден."}, status=404)
 
-        if user_to_attach.company == owner.company:
+        if user_to_attach.company_id == owner.company_id:
             return Response({"detail": "Пользователь уже прикреплён к вашей компании."}, status=400)
 
-        user_to_attach.company = owner.company
-        user_to_attach.save()
+        user_to_attach.company_id = owner.company_id
+        user_to_attach.save(update_fields=['company'])
+        principal_cache.invalidate_users(user_to_attach.pk)
 
         return Response({"detail": f"Пользователь {user_to_attach.email} успешно прикреплён к компании."})
+
+
+def job_accepted(request, job):
+    """Ответ 202 на поставленную в очередь задачу; статус опрашивается по Location."""
+    serializer = JobSerializer(job, context={'request': request})
+    location = request.build_absolute_uri(reverse('job_detail', args=[job.pk]))
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
+def wants_background(request):
+    return request.query_params.get('async') in ('1', 'true')
+
+
+class ExportView(APIView):
+    """Потоковая выгрузка CSV/NDJSON: ?output=csv (по умолчанию) или ?output=ndjson.
+
+    С ?async=1 выгрузка ставится в очередь фоновых задач и сразу отдаётся 202.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    filename = None
+    job_kind = None
+
+    def get_rows(self, principal):
+        raise NotImplementedError
+
+    def perform_content_negotiation(self, request, force=False):
+        # Ответ — не DRF Response, поэтому Accept: text/csv не должен давать 406.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        output = request.query_params.get('output', exports.CSV)
+        if output not in exports.CONTENT_TYPES:
+            raise ValidationError("Формат выгрузки должен быть csv или ndjson.")
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        columns, rows = self.get_rows(principal)
+        if wants_background(request):
+            return job_accepted(request, jobs.submit_job(self.job_kind, principal, {'output': output}))
+        response = StreamingHttpResponse(
+            exports.stream_rows(columns, rows, output), content_type=exports.CONTENT_TYPES[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.filename}.{output}"'
+        return response
+
+
+class ProductExportView(ExportView):
+    filename = 'products'
+    job_kind = jobs.EXPORT_PRODUCTS
+
+    def get_rows(self, principal):
+        if principal.storage_id is None:
+            raise ValidationError("У компании нет склада.")
+        return exports.product_rows(principal.storage_id)
+
+
+class SupplierExportView(ExportView):
+    filename = 'suppliers'
+    job_kind = jobs.EXPORT_SUPPLIERS
+
+    def get_rows(self, principal):
+        return exports.supplier_rows(principal.company_id)
+
+
+class SupplyExportView(ExportView):
+    filename = 'supplies'
+    job_kind = jobs.EXPORT_SUPPLIES
+
+    def get_rows(self, principal):
+        return exports.supply_line_rows(principal.company_id)
+
+
+class ImportView(APIView):
+    """Импорт CSV-файла из поля file (multipart) с построчным отчётом об ошибках.
+
+    С ?async=1 файл сохраняется, импорт выполняет runworkers, ответ — 202.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+    job_kind = None
+
+    def run_import(self, uploaded_file, principal):
+        raise NotImplementedError
+
+    def check_principal(self, principal):
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+
+    def post(self, request):
+        uploaded_file = request.FILES.get('file')
+        if uploaded_file is None:
+            raise ValidationError("Необходимо передать CSV-файл в поле file.")
+        principal = get_principal(request)
+        self.check_principal(principal)
+        if wants_background(request):
+            return job_accepted(request, jobs.submit_job(self.job_kind, principal, upload=uploaded_file))
+        try:
+            report = self.run_import(uploaded_file, principal)
+        except imports.CsvImportError as exc:
+            raise ValidationError(str(exc))
+        return Response(report.as_dict())
+
+
+class ProductImportView(ImportView):
+    job_kind = jobs.IMPORT_PRODUCTS
+
+    def check_principal(self, principal):
+        super().check_principal(principal)
+        if principal.storage_id is None:
+            raise ValidationError("У компании нет склада.")
+
+    def run_import(self, uploaded_file, principal):
+        return imports.import_products(uploaded_file, principal)
+
+
+class SupplierImportView(ImportView):
+    job_kind = jobs.IMPORT_SUPPLIERS
+
+    def run_import(self, uploaded_file, principal):
+        return imports.import_suppliers(uploaded_file, principal)
+
+
+class JobCreateView(APIView):
+    """Постановка фоновой задачи: kind, для выгрузок output, для импорта файл в поле file."""
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
+
+    def post(self, request):
+        kind = request.data.get('kind')
+        if kind not in jobs.job_kinds():
+            raise ValidationError({'kind': [f"Допустимые значения: {', '.join(jobs.job_kinds())}."]})
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        if kind in (jobs.EXPORT_PRODUCTS, jobs.IMPORT_PRODUCTS) and principal.storage_id is None:
+            raise ValidationError("У компании нет склада.")
+
+        params, upload = {}, None
+        if kind in (jobs.IMPORT_PRODUCTS, jobs.IMPORT_SUPPLIERS):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError("Необходимо передать CSV-файл в поле file.")
+        else:
+            params['output'] = request.data.get('output', exports.CSV)
+            if params['output'] not in exports.CONTENT_TYPES:
+                raise ValidationError("Формат выгрузки должен быть csv или ndjson.")
+        return job_accepted(request, jobs.submit_job(kind, principal, params, upload=upload))
+
+
+class JobDetailView(generics.RetrieveAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Job.objects.none()
+        return Job.objects.filter(company_id=get_principal(self.request).company_id)
+
+
+class JobResultView(JobDetailView):
+    """Файл результата выгрузки, когда задача выполнена."""
+
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(request, force=True)
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.status != Job.SUCCEEDED or not job.result_file:
+            raise Http404
+        try:
+            result = open(jobs.job_path(job.result_file), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        output = job.params.get('output', exports.CSV)
+        return FileResponse(
+            result,
+            as_attachment=True,
+            filename=job.result_file,
+            content_type=exports.CONTENT_TYPES[output],
+        )
+
+
+class ResponseCacheStatsView(APIView):
+    """Попадания и промахи кэша списков в этом процессе; статистика общая для всех компаний, поэтому только для staff."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache.stats.as_dict())
+
+
+class BatchView(APIView):
+    """Пакет подзапросов к API за один запрос, при atomic — в одной транзакции (crm/batch.py).
+
+    Тело: {"atomic": false, "requests": [{"method": "POST", "path": "/api/suppliers/", "body": {...}}, ...]};
+    в path и body можно ссылаться на ответы предыдущих подзапросов: "$0.id".
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        runner = batch.BatchRunner(request, BatchView)
+        return Response(runner.run(serializer.validated_data['requests'], serializer.validated_data['atomic']))
+
+
+class SyncView(APIView):
+    """Дельта-синхронизация товаров, поставщиков и поставок (crm/sync.py).
+
+    GET /api/sync/ — всё с начала, дальше ?since=<cursor> из предыдущего ответа,
+    пока has_more. Удалённые строки приходят с deleted: true, reset: true —
+    курсор устарел, локальные данные нужно заменить выгрузкой.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        products = Product.objects.filter(storage_id=principal.storage_id)
+        if principal.storage_id is None:
+            products = Product.objects.none()
+        sources = [
+            sync.Source(Tombstone.PRODUCT, products, ProductSerializer),
+            sync.Source(Tombstone.SUPPLIER, Supplier.objects.filter(company_id=principal.company_id), SupplierSerializer),
+            sync.Source(
+                Tombstone.SUPPLY, supplies_with_lines(Supply.objects.filter(company_id=principal.company_id)),
+                SupplySerializer,
+            ),
+        ]
+        try:
+            page = sync.changes(
+                principal, sources, request.query_params.get('since'), settings.CRM_SYNC_PAGE_SIZE,
+                context={'request': request},
+            )
+        except sync.InvalidCursor:
+            raise ValidationError({'since': ["Некорректный курсор."]})
+        return Response(page)
+
+
+class StockAtView(APIView):
+    """Остатки склада и их стоимость на момент времени по журналу движений (crm/ledger.py).
+
+    GET /api/stock/at/?at=2024-05-01T12:00:00 (или дата — на её начало; без at — сейчас).
+    Стоимость считается по закупочной цене, действовавшей на тот же момент.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        principal = get_principal(request)
+        if principal.company_id is None:
+            raise ValidationError("Пользователь не привязан к компании.")
+        if principal.storage_id is None:
+            raise ValidationError("У компании нет склада.")
+        moment = timezone.now()
+        value = request.query_params.get('at')
+        if value is not None:
+            moment = self.parse_moment(value)
+        snapshot, applied, state = ledger.inventory_at(principal.storage_id, moment)
+        items, total = ledger.valuation(state)
+        return Response({
+            'at': moment,
+            'snapshot_at': snapshot.taken_at if snapshot is not None else None,
+            'movements_applied': applied,
+            'total_value': total,
+            'products': items,
+        })
+
+    @staticmethod
+    def parse_moment(value):
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = day and datetime.combine(day, time.min)
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({'at': ["Некорректная дата или время."]})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment